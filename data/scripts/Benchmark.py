@@ -0,0 +1,1625 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------- #
+#           The HMM-Based Speech Synthesis System (HTS)             #
+#           developed by HTS Working Group                          #
+#           http://hts.sp.nitech.ac.jp/                             #
+# ----------------------------------------------------------------- #
+#                                                                   #
+#  Copyright (c) 2014-2017  Nagoya Institute of Technology          #
+#                           Department of Computer Science          #
+#                                                                   #
+# All rights reserved.                                              #
+#                                                                   #
+# Redistribution and use in source and binary forms, with or        #
+# without modification, are permitted provided that the following   #
+# conditions are met:                                               #
+#                                                                   #
+# - Redistributions of source code must retain the above copyright  #
+#   notice, this list of conditions and the following disclaimer.   #
+# - Redistributions in binary form must reproduce the above         #
+#   copyright notice, this list of conditions and the following     #
+#   disclaimer in the documentation and/or other materials provided #
+#   with the distribution.                                          #
+# - Neither the name of the HTS working group nor the names of its  #
+#   contributors may be used to endorse or promote products derived #
+#   from this software without specific prior written permission.   #
+#                                                                   #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND            #
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,       #
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF          #
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE          #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS #
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,          #
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED   #
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,     #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON #
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,   #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY    #
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE           #
+# POSSIBILITY OF SUCH DAMAGE.                                       #
+# ----------------------------------------------------------------- #
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+
+from six.moves import xrange
+
+
+def time_function(function, num_repeats):
+    durations = []
+    for _ in xrange(num_repeats):
+        start_time = time.time()
+        function()
+        durations.append(time.time() - start_time)
+    return min(durations)
+
+
+def print_table(header, rows):
+    print('  %-28s' % header[0] + ''.join('%14s' % h for h in header[1:]))
+    for row in rows:
+        print('  %-28s' % row[0] + ''.join('%14s' % r for r in row[1:]))
+    print()
+
+
+# Reference implementations copied from the scripts before optimization
+def legacy_load_binary_data(filename, num_dimensions=1, read_size=4):
+    data = []
+    with open(filename.rstrip(), 'rb') as f:
+        packed_data = f.read(read_size)
+        while len(packed_data) == read_size:
+            data.extend(struct.unpack('f', packed_data))
+            packed_data = f.read(read_size)
+
+    return np.reshape(np.asarray(data), [-1, num_dimensions])
+
+
+def legacy_sopr_log(arr):
+    ret = []
+    for i in range(0, len(arr)):
+        t = []
+        for j in range(0, len(arr[i])):
+            if arr[i][j] <= 0:
+                t.append(1e-8)
+            else:
+                t.append(np.log(arr[i][j]))
+        ret.append(t)
+    return ret
+
+
+def legacy_sopr_exp(arr):
+    ret = []
+    for i in range(0, len(arr)):
+        s = []
+        for j in range(0, len(arr[i])):
+            t = np.exp(arr[i][j])
+            if t < 1:
+                t = 0
+            s.append(t)
+        ret.append(s)
+    return ret
+
+
+def legacy_get_vibrate(f0):
+    length = len(f0)
+    if length <= 2:
+        return
+    vib = [[0, 0] for _ in range(0, length)]
+    if f0[0] < 0:
+        positive = False
+    else:
+        positive = True
+
+    interPoints = []
+    for i in range(0, length):
+        if(positive and f0[i] <= 0):
+            interPoints.append(i)
+            positive = False
+        elif(not positive and f0[i] >= 0):
+            interPoints.append(i)
+            positive = True
+    peak = 0
+    period = 0
+    for i in range(0, len(interPoints) - 1):
+        start = interPoints[i]
+        end = interPoints[i + 1]
+        t = abs(f0[start:end])
+        peak = max(t)
+        if(peak < 5):
+            continue
+        period = end - start / 2
+        for j in range(start, end):
+            vib.append([peak, period])
+    for i in range(interPoints[-1], length):
+        vib.append([peak, period])
+    return vib
+
+
+def legacy_voiced_segments(f0, start, end):
+    segments = []
+    j = start
+    while j < end:
+        ostart = j
+        oend = 0
+        firstTime = True
+        while j < end:
+            if firstTime and f0[j] >= 55.0:
+                ostart = j
+                firstTime = False
+            elif not firstTime and f0[j] < 55.0:
+                oend = j
+                break
+            j += 1
+        if oend == 0:
+            continue
+        segments.append((ostart, oend))
+    return segments
+
+
+def legacy_extract(lf0, vib, mono, full, framePeriod):
+    import math
+    import re
+    from progressbar import Bar, Percentage, ProgressBar
+    from statsmodels.nonparametric.smoothers_lowess import lowess
+
+    def loadVector(filename, width, typeStr):
+        fsize = os.path.getsize(filename)
+        file = open(filename, 'rb')
+        ret = []
+        oneByte = 4
+        if(typeStr == 'd'):
+            oneByte = 8
+        length = math.floor(fsize / width / oneByte)
+        for i in range(0, length):
+            t = file.read(width * oneByte)
+            ret.append(struct.unpack(typeStr * width, t))
+        file.close()
+        return ret
+
+    def saveVector(filename, vector, typeStr):
+        file = open(filename, 'wb')
+        for column in vector:
+            if(not isinstance(column, list)):
+                file.write(struct.pack(typeStr, column))
+            else:
+                for one in column:
+                    file.write(struct.pack(typeStr, one))
+        file.close()
+
+    def loadLabel(mono, full):
+        monoLines = open(mono, 'r').read().split('\n')
+        fullLines = open(full, 'r').read().split('\n')
+        ret = []
+        for i in range(0, len(monoLines)):
+            if(monoLines[i] == '' or fullLines[i] == ''):
+                continue
+            monoData = monoLines[i].split(' ')
+            fullData = fullLines[i].split(' ')
+            monoData[0] = float(monoData[0]) / 10e3
+            monoData[1] = float(monoData[1]) / 10e3
+            ret.append([monoData[0], monoData[1], monoData[2], fullData[2]])
+        return ret
+
+    def getNotePitch(note):
+        scaList = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
+        scale = scaList.index(note[0:-1]) - 9
+        octave = int(note[-1:]) - 4
+        return 440 * pow(2.0, octave) * pow(2.0, scale / 12.0)
+
+    f0 = legacy_sopr_exp(loadVector(lf0, 1, 'f'))
+
+    fLen = len(f0)
+    df0 = [[0, 0] for _ in range(0, fLen)]
+    df02 = [0] * fLen
+    label = loadLabel(mono, full)
+    vibrate = [[0, 0] for _ in range(0, fLen)]
+    lLen = len(label)
+
+    widgets = ['Extract VIB: ', Percentage(), ' ', Bar('#'), ' ']
+    pbar = ProgressBar(widgets=widgets).start()
+    for i in range(0, lLen):
+        pbar.update((i / lLen) * 100)
+        start = max(math.floor(label[i][0] / framePeriod), 0)
+        end = min(math.floor(label[i][1] / framePeriod), fLen)
+        notePitch = re.findall(r'/E:\w+\]', label[i][3])[0]
+        notePitch = notePitch.replace('/E:', '').replace(']', '')
+        basePitch = 0
+        if(notePitch != 'xx'):
+            basePitch = getNotePitch(notePitch)
+        for j in range(start, end):
+            t = f0[j][0] - basePitch + 500
+            if t <= 0:
+                t = -1
+            df0[j][0] = f0[j][0]
+            if(f0[j][0] < 55.0):
+                df0[j][1] = 0
+                df02[j] = 0
+            else:
+                df0[j][1] = t
+                df02[j] = f0[j][0] - basePitch
+        j = start
+        while j < end:
+            ostart = j
+            oend = 0
+            firstTime = True
+            while j < end:
+                if firstTime and f0[j][0] >= 55.0:
+                    ostart = j
+                    firstTime = False
+                elif not firstTime and f0[j][0] < 55.0:
+                    oend = j
+                    break
+                j += 1
+            if oend == 0:
+                continue
+            if(oend - ostart > 20):
+                pf0 = np.array(df02[ostart:oend])
+                keys = range(0, len(pf0))
+                s = lowess(pf0, keys, it=20, delta=0.0)
+                pf0 = pf0 - s[:, 1]
+                t = legacy_get_vibrate(pf0)
+                for k in range(0, len(t)):
+                    vibrate[ostart + k][0] = t[k][0]
+                    vibrate[ostart + k][1] = t[k][1]
+    saveVector(lf0, legacy_sopr_log(df0), 'f')
+    saveVector(vib, legacy_sopr_log(vibrate), 'f')
+    pbar.finish()
+
+
+def benchmark_io(args):
+    import DNNDataIO
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(work_dir, 'bench.ffi')
+        data = np.random.randn(args.num_frames, args.num_dimensions)
+        data.astype(np.float32).tofile(filename)
+
+        legacy = legacy_load_binary_data(filename, args.num_dimensions)
+        mapped = DNNDataIO.load_binary_data(filename, args.num_dimensions)
+        assert mapped.shape == legacy.shape
+        assert np.array_equal(np.asarray(mapped, np.float64), legacy)
+
+        half = args.num_frames // 2
+        window = DNNDataIO.load_binary_data(
+            filename, args.num_dimensions, start=half, num_frames=100)
+        assert np.array_equal(window, mapped[half:half + 100])
+
+        rows = []
+        legacy_time = time_function(
+            lambda: legacy_load_binary_data(filename, args.num_dimensions),
+            args.num_repeats)
+        rows.append(['struct.unpack loop', '%.4f' % legacy_time, '1.0x'])
+        # Touch every element so that the lazy mapping is actually read
+        mapped_time = time_function(
+            lambda: np.sum(DNNDataIO.load_binary_data(
+                filename, args.num_dimensions)),
+            args.num_repeats)
+        rows.append(['np.memmap (full read)', '%.4f' % mapped_time,
+                     '%.1fx' % (legacy_time / mapped_time)])
+        slice_time = time_function(
+            lambda: np.sum(DNNDataIO.load_binary_data(
+                filename, args.num_dimensions, start=half, num_frames=100)),
+            args.num_repeats)
+        rows.append(['np.memmap (100 frames)', '%.4f' % slice_time,
+                     '%.1fx' % (legacy_time / slice_time)])
+
+        print('load_binary_data: %d frames x %d dimensions' %
+              (args.num_frames, args.num_dimensions))
+        print_table(['Reader', 'Time [sec]', 'Speedup'], rows)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def make_window_vector(num_feature_dimensions, windows):
+    # Same layout as the window vector built in DNNTraining.py
+    num_windows = len(windows)
+    window_width = len(windows[0])
+    window_vector = []
+    for i in xrange(len(num_feature_dimensions)):
+        for j in xrange(window_width - 1, -1, -1):
+            for k in xrange(num_windows):
+                window_vector.append(windows[k][j])
+    window_vector = np.reshape(window_vector, [len(num_feature_dimensions), -1])
+    window_vector = np.repeat(window_vector, num_feature_dimensions, axis=0)
+    return window_vector.astype(np.float32)
+
+
+def run_mlpg(args):
+    import resource
+    import tensorflow as tf
+    import DNNDefine
+
+    windows = [[0.0, 1.0, 0.0], [-0.5, 0.0, 0.5], [1.0, -2.0, 1.0]]
+    num_feature_dimensions = [args.num_dimensions, 1, 1]
+    msd_flags = [0, 1, 1]
+    num_windows = len(windows)
+    window_vector = make_window_vector(num_feature_dimensions, windows)
+    num_outputs = num_windows * sum(num_feature_dimensions) + sum(msd_flags)
+
+    num_frames = args.frames[0]
+    rng = np.random.RandomState(0)
+    feed_values = [
+        rng.randn(num_frames, num_outputs),
+        rng.randn(num_frames, num_outputs),
+        rng.uniform(0.5, 1.5, [1, num_outputs]),
+        rng.uniform(0.5, 1.5, [1, sum(num_feature_dimensions)])]
+
+    with tf.Graph().as_default():
+        # Placeholders keep the graph from being folded into constants
+        placeholders = [tf.placeholder(tf.float32, shape=x.shape)
+                        for x in feed_values]
+        predicted_outputs, observed_outputs, variances, gv_variances = placeholders
+        cost, outputs = DNNDefine.trajectory_cost(
+            predicted_outputs, observed_outputs, variances, gv_variances,
+            num_feature_dimensions, msd_flags, num_windows, window_vector,
+            solver=args.solver)
+        gradients = tf.gradients(cost, [predicted_outputs, variances])
+        fetches = [cost, outputs] + gradients
+        feed_dict = dict(zip(placeholders, feed_values))
+
+        with tf.Session() as sess:
+            sess.run(fetches, feed_dict=feed_dict)
+            duration = time_function(
+                lambda: sess.run(fetches, feed_dict=feed_dict),
+                args.num_repeats)
+            value = sess.run(cost, feed_dict=feed_dict)
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print('%f %f %f' % (duration, peak_rss, value))
+
+
+def benchmark_mlpg(args):
+    if args.child:
+        run_mlpg(args)
+        return
+
+    # Every measurement runs in its own process so that the peak RSS of
+    # one solver does not hide that of the other.
+    rows = []
+    for num_frames in args.frames:
+        for solver in ['dense', 'banded']:
+            command = [sys.executable, os.path.abspath(__file__), 'mlpg',
+                       '--child', '-s', solver, '-T', str(num_frames),
+                       '-D', str(args.num_dimensions),
+                       '-r', str(args.num_repeats)]
+            try:
+                output = subprocess.check_output(command)
+                duration, peak_rss, value = [
+                    float(x) for x in output.split()[-3:]]
+                rows.append(['%s (T=%d)' % (solver, num_frames),
+                             '%.3f' % duration, '%.0f' % peak_rss,
+                             '%.6e' % value])
+            except subprocess.CalledProcessError:
+                rows.append(['%s (T=%d)' % (solver, num_frames),
+                             'failed', '-', '-'])
+
+    print('trajectory_cost + gradients: %d static dimensions' %
+          (args.num_dimensions + 2))
+    print_table(['Solver', 'Time [sec]', 'Peak RSS [MB]', 'Cost'], rows)
+
+
+def build_generation_graph(num_dimensions):
+    import tensorflow as tf
+    import DNNDefine
+
+    windows = [[0.0, 1.0, 0.0], [-0.5, 0.0, 0.5], [1.0, -2.0, 1.0]]
+    num_feature_dimensions = [num_dimensions, 1, 1]
+    msd_flags = [0, 1, 1]
+    num_windows = len(windows)
+    window_vector = make_window_vector(num_feature_dimensions, windows)
+    num_outputs = num_windows * sum(num_feature_dimensions) + sum(msd_flags)
+
+    rng = np.random.RandomState(0)
+    predicted_outputs = tf.placeholder(tf.float32, shape=[None, num_outputs])
+    variances = tf.constant(
+        rng.uniform(0.5, 1.5, [1, num_outputs]).astype(np.float32))
+    gv_variances = tf.constant(
+        rng.uniform(0.5, 1.5, [1, sum(num_feature_dimensions)]).astype(np.float32))
+    _, outputs = DNNDefine.trajectory_cost(
+        predicted_outputs, tf.zeros_like(predicted_outputs), variances,
+        gv_variances, num_feature_dimensions, msd_flags, num_windows,
+        window_vector, solver='banded')
+    return predicted_outputs, outputs
+
+
+def generate_in_chunks(sess, predicted_outputs, outputs, mu, chunk_size,
+                       overlap):
+    import DNNDataIO
+
+    chunks = DNNDataIO.get_chunks(len(mu), chunk_size, overlap)
+    if len(chunks) == 1:
+        overlap = 0
+    generated = (sess.run(outputs, feed_dict={predicted_outputs: mu[start:end]})
+                 for start, end in chunks)
+    return np.concatenate(list(DNNDataIO.stitch_chunks(generated, overlap)))
+
+
+def make_trajectory_inputs(num_frames, num_outputs):
+    # Random walk so that neighbouring frames are correlated as in speech
+    rng = np.random.RandomState(1)
+    mu = np.cumsum(rng.randn(num_frames, num_outputs) * 0.1, axis=0)
+    return mu.astype(np.float32)
+
+
+def run_chunk(args):
+    import resource
+    import tensorflow as tf
+
+    with tf.Graph().as_default():
+        predicted_outputs, outputs = build_generation_graph(args.num_dimensions)
+        mu = make_trajectory_inputs(
+            args.frames[0], predicted_outputs.get_shape()[1].value)
+        with tf.Session() as sess:
+            start_time = time.time()
+            generate_in_chunks(sess, predicted_outputs, outputs, mu,
+                               args.chunk_size, args.overlaps[-1])
+            duration = time.time() - start_time
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    print('%f %f' % (duration, peak_rss))
+
+
+def benchmark_chunk(args):
+    if args.child:
+        run_chunk(args)
+        return
+
+    import tensorflow as tf
+
+    # Accuracy against the full-length solution
+    rows = []
+    with tf.Graph().as_default():
+        predicted_outputs, outputs = build_generation_graph(args.num_dimensions)
+        mu = make_trajectory_inputs(
+            args.frames[0], predicted_outputs.get_shape()[1].value)
+        with tf.Session() as sess:
+            full = generate_in_chunks(sess, predicted_outputs, outputs, mu, 0, 0)
+            for overlap in args.overlaps:
+                chunked = generate_in_chunks(sess, predicted_outputs, outputs,
+                                             mu, args.chunk_size, overlap)
+                assert chunked.shape == full.shape
+                error = np.max(np.abs(chunked - full))
+                rows.append(['overlap %d' % overlap, '%.3e' % error,
+                             'ok' if error <= args.tolerance else 'FAILED'])
+    print('Chunked MLPG: %d frames, chunks of %d frames, max |error| vs full'
+          % (args.frames[0], args.chunk_size))
+    print_table(['Overlap', 'Max error', 'Status'], rows)
+
+    # Time and peak RSS, each measurement in its own process
+    rows = []
+    for num_frames in args.frames:
+        for chunk_size in [0, args.chunk_size]:
+            name = 'full' if chunk_size == 0 else 'chunked'
+            command = [sys.executable, os.path.abspath(__file__), 'chunk',
+                       '--child', '-T', str(num_frames),
+                       '-D', str(args.num_dimensions),
+                       '-c', str(chunk_size), '-o', str(args.overlaps[-1])]
+            try:
+                output = subprocess.check_output(command)
+                duration, peak_rss = [float(x) for x in output.split()[-2:]]
+                rows.append(['%s (T=%d)' % (name, num_frames),
+                             '%.3f' % duration, '%.0f' % peak_rss])
+            except subprocess.CalledProcessError:
+                rows.append(['%s (T=%d)' % (name, num_frames), 'failed', '-'])
+    print_table(['Generation', 'Time [sec]', 'Peak RSS [MB]'], rows)
+
+
+def benchmark_forward(args):
+    import tensorflow as tf
+    import DNNDefine
+
+    num_io_units = [args.num_inputs, args.num_outputs]
+    rng = np.random.RandomState(0)
+    input_data = rng.randn(args.num_frames, args.num_inputs).astype(np.float32)
+    output_data = rng.randn(args.num_frames, args.num_outputs).astype(np.float32)
+
+    with tf.Graph().as_default():
+        inputs = tf.placeholder(tf.float32, shape=[None, args.num_inputs])
+        outputs = tf.placeholder(tf.float32, shape=[None, args.num_outputs])
+        with tf.variable_scope('model'):
+            predicted_outputs, variances, _ = DNNDefine.inference(
+                inputs, [[0]], num_io_units, args.num_hidden_units, 1, 1,
+                'Tanh', 'Linear', 1.0, 'SD', seed=0)
+        cost_op, _ = DNNDefine.cost(predicted_outputs, outputs, variances)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+
+            # The loop formerly used by DNNSynthesis.py in frame-by-frame mode
+            def forward_frames():
+                total_cost = 0.0
+                predicts = []
+                for j in xrange(args.num_frames):
+                    predict, cost = sess.run(
+                        [predicted_outputs, cost_op],
+                        feed_dict={inputs: [input_data[j]],
+                                   outputs: [output_data[j]]})
+                    predicts.append(predict)
+                    total_cost += cost
+                return np.concatenate(predicts), total_cost / args.num_frames
+
+            def forward_blocks(block_size):
+                import DNNDataIO
+                total_cost = 0.0
+                predicts = []
+                for start, end in DNNDataIO.get_chunks(args.num_frames,
+                                                       block_size, 0):
+                    predict, cost = sess.run(
+                        [predicted_outputs, cost_op],
+                        feed_dict={inputs: input_data[start:end],
+                                   outputs: output_data[start:end]})
+                    predicts.append(predict)
+                    total_cost += cost * (end - start)
+                return np.concatenate(predicts), total_cost / args.num_frames
+
+            reference, reference_cost = forward_frames()
+            frame_time = time_function(forward_frames, args.num_repeats)
+            rows = [['per frame', '%.4f' % frame_time, '1.0x', '-', '-']]
+            for block_size in args.block_sizes:
+                predicts, cost = forward_blocks(block_size)
+                block_time = time_function(
+                    lambda: forward_blocks(block_size), args.num_repeats)
+                name = 'whole utterance' if block_size == 0 else \
+                    'blocks of %d' % block_size
+                rows.append([name, '%.4f' % block_time,
+                             '%.1fx' % (frame_time / block_time),
+                             '%.1e' % np.max(np.abs(predicts - reference)),
+                             '%.1e' % abs(cost - reference_cost)])
+
+    print('Frame-by-frame forwarding: %d frames, %d -> %s -> %d units' %
+          (args.num_frames, args.num_inputs,
+           'x'.join(str(n) for n in args.num_hidden_units), args.num_outputs))
+    print_table(['Forwarding', 'Time [sec]', 'Speedup', 'Max error',
+                 'Cost error'], rows)
+
+
+def make_engine_config(args):
+    return {
+        'all_spkrs': ['spkr'],
+        'restore_ckpt': 0,
+        'num_input_units': args.num_inputs,
+        'num_output_units': args.num_outputs,
+        'num_io_units': (args.num_inputs, args.num_outputs),
+        'num_hidden_units': args.num_hidden_units,
+        'hidden_activation': 'Tanh',
+        'output_activation': 'Linear',
+        'num_threads': 1,
+        'frame_by_frame': 1,
+        'num_feature_dimensions': [args.num_outputs]}
+
+
+def save_random_model(config, model_dir):
+    import tensorflow as tf
+    import DNNDefine
+
+    with tf.Graph().as_default():
+        inputs = tf.placeholder(tf.float32, shape=[None, config['num_input_units']])
+        with tf.variable_scope('model'):
+            DNNDefine.inference(
+                inputs, [[0]], config['num_io_units'], config['num_hidden_units'],
+                1, 1, config['hidden_activation'], config['output_activation'],
+                1.0, 'SD', seed=0)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            tf.train.Saver().save(sess, os.path.join(model_dir, 'model.ckpt'))
+
+
+def run_engine(args):
+    # Load the model and generate one frame, as a synthesis call would
+    config = make_engine_config(args)
+    input_data = np.zeros([1, args.num_inputs], np.float32)
+    if args.engine == 'numpy':
+        import DNNEngine
+        DNNEngine.Engine(os.path.join(args.work_dir, 'model.npz')).generate(
+            input_data)
+    else:
+        import DNNSynthesis
+        DNNSynthesis.Synthesizer(config, args.work_dir).synthesize(input_data)
+
+
+def benchmark_engine(args):
+    if args.engine is not None:
+        run_engine(args)
+        return
+
+    import DNNEngine
+    import DNNExport
+    import DNNSynthesis
+
+    config = make_engine_config(args)
+    work_dir = tempfile.mkdtemp()
+    try:
+        save_random_model(config, work_dir)
+        DNNExport.export_model(config, work_dir,
+                               os.path.join(work_dir, 'model.npz'))
+
+        # Startup: a fresh process that imports, loads the model and
+        # generates one frame
+        rows = []
+        for engine in ['tensorflow', 'numpy']:
+            command = [sys.executable, os.path.abspath(__file__), 'engine',
+                       '-e', engine, '-d', work_dir,
+                       '-I', str(args.num_inputs), '-O', str(args.num_outputs),
+                       '-H'] + [str(n) for n in args.num_hidden_units]
+            try:
+                duration = time_function(
+                    lambda: subprocess.check_call(command), args.num_repeats)
+                rows.append([engine, '%.3f' % duration])
+            except subprocess.CalledProcessError:
+                rows.append([engine, 'failed'])
+        print('Startup of a synthesis process (%s -> %s -> %s units)' %
+              (args.num_inputs, 'x'.join(str(n) for n in args.num_hidden_units),
+               args.num_outputs))
+        print_table(['Engine', 'Time [sec]'], rows)
+
+        # Throughput of a warm engine
+        rng = np.random.RandomState(0)
+        input_data = rng.randn(args.num_frames, args.num_inputs).astype(np.float32)
+        synthesizer = DNNSynthesis.Synthesizer(config, work_dir)
+        engine = DNNEngine.Engine(os.path.join(work_dir, 'model.npz'))
+        reference, _ = synthesizer.synthesize(input_data)
+        error = np.max(np.abs(engine.generate(input_data) - reference))
+        tf_time = time_function(lambda: synthesizer.synthesize(input_data),
+                                args.num_repeats)
+        numpy_time = time_function(lambda: engine.generate(input_data),
+                                   args.num_repeats)
+        synthesizer.close()
+        rows = [['tensorflow', '%.4f' % tf_time,
+                 '%.0f' % (args.num_frames / tf_time), '-'],
+                ['numpy', '%.4f' % numpy_time,
+                 '%.0f' % (args.num_frames / numpy_time), '%.1e' % error]]
+        print('Forwarding %d frames' % args.num_frames)
+        print_table(['Engine', 'Time [sec]', 'Frames/sec', 'Max error'], rows)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+def benchmark_fold(args):
+    import tensorflow as tf
+    import DNNDefine
+
+    num_io_units = [args.num_inputs, args.num_outputs]
+    rng = np.random.RandomState(0)
+    input_data = rng.randn(args.num_frames, args.num_inputs).astype(np.float32)
+    spkr_id = args.num_spkrs - 1
+
+    with tf.Graph().as_default():
+        inputs = tf.placeholder(tf.float32, shape=[None, args.num_inputs])
+        # One-hot speaker vectors on every frame as in training
+        spkr_ids = tf.fill([tf.shape(inputs)[0], 1], spkr_id)
+        with tf.variable_scope('model'):
+            one_hot_outputs, one_hot_variances, _ = DNNDefine.inference(
+                inputs, spkr_ids, num_io_units, args.num_hidden_units,
+                args.num_spkrs, 1, 'Tanh', 'Linear', 1.0, 'SAT', seed=0)
+        with tf.variable_scope('model', reuse=True):
+            folded_outputs, folded_variances, _ = DNNDefine.inference(
+                inputs, [[spkr_id]], num_io_units, args.num_hidden_units,
+                args.num_spkrs, 1, 'Tanh', 'Linear', 1.0, 'SAT',
+                fold_spkr_biases=True)
+
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            feed_dict = {inputs: input_data}
+            reference, reference_variances = sess.run(
+                [one_hot_outputs, one_hot_variances], feed_dict=feed_dict)
+            outputs, variances = sess.run(
+                [folded_outputs, folded_variances], feed_dict=feed_dict)
+            error = max(np.max(np.abs(outputs - reference)),
+                        np.max(np.abs(variances - reference_variances)))
+
+            one_hot_time = time_function(
+                lambda: sess.run(one_hot_outputs, feed_dict=feed_dict),
+                args.num_repeats)
+            folded_time = time_function(
+                lambda: sess.run(folded_outputs, feed_dict=feed_dict),
+                args.num_repeats)
+
+    rows = [['one-hot matmul', '%.4f' % one_hot_time, '1.0x', '-'],
+            ['folded biases', '%.4f' % folded_time,
+             '%.1fx' % (one_hot_time / folded_time), '%.1e' % error]]
+    print('SAT forwarding: %d frames, %d speakers, %d -> %s -> %d units' %
+          (args.num_frames, args.num_spkrs, args.num_inputs,
+           'x'.join(str(n) for n in args.num_hidden_units), args.num_outputs))
+    print_table(['Speaker bias', 'Time [sec]', 'Speedup', 'Max error'], rows)
+
+
+def benchmark_quant(args):
+    import DNNDataIO
+    import DNNEngine
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        if args.model_file is None:
+            import DNNExport
+            config = make_engine_config(args)
+            save_random_model(config, work_dir)
+            model_file = os.path.join(work_dir, 'model.npz')
+            DNNExport.export_model(config, work_dir, model_file)
+        else:
+            model_file = args.model_file
+        with np.load(model_file) as data:
+            params = dict((key, data[key]) for key in data.files)
+        if 'weight_format' in params and str(params['weight_format']) != 'float32':
+            sys.exit('  ERROR  benchmark_quant: %s is not a float32 model' %
+                     model_file)
+
+        # Held-out utterances if a script is given, random frames otherwise
+        num_inputs = params['hidden0/si_weights'].shape[0]
+        if args.script is None:
+            rng = np.random.RandomState(0)
+            input_data = [rng.randn(args.num_frames,
+                                    num_inputs).astype(np.float32)]
+        else:
+            input_filenames, _ = DNNDataIO.get_filenames(args.script)
+            input_data = [DNNDataIO.load_binary_data(filename, num_inputs)
+                          for filename in input_filenames]
+        num_frames = sum(len(data) for data in input_data)
+
+        rows = []
+        for weight_format in ['float32', 'float16', 'int8']:
+            export_file = os.path.join(work_dir, weight_format + '.npz')
+            quantized_params = DNNEngine.quantize_params(params, weight_format)
+            np.savez(export_file, **quantized_params)
+            weight_bytes = sum(
+                value.nbytes for key, value in quantized_params.items()
+                if key.startswith('hidden') and '/si_weights' in key)
+
+            engine = DNNEngine.Engine(export_file)
+            outputs = np.concatenate(
+                [engine.generate(data, args.spkr) for data in input_data])
+            if weight_format == 'float32':
+                reference = outputs
+            rmse = np.sqrt(np.mean(np.square(outputs - reference)))
+            duration = time_function(
+                lambda: [engine.generate(data, args.spkr) for data in input_data],
+                args.num_repeats)
+            rows.append([weight_format,
+                         '%.2f' % (weight_bytes / 2 ** 20),
+                         '%.2f' % (os.path.getsize(export_file) / 2 ** 20),
+                         '%.0f' % (num_frames / duration),
+                         '-' if weight_format == 'float32' else '%.1e' % rmse])
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('Generation of %d utterances (%d frames) with hidden-layer weights in '
+          'reduced precision' % (len(input_data), num_frames))
+    print_table(['Weights', 'Weights [MB]', 'File [MB]', 'Frames/sec', 'RMSE'],
+                rows)
+
+
+def make_extract_corpus(work_dir, num_utterances, num_notes, frame_period):
+    # Sung notes with vibrato of varying depth, each followed by a few
+    # unvoiced frames inside its label, and rests between phrases
+    notes = ['C4', 'D4', 'E4', 'F4', 'G4', 'A4', 'B4', 'Db5', 'Eb5', 'Gb4', 'Ab3',
+             'Bb3']
+    rng = np.random.RandomState(0)
+    for directory in ['lf0', 'vib', 'labels/mono', 'labels/full']:
+        os.makedirs(os.path.join(work_dir, directory))
+    basenames = []
+    for n in xrange(num_utterances):
+        base = 'utt%03d' % n
+        lf0 = []
+        labels = []
+        for i in xrange(num_notes + 2):
+            if i == 0 or i == num_notes + 1 or rng.rand() < 0.1:
+                # The final rest is longer than any note, as vibrato may be
+                # written past the end of a voiced segment
+                length = 250 if i == num_notes + 1 else rng.randint(10, 60)
+                lf0.append(np.full(length, -1e10))
+                labels.append(('pau', 'xx', length))
+                continue
+            note = notes[rng.randint(len(notes))]
+            voiced = rng.randint(15, 200)
+            frames = np.arange(voiced)
+            f0 = (440.0 * 2.0 ** ((notes.index(note) - 5) / 12.0) *
+                  (1.0 + 0.01 * rng.randn()) +
+                  rng.uniform(0.0, 30.0) *
+                  np.sin(2 * np.pi * rng.uniform(4.5, 7.0) * frame_period /
+                         1000.0 * frames) +
+                  np.cumsum(rng.randn(voiced)))
+            lf0.append(np.log(np.maximum(f0, 1.0)))
+            gap = rng.randint(1, 10)
+            lf0.append(np.full(gap, -1e10))
+            labels.append(('a', note, voiced + gap))
+        np.concatenate(lf0).astype(np.float32).tofile(
+            os.path.join(work_dir, 'lf0', base + '.lf0'))
+
+        with open(os.path.join(work_dir, 'labels/mono', base + '.lab'), 'w') as mono:
+            with open(os.path.join(work_dir, 'labels/full', base + '.lab'), 'w') as full:
+                start = 0
+                for phoneme, note, length in labels:
+                    times = '%d %d ' % (start * frame_period * 10000,
+                                        (start + length) * frame_period * 10000)
+                    mono.write(times + phoneme + '\n')
+                    full.write(times + 'xx^xx-%s+xx=xx/A:xx/E:%s]!xx\n' %
+                               (phoneme, note))
+                    start += length
+        basenames.append(base)
+    return basenames
+
+
+def run_extract(function, work_dir, output_dir, basenames, frame_period):
+    # Extraction overwrites the LF0 file, so each run starts from a copy
+    durations = []
+    for base in basenames:
+        lf0 = os.path.join(output_dir, base + '.lf0')
+        shutil.copyfile(os.path.join(work_dir, 'lf0', base + '.lf0'), lf0)
+        start_time = time.time()
+        function(lf0, os.path.join(output_dir, base + '.vib'),
+                 os.path.join(work_dir, 'labels/mono', base + '.lab'),
+                 os.path.join(work_dir, 'labels/full', base + '.lab'),
+                 frame_period)
+        durations.append(time.time() - start_time)
+    return durations
+
+
+def benchmark_extract(args):
+    import Extract
+
+    work_dir = tempfile.mkdtemp()
+    stderr = sys.stderr
+    try:
+        basenames = make_extract_corpus(work_dir, args.num_utterances,
+                                        args.num_notes, args.frame_period)
+        num_frames = sum(os.path.getsize(os.path.join(work_dir, 'lf0', base +
+                                                      '.lf0')) // 4
+                         for base in basenames)
+        implementations = [('nested lists', legacy_extract),
+                           ('numpy arrays', Extract.extract)]
+
+        rows = []
+        outputs = []
+        for name, function in implementations:
+            output_dir = os.path.join(work_dir, name.replace(' ', '_'))
+            os.mkdir(output_dir)
+            # Keep the progress bars out of the table
+            sys.stderr = open(os.devnull, 'w')
+            try:
+                durations = [
+                    np.mean(run_extract(function, work_dir, output_dir,
+                                        basenames, args.frame_period))
+                    for _ in xrange(args.num_repeats)]
+            finally:
+                sys.stderr.close()
+                sys.stderr = stderr
+            output = []
+            for base in basenames:
+                for extension in ['.lf0', '.vib']:
+                    with open(os.path.join(output_dir, base + extension),
+                              'rb') as f:
+                        output.append(f.read())
+            outputs.append(output)
+            rows.append([name, '%.4f' % min(durations)])
+
+        legacy_time = float(rows[0][1])
+        for row, output in zip(rows, outputs):
+            row.append('%.1fx' % (legacy_time / float(row[1])))
+            row.append('%d/%d' % (sum(a == b for a, b in zip(output, outputs[0])),
+                                  len(output)))
+        print('Extract.py: %d utterances (%d frames), %g ms frame period' %
+              (len(basenames), num_frames, args.frame_period))
+        print_table(['Implementation', 'Sec/utterance', 'Speedup',
+                     'Identical'], rows)
+    finally:
+        sys.stderr = stderr
+        shutil.rmtree(work_dir)
+
+
+def load_vibrato(filename):
+    # Depth [Hz] and period [frames]; the 1e-8 written for frames without
+    # vibrato becomes 0
+    vib = np.fromfile(filename, np.float32).reshape(-1, 2).astype(np.float64)
+    return np.where(vib == np.float32(1e-8), 0.0, np.exp(vib))
+
+
+def benchmark_detrend(args):
+    import Extract
+
+    rows = []
+    rng = np.random.RandomState(0)
+    segments = []
+    for length in args.lengths:
+        frames = np.arange(length)
+        segments.append(20.0 * np.sin(2 * np.pi * 6.0 * args.frame_period /
+                                      1000.0 * frames) +
+                        np.cumsum(rng.randn(length)))
+    for backend in sorted(Extract.detrendBackends):
+        trend = Extract.detrendBackends[backend]
+        rows.append([backend] + [
+            '%.2f' % (1000 * time_function(lambda: trend(segment),
+                                           args.num_repeats))
+            for segment in segments])
+    print('Trend of one voiced segment')
+    print_table(['Backend'] + ['%d fr [ms]' % n for n in args.lengths], rows)
+
+    work_dir = tempfile.mkdtemp()
+    stderr = sys.stderr
+    try:
+        basenames = make_extract_corpus(work_dir, args.num_utterances,
+                                        args.num_notes, args.frame_period)
+        rows = []
+        reference = None
+        for backend in ['lowess'] + sorted(set(Extract.detrendBackends) -
+                                            set(['lowess'])):
+            output_dir = os.path.join(work_dir, backend)
+            os.mkdir(output_dir)
+            sys.stderr = open(os.devnull, 'w')
+            try:
+                duration = np.mean(run_extract(
+                    lambda *files: Extract.extract(*files, detrend=backend),
+                    work_dir, output_dir, basenames, args.frame_period))
+            finally:
+                sys.stderr.close()
+                sys.stderr = stderr
+            vibrato = np.concatenate(
+                [load_vibrato(os.path.join(output_dir, base + '.vib'))
+                 for base in basenames])
+            if reference is None:
+                reference = vibrato
+            # Errors over the frames where either backend found vibrato
+            active = (vibrato[:, 0] > 0) | (reference[:, 0] > 0)
+            depth_rmse, period_rmse = np.sqrt(
+                np.mean(np.square(vibrato[active] - reference[active]), axis=0))
+            agreement = np.mean((vibrato[:, 0] > 0) == (reference[:, 0] > 0))
+            rows.append([backend, '%.4f' % duration, '%.2f' % depth_rmse,
+                         '%.2f' % period_rmse, '%.1f%%' % (100 * agreement)])
+        print('Extract.py VIB against lowess: %d utterances' % len(basenames))
+        print_table(['Backend', 'Sec/utterance', 'Depth [Hz]', 'Period [fr]',
+                     'Same frames'], rows)
+    finally:
+        sys.stderr = stderr
+        shutil.rmtree(work_dir)
+
+
+def parse_import_times(output, module):
+    # Cumulative microseconds of module and of the modules it imports
+    # directly, from python -X importtime where children precede parents
+    times = {}
+    for line in output.splitlines():
+        fields = line.split('|')
+        if not line.startswith('import time:') or not fields[1].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth == 1:
+            times[name.strip()] = int(fields[1])
+        elif depth == 0:
+            if name.strip() == module:
+                times[module] = int(fields[1])
+                return times
+            times = {}
+    return times
+
+
+def benchmark_startup(args):
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    heavy_modules = ['matplotlib', 'progressbar', 'scipy', 'statsmodels']
+
+    # A fresh interpreter each time, as the Makefile starts Extract.py
+    durations = []
+    for _ in xrange(args.num_repeats):
+        process = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c',
+             'import sys, Extract; print(" ".join(sys.modules))'],
+            cwd=script_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        modules, output = process.communicate()
+        if process.returncode != 0:
+            sys.exit(output)
+        durations.append(parse_import_times(output, 'Extract'))
+    times = min(durations, key=lambda t: t['Extract'])
+    total = times.pop('Extract')
+
+    rows = [[name, '%.1f' % (time / 1000.0), '%.0f%%' % (100.0 * time / total)]
+            for name, time in sorted(times.items(), key=lambda t: -t[1])
+            [:args.num_modules]]
+    rows.append(['total', '%.1f' % (total / 1000.0), '100%'])
+    print('Import of Extract.py (python -X importtime, best of %d)' %
+          args.num_repeats)
+    print_table(['Module', 'Time [ms]', 'Share'], rows)
+
+    # Regression guards: heavy modules stay lazy and the total stays small
+    loaded = sorted(set(name.split('.')[0] for name in modules.split()) &
+                    set(heavy_modules))
+    failures = []
+    if len(loaded) > 0:
+        failures.append('imported at load time: %s' % ', '.join(loaded))
+    if args.limit > 0 and total / 1000.0 > args.limit:
+        failures.append('import time %.1f ms exceeds %.1f ms' %
+                        (total / 1000.0, args.limit))
+    for failure in failures:
+        print('  FAILED  %s' % failure)
+    if len(failures) > 0:
+        sys.exit(1)
+
+
+def make_vibrato_track(rng, length):
+    # Detrended F0 around zero: vibrato of varying depth with noise, some
+    # shallow cycles and some frames exactly at zero
+    frames = np.arange(length)
+    track = (rng.uniform(0.0, 30.0) *
+             np.sin(2 * np.pi * rng.uniform(0.01, 0.1) * frames +
+                    rng.uniform(0, 2 * np.pi)) +
+             rng.uniform(0.0, 5.0) * rng.randn(length))
+    track[rng.rand(length) < 0.02] = 0.0
+    return track
+
+
+def make_voiced_track(rng, length):
+    # F0 with voiced runs, unvoiced gaps and a few NaN frames
+    track = np.where(rng.rand(length) < 0.05, 0.0,
+                     rng.uniform(100.0, 400.0, length))
+    gaps = np.cumsum(rng.rand(length) < 0.02) % 2 == 1
+    track[gaps] = 0.0
+    track[rng.rand(length) < 0.005] = np.nan
+    return track
+
+
+def benchmark_vibrato(args):
+    import Extract
+
+    rng = np.random.RandomState(0)
+    lengths = rng.randint(3, args.max_length, args.num_tracks)
+    vibrato_tracks = [make_vibrato_track(rng, n) for n in lengths]
+    voiced_tracks = [make_voiced_track(rng, n) for n in lengths]
+    # Label ranges cut anywhere in the track, including empty ones
+    ranges = [tuple(sorted(rng.randint(0, n + 1, 2))) for n in lengths]
+
+    mismatches = [0, 0]
+    skipped = 0
+    for track in vibrato_tracks:
+        try:
+            reference = np.array(legacy_get_vibrate(track))
+        except IndexError:
+            # No zero crossing at all, which fails in both implementations
+            skipped += 1
+            continue
+        mismatches[0] += not np.array_equal(Extract.getVibrate(track),
+                                            reference)
+    for track, (start, end) in zip(voiced_tracks, ranges):
+        mismatches[1] += (Extract.voicedSegments(track, start, end) !=
+                          legacy_voiced_segments(track, start, end))
+
+    rows = []
+    legacy_time = time_function(
+        lambda: [legacy_get_vibrate(track) for track in vibrato_tracks[:100]
+                 if len(track) > 2 and np.any(track <= 0) and
+                 np.any(track >= 0)],
+        args.num_repeats)
+    new_time = time_function(
+        lambda: [Extract.getVibrate(track) for track in vibrato_tracks[:100]
+                 if len(track) > 2 and np.any(track <= 0) and
+                 np.any(track >= 0)],
+        args.num_repeats)
+    rows.append(['getVibrate', '%.4f' % legacy_time, '%.4f' % new_time,
+                 '%.1fx' % (legacy_time / new_time),
+                 '%d/%d' % (mismatches[0], len(vibrato_tracks) - skipped)])
+    legacy_time = time_function(
+        lambda: [legacy_voiced_segments(track, start, end)
+                 for track, (start, end) in zip(voiced_tracks[:100], ranges)],
+        args.num_repeats)
+    new_time = time_function(
+        lambda: [Extract.voicedSegments(track, start, end)
+                 for track, (start, end) in zip(voiced_tracks[:100], ranges)],
+        args.num_repeats)
+    rows.append(['voiced segments', '%.4f' % legacy_time, '%.4f' % new_time,
+                 '%.1fx' % (legacy_time / new_time),
+                 '%d/%d' % (mismatches[1], len(voiced_tracks))])
+    print('Vibrato extraction on synthetic tracks of 3-%d frames (time of the '
+          'first 100)' % args.max_length)
+    print_table(['Function', 'Loops [sec]', 'Numpy [sec]', 'Speedup',
+                 'Mismatches'], rows)
+    if sum(mismatches) > 0:
+        sys.exit(1)
+
+
+def make_parallel_stages(args):
+    # Training-like fan-outs: in each stream, every iteration runs shards
+    # of varying length and then a merge that the next iteration needs
+    rng = np.random.RandomState(0)
+    stages = []
+    for i in xrange(args.num_iterations):
+        shards = []
+        merges = []
+        for stream in xrange(args.num_streams):
+            prefix = 'stream%d it%d' % (stream, i)
+            depends = ['stream%d it%d merge' % (stream, i - 1)] if i > 0 else []
+            names = []
+            for shard in xrange(args.num_shards):
+                names.append('%s shard%d' % (prefix, shard))
+                shards.append((names[-1], depends,
+                               rng.uniform(0.2, 1.0) * args.scale))
+            merges.append((prefix + ' merge', names, 0.3 * args.scale))
+        stages.extend([shards, merges])
+    return stages
+
+
+def write_parallel_config(filename, sections, with_depends):
+    with open(filename, 'w') as f:
+        for name, depends, duration in sections:
+            options = ''
+            if with_depends and len(depends) > 0:
+                options = ' depends=' + ','.join(depends)
+            f.write('[%s]%s\nsleep %.3f\n\n' % (name, options, duration))
+
+
+def run_parallel(config_file, num_jobs, options=[]):
+    start_time = time.time()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(
+            [sys.executable,
+             os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'parallel.py'),
+             '-j', str(num_jobs)] + options + [config_file], stdout=devnull)
+    return time.time() - start_time
+
+
+def benchmark_parallel(args):
+    stages = make_parallel_stages(args)
+    sections = [section for stage in stages for section in stage]
+    durations = dict((name, duration) for name, _, duration in sections)
+    depends = dict((name, deps) for name, deps, _ in sections)
+
+    # Lower bounds: the longest dependency chain and the work per slot
+    finish = {}
+    for name, _, duration in sections:
+        finish[name] = duration + max([finish[d] for d in depends[name]] + [0])
+    critical_path = max(finish.values())
+    work = sum(durations.values()) / args.num_jobs
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        # Before depends=, each stage was a separate call, i.e. a barrier
+        barrier_time = 0.0
+        for i, stage in enumerate(stages):
+            config_file = os.path.join(work_dir, 'stage%d.conf' % i)
+            write_parallel_config(config_file, stage, False)
+            barrier_time += run_parallel(config_file, args.num_jobs)
+        config_file = os.path.join(work_dir, 'all.conf')
+        write_parallel_config(config_file, sections, True)
+        depends_time = run_parallel(config_file, args.num_jobs)
+    finally:
+        shutil.rmtree(work_dir)
+
+    rows = [['stage barriers', '%.2f' % barrier_time, '1.0x'],
+            ['depends=', '%.2f' % depends_time,
+             '%.1fx' % (barrier_time / depends_time)],
+            ['lower bound', '%.2f' % max(critical_path, work),
+             '%.1fx' % (barrier_time / max(critical_path, work))]]
+    print('parallel.py: %d streams x %d iterations x %d shards + merge, '
+          '%d slots' % (args.num_streams, args.num_iterations,
+                        args.num_shards, args.num_jobs))
+    print_table(['Schedule', 'Makespan [sec]', 'Speedup'], rows)
+
+
+def free_port():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def run_remote(config_file, num_workers, num_slots, prefetch, kill_after=None):
+    # Worker agents on localhost stand in for the render nodes
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'parallel.py')
+    address = '127.0.0.1:%d' % free_port()
+    with open(os.devnull, 'w') as devnull:
+        workers = [subprocess.Popen([sys.executable, script, '-w', address,
+                                     '-j', str(num_slots), '-o'],
+                                    stdout=devnull, stderr=devnull)
+                   for _ in xrange(num_workers)]
+        start_time = time.time()
+        coordinator = subprocess.Popen(
+            [sys.executable, script, '-e', 'remote', '-a', address,
+             '-P', str(prefetch), config_file],
+            stdout=subprocess.PIPE, universal_newlines=True)
+        if kill_after is not None:
+            time.sleep(kill_after)
+            workers[0].kill()
+        output = coordinator.communicate()[0]
+        duration = time.time() - start_time
+        for worker in workers:
+            worker.wait()
+    if coordinator.returncode != 0:
+        raise RuntimeError('parallel.py -e remote failed:\n' + output)
+    stolen = sum(int(line.split()[4]) for line in output.splitlines()
+                 if ' gave up ' in line)
+    return duration, stolen
+
+
+def benchmark_remote(args):
+    stages = make_parallel_stages(args)
+    sections = [section for stage in stages for section in stage]
+    num_slots = args.num_workers * args.num_slots
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        config_file = os.path.join(work_dir, 'all.conf')
+        write_parallel_config(config_file, sections, True)
+        rows = [['thread, -j %d' % num_slots,
+                 '%.2f' % run_parallel(config_file, num_slots), '-']]
+        for label, prefetch, kill_after in [
+                ('remote, -P 0', 0, None),
+                ('remote, -P %d' % args.prefetch, args.prefetch, None),
+                ('remote, -P %d, 1 killed' % args.prefetch,
+                 args.prefetch, 2.0 * args.scale)]:
+            duration, stolen = run_remote(config_file, args.num_workers,
+                                          args.num_slots, prefetch, kill_after)
+            rows.append([label, '%.2f' % duration, '%d' % stolen])
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('parallel.py: %d sections, %d workers x %d slots on localhost' %
+          (len(sections), args.num_workers, args.num_slots))
+    print_table(['Executor', 'Makespan [sec]', 'Stolen'], rows)
+
+
+def benchmark_logs(args):
+    import resource
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        # Chatty jobs as HTK tools with tracing print line by line
+        config_file = os.path.join(work_dir, 'chatty.conf')
+        with open(config_file, 'w') as f:
+            for i in xrange(args.num_sections):
+                f.write('[job%d]\nseq -f "HERest shard %d line %%g" %d\n\n' %
+                        (i, i, args.num_lines))
+
+        rows = []
+        log_dir = os.path.join(work_dir, 'log')
+        for engine in ['thread', 'asyncio']:
+            for options, output in [([], 'console'),
+                                    (['-l', log_dir], 'log files'),
+                                    (['-l', log_dir, '-t'], 'log files + tail')]:
+                usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+                duration = run_parallel(config_file, args.num_jobs,
+                                        ['-e', engine] + options)
+                cpu = resource.getrusage(resource.RUSAGE_CHILDREN)
+                cpu_time = (cpu.ru_utime + cpu.ru_stime -
+                            usage.ru_utime - usage.ru_stime)
+                rows.append(['%s, %s' % (engine, output), '%.2f' % duration,
+                             '%.2f' % cpu_time])
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('parallel.py: %d sections of %d output lines, %d at a time' %
+          (args.num_sections, args.num_lines, args.num_jobs))
+    print_table(['Engine, output', 'Wall [sec]', 'CPU [sec]'], rows)
+
+
+def write_cached_config(filename, work_dir, sections):
+    # Every section writes one file and reads those of its dependencies;
+    # the first iteration of a stream reads the stream's input file
+    def output(name):
+        return os.path.join(work_dir, name.replace(' ', '_') + '.out')
+
+    with open(filename, 'w') as f:
+        for name, depends, duration in sections:
+            inputs = [output(d) for d in depends]
+            options = ''
+            if len(depends) > 0:
+                options = ' depends=' + ','.join(depends)
+            else:
+                inputs = [os.path.join(work_dir, name.split()[0] + '.in')]
+            options += ' inputs=%s outputs=%s' % (','.join(inputs), output(name))
+            f.write('[%s]%s\nsleep %.3f && cat %s > %s\n\n' %
+                    (name, options, duration, ' '.join(inputs), output(name)))
+
+
+def benchmark_cache(args):
+    sections = [section for stage in make_parallel_stages(args)
+                for section in stage]
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        config_file = os.path.join(work_dir, 'all.conf')
+        cache_file = os.path.join(work_dir, 'cache.json')
+        write_cached_config(config_file, work_dir, sections)
+
+        def write_inputs(version):
+            for stream in xrange(args.num_streams):
+                with open(os.path.join(work_dir, 'stream%d.in' % stream),
+                          'w') as f:
+                    f.write('stream%d version %d\n' % (stream, version))
+
+        def edit_input():
+            with open(os.path.join(work_dir, 'stream0.in'), 'a') as f:
+                f.write('edited\n')
+
+        rows = []
+        for mode, options in [('content', []), ('mtime', ['-T'])]:
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            write_inputs(0)
+            options = ['-c', cache_file] + options
+            for label, prepare in [
+                    ('first run', None),
+                    ('unchanged', None),
+                    ('one input changed', edit_input),
+                    ('one output deleted',
+                     lambda: os.remove(os.path.join(
+                         work_dir, 'stream%d_it%d_merge.out' %
+                         (args.num_streams - 1, args.num_iterations - 1))))]:
+                if prepare is not None:
+                    prepare()
+                rows.append(['%s, %s' % (mode, label), '%.2f' %
+                             run_parallel(config_file, args.num_jobs, options)])
+        write_inputs(0)
+        rows.append(['no cache', '%.2f' %
+                     run_parallel(config_file, args.num_jobs)])
+    finally:
+        shutil.rmtree(work_dir)
+
+    print('parallel.py -c: %d streams x %d iterations x %d shards + merge, '
+          '%d slots' % (args.num_streams, args.num_iterations,
+                        args.num_shards, args.num_jobs))
+    print_table(['Cache, rerun', 'Makespan [sec]'], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    io_parser = subparsers.add_parser(
+        'io', help='compare binary feature readers')
+    io_parser.add_argument('-T', metavar='n', dest='num_frames', type=int,
+                           default=20000, help='set number of frames to n')
+    io_parser.add_argument('-D', metavar='n', dest='num_dimensions', type=int,
+                           default=199, help='set frame dimension to n')
+    io_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                           default=3, help='set number of repetitions to n')
+    io_parser.set_defaults(function=benchmark_io)
+
+    mlpg_parser = subparsers.add_parser(
+        'mlpg', help='compare dense and banded MLPG in trajectory_cost')
+    mlpg_parser.add_argument('-T', metavar='n', dest='frames', type=int,
+                             nargs='+', default=[500, 1000, 2000, 5000],
+                             help='set numbers of frames to n')
+    mlpg_parser.add_argument('-D', metavar='n', dest='num_dimensions', type=int,
+                             default=40, help='set spectral dimension to n')
+    mlpg_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                             default=3, help='set number of repetitions to n')
+    mlpg_parser.add_argument('-s', metavar='solver', dest='solver', type=str,
+                             default='banded', help=argparse.SUPPRESS)
+    mlpg_parser.add_argument('--child', action='store_true',
+                             help=argparse.SUPPRESS)
+    mlpg_parser.set_defaults(function=benchmark_mlpg)
+
+    chunk_parser = subparsers.add_parser(
+        'chunk', help='compare chunked and full-length MLPG generation')
+    chunk_parser.add_argument('-T', metavar='n', dest='frames', type=int,
+                              nargs='+', default=[5000, 20000, 50000],
+                              help='set numbers of frames to n')
+    chunk_parser.add_argument('-D', metavar='n', dest='num_dimensions', type=int,
+                              default=40, help='set spectral dimension to n')
+    chunk_parser.add_argument('-c', metavar='n', dest='chunk_size', type=int,
+                              default=1000, help='set chunk size to n frames')
+    chunk_parser.add_argument('-o', metavar='n', dest='overlaps', type=int,
+                              nargs='+', default=[25, 50, 100],
+                              help='set overlaps to n frames')
+    chunk_parser.add_argument('-e', metavar='f', dest='tolerance', type=float,
+                              default=1e-4, help='set error tolerance to f')
+    chunk_parser.add_argument('--child', action='store_true',
+                              help=argparse.SUPPRESS)
+    chunk_parser.set_defaults(function=benchmark_chunk)
+
+    forward_parser = subparsers.add_parser(
+        'forward', help='compare per-frame and blocked forwarding')
+    forward_parser.add_argument('-T', metavar='n', dest='num_frames', type=int,
+                                default=2000, help='set number of frames to n')
+    forward_parser.add_argument('-I', metavar='n', dest='num_inputs', type=int,
+                                default=400, help='set input dimension to n')
+    forward_parser.add_argument('-O', metavar='n', dest='num_outputs', type=int,
+                                default=199, help='set output dimension to n')
+    forward_parser.add_argument('-H', metavar='n', dest='num_hidden_units',
+                                type=int, nargs='+', default=[1024, 1024, 1024],
+                                help='set hidden layer sizes to n')
+    forward_parser.add_argument('-b', metavar='n', dest='block_sizes', type=int,
+                                nargs='+', default=[256, 0],
+                                help='set block sizes to n (0: whole utterance)')
+    forward_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                                default=3, help='set number of repetitions to n')
+    forward_parser.set_defaults(function=benchmark_forward)
+
+    engine_parser = subparsers.add_parser(
+        'engine', help='compare the NumPy engine with TensorFlow synthesis')
+    engine_parser.add_argument('-T', metavar='n', dest='num_frames', type=int,
+                               default=2000, help='set number of frames to n')
+    engine_parser.add_argument('-I', metavar='n', dest='num_inputs', type=int,
+                               default=400, help='set input dimension to n')
+    engine_parser.add_argument('-O', metavar='n', dest='num_outputs', type=int,
+                               default=199, help='set output dimension to n')
+    engine_parser.add_argument('-H', metavar='n', dest='num_hidden_units',
+                               type=int, nargs='+', default=[1024, 1024, 1024],
+                               help='set hidden layer sizes to n')
+    engine_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                               default=3, help='set number of repetitions to n')
+    engine_parser.add_argument('-e', dest='engine', type=str, default=None,
+                               help=argparse.SUPPRESS)
+    engine_parser.add_argument('-d', dest='work_dir', type=str, default=None,
+                               help=argparse.SUPPRESS)
+    engine_parser.set_defaults(function=benchmark_engine)
+
+    fold_parser = subparsers.add_parser(
+        'fold', help='compare one-hot and folded speaker biases')
+    fold_parser.add_argument('-T', metavar='n', dest='num_frames', type=int,
+                             default=2000, help='set number of frames to n')
+    fold_parser.add_argument('-s', metavar='n', dest='num_spkrs', type=int,
+                             default=200, help='set number of speakers to n')
+    fold_parser.add_argument('-I', metavar='n', dest='num_inputs', type=int,
+                             default=400, help='set input dimension to n')
+    fold_parser.add_argument('-O', metavar='n', dest='num_outputs', type=int,
+                             default=199, help='set output dimension to n')
+    fold_parser.add_argument('-H', metavar='n', dest='num_hidden_units',
+                             type=int, nargs='+', default=[1024, 1024, 1024],
+                             help='set hidden layer sizes to n')
+    fold_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                             default=3, help='set number of repetitions to n')
+    fold_parser.set_defaults(function=benchmark_fold)
+
+    quant_parser = subparsers.add_parser(
+        'quant', help='compare float32, float16 and int8 engine weights')
+    quant_parser.add_argument('-m', metavar='f', dest='model_file', type=str,
+                              default=None,
+                              help='set float32 model exported by DNNExport.py '
+                              'to f (default: random model)')
+    quant_parser.add_argument('-S', metavar='f', dest='script', type=str,
+                              default=None,
+                              help='set held-out script file to f '
+                              '(default: random frames)')
+    quant_parser.add_argument('-s', metavar='spkr', dest='spkr', type=str,
+                              default=None, help='set speaker to spkr')
+    quant_parser.add_argument('-T', metavar='n', dest='num_frames', type=int,
+                              default=2000, help='set number of frames to n')
+    quant_parser.add_argument('-I', metavar='n', dest='num_inputs', type=int,
+                              default=400, help='set input dimension to n')
+    quant_parser.add_argument('-O', metavar='n', dest='num_outputs', type=int,
+                              default=199, help='set output dimension to n')
+    quant_parser.add_argument('-H', metavar='n', dest='num_hidden_units',
+                              type=int, nargs='+', default=[1024, 1024, 1024],
+                              help='set hidden layer sizes to n')
+    quant_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                              default=3, help='set number of repetitions to n')
+    quant_parser.set_defaults(function=benchmark_quant)
+
+    extract_parser = subparsers.add_parser(
+        'extract', help='compare Extract.py with its list-based original')
+    extract_parser.add_argument('-u', metavar='n', dest='num_utterances',
+                                type=int, default=10,
+                                help='set number of utterances to n')
+    extract_parser.add_argument('-n', metavar='n', dest='num_notes', type=int,
+                                default=40, help='set notes per utterance to n')
+    extract_parser.add_argument('-p', metavar='f', dest='frame_period',
+                                type=float, default=5.0,
+                                help='set frame period to f ms')
+    extract_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                                default=3, help='set number of repetitions to n')
+    extract_parser.set_defaults(function=benchmark_extract)
+
+    detrend_parser = subparsers.add_parser(
+        'detrend', help='compare trend backends for vibrato extraction')
+    detrend_parser.add_argument('-T', metavar='n', dest='lengths', type=int,
+                                nargs='+', default=[50, 200, 1000, 3000],
+                                help='set segment lengths to n frames')
+    detrend_parser.add_argument('-u', metavar='n', dest='num_utterances',
+                                type=int, default=10,
+                                help='set number of utterances to n')
+    detrend_parser.add_argument('-n', metavar='n', dest='num_notes', type=int,
+                                default=40, help='set notes per utterance to n')
+    detrend_parser.add_argument('-p', metavar='f', dest='frame_period',
+                                type=float, default=5.0,
+                                help='set frame period to f ms')
+    detrend_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                                default=3, help='set number of repetitions to n')
+    detrend_parser.set_defaults(function=benchmark_detrend)
+
+    startup_parser = subparsers.add_parser(
+        'startup', help='measure and guard the import time of Extract.py')
+    startup_parser.add_argument('-n', metavar='n', dest='num_modules',
+                                type=int, default=10,
+                                help='set number of listed modules to n')
+    startup_parser.add_argument('-e', metavar='ms', dest='limit', type=float,
+                                default=0.0,
+                                help='fail if the import takes more than ms '
+                                '(0: no limit)')
+    startup_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                                default=5, help='set number of repetitions to n')
+    startup_parser.set_defaults(function=benchmark_startup)
+
+    vibrato_parser = subparsers.add_parser(
+        'vibrato', help='check and time vectorized vibrato extraction')
+    vibrato_parser.add_argument('-n', metavar='n', dest='num_tracks', type=int,
+                                default=2000, help='set number of tracks to n')
+    vibrato_parser.add_argument('-T', metavar='n', dest='max_length', type=int,
+                                default=2000,
+                                help='set maximum track length to n frames')
+    vibrato_parser.add_argument('-r', metavar='n', dest='num_repeats', type=int,
+                                default=3, help='set number of repetitions to n')
+    vibrato_parser.set_defaults(function=benchmark_vibrato)
+
+    parallel_parser = subparsers.add_parser(
+        'parallel', help='compare stage barriers with depends= in parallel.py')
+    parallel_parser.add_argument('-s', metavar='n', dest='num_streams', type=int,
+                                 default=3, help='set number of streams to n')
+    parallel_parser.add_argument('-i', metavar='n', dest='num_iterations',
+                                 type=int, default=3,
+                                 help='set number of iterations to n')
+    parallel_parser.add_argument('-k', metavar='n', dest='num_shards', type=int,
+                                 default=6, help='set shards per iteration to n')
+    parallel_parser.add_argument('-j', metavar='n', dest='num_jobs', type=int,
+                                 default=8, help='set number of slots to n')
+    parallel_parser.add_argument('-t', metavar='f', dest='scale', type=float,
+                                 default=1.0,
+                                 help='set scale of job durations to f')
+    parallel_parser.set_defaults(function=benchmark_parallel)
+
+    cache_parser = subparsers.add_parser(
+        'cache', help='measure reruns with the result cache of parallel.py')
+    cache_parser.add_argument('-s', metavar='n', dest='num_streams', type=int,
+                              default=3, help='set number of streams to n')
+    cache_parser.add_argument('-i', metavar='n', dest='num_iterations',
+                              type=int, default=3,
+                              help='set number of iterations to n')
+    cache_parser.add_argument('-k', metavar='n', dest='num_shards', type=int,
+                              default=6, help='set shards per iteration to n')
+    cache_parser.add_argument('-j', metavar='n', dest='num_jobs', type=int,
+                              default=8, help='set number of slots to n')
+    cache_parser.add_argument('-t', metavar='f', dest='scale', type=float,
+                              default=0.5,
+                              help='set scale of job durations to f')
+    cache_parser.set_defaults(function=benchmark_cache)
+
+    remote_parser = subparsers.add_parser(
+        'remote', help='run parallel.py -e remote with workers on localhost')
+    remote_parser.add_argument('-w', metavar='n', dest='num_workers', type=int,
+                               default=3, help='set number of workers to n')
+    remote_parser.add_argument('-j', metavar='n', dest='num_slots', type=int,
+                               default=2, help='set slots per worker to n')
+    remote_parser.add_argument('-P', metavar='n', dest='prefetch', type=int,
+                               default=2,
+                               help='set queued sections per slot to n')
+    remote_parser.add_argument('-s', metavar='n', dest='num_streams', type=int,
+                               default=3, help='set number of streams to n')
+    remote_parser.add_argument('-i', metavar='n', dest='num_iterations',
+                               type=int, default=3,
+                               help='set number of iterations to n')
+    remote_parser.add_argument('-k', metavar='n', dest='num_shards', type=int,
+                               default=6, help='set shards per iteration to n')
+    remote_parser.add_argument('-t', metavar='f', dest='scale', type=float,
+                               default=1.0,
+                               help='set scale of job durations to f')
+    remote_parser.set_defaults(function=benchmark_remote)
+
+    logs_parser = subparsers.add_parser(
+        'logs', help='compare output handling of parallel.py engines')
+    logs_parser.add_argument('-n', metavar='n', dest='num_sections', type=int,
+                             default=200, help='set number of sections to n')
+    logs_parser.add_argument('-L', metavar='n', dest='num_lines', type=int,
+                             default=5000,
+                             help='set output lines per section to n')
+    logs_parser.add_argument('-j', metavar='n', dest='num_jobs', type=int,
+                             default=100, help='set number of slots to n')
+    logs_parser.set_defaults(function=benchmark_logs)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == '__main__':
+    main()
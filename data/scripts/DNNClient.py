@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------- #
+#           The HMM-Based Speech Synthesis System (HTS)             #
+#           developed by HTS Working Group                          #
+#           http://hts.sp.nitech.ac.jp/                             #
+# ----------------------------------------------------------------- #
+#                                                                   #
+#  Copyright (c) 2014-2017  Nagoya Institute of Technology          #
+#                           Department of Computer Science          #
+#                                                                   #
+# All rights reserved.                                              #
+#                                                                   #
+# Redistribution and use in source and binary forms, with or        #
+# without modification, are permitted provided that the following   #
+# conditions are met:                                               #
+#                                                                   #
+# - Redistributions of source code must retain the above copyright  #
+#   notice, this list of conditions and the following disclaimer.   #
+# - Redistributions in binary form must reproduce the above         #
+#   copyright notice, this list of conditions and the following     #
+#   disclaimer in the documentation and/or other materials provided #
+#   with the distribution.                                          #
+# - Neither the name of the HTS working group nor the names of its  #
+#   contributors may be used to endorse or promote products derived #
+#   from this software without specific prior written permission.   #
+#                                                                   #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND            #
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,       #
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF          #
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE          #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS #
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,          #
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED   #
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,     #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON #
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,   #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY    #
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE           #
+# POSSIBILITY OF SUCH DAMAGE.                                       #
+# ----------------------------------------------------------------- #
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import socket
+import time
+
+from six.moves import http_client
+from six.moves import xrange
+
+import DNNDataIO
+from DNNDataIO import format_duration, print_time
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-a', metavar='host', dest='address', type=str,
+                    default='localhost', help='set address of the server')
+parser.add_argument('-p', metavar='n', dest='port', type=int, default=8080,
+                    help='set port of the server')
+parser.add_argument('-M', metavar='dir', dest='gen_dir', type=str, default='.',
+                    help='set directory to write outputs')
+parser.add_argument('-S', metavar='f', dest='script', type=str, required=True,
+                    help='set generation script file to f')
+parser.add_argument('-X', metavar='ext', dest='extension', type=str, default='ffo',
+                    help='set output file extension')
+parser.add_argument('-s', metavar='spkr', dest='spkr', type=str, default=None,
+                    help='set speaker to generate (default: the last speaker)')
+parser.add_argument('-f', dest='send_filenames', action='store_true',
+                    help='send file names instead of data (shared file system)')
+
+
+def request(connection, body, content_type, spkr=None):
+    headers = {'Content-Type': content_type}
+    if spkr is not None:
+        headers['X-Speaker'] = spkr
+    connection.request('POST', '/synthesize', body, headers)
+    response = connection.getresponse()
+    data = response.read()
+    if response.status != 200:
+        raise IOError('server returned %d %s' % (response.status, response.reason))
+    return response, data
+
+
+def main():
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gen_dir):
+        os.mkdir(args.gen_dir)
+
+    input_filenames, _ = DNNDataIO.get_filenames(args.script)
+    connection = http_client.HTTPConnection(args.address, args.port)
+    connection.connect()
+    connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    latencies = []
+    print_time('Start requesting')
+    for i in xrange(len(input_filenames)):
+        basename = os.path.splitext(
+            os.path.basename(input_filenames[i]))[0]
+        basename = os.path.join(args.gen_dir, basename)
+        if args.extension == '':
+            predict_filename = basename
+        else:
+            predict_filename = basename + '.' + args.extension
+
+        start_time = time.time()
+        if args.send_filenames:
+            body = json.dumps({'input': os.path.abspath(input_filenames[i]),
+                               'output': os.path.abspath(predict_filename),
+                               'speaker': args.spkr})
+            _, data = request(connection, body, 'application/json')
+            synthesis_time = json.loads(data.decode('utf-8'))['synthesis_time']
+        else:
+            with open(input_filenames[i], 'rb') as f:
+                body = f.read()
+            response, data = request(connection, body,
+                                     'application/octet-stream', args.spkr)
+            with open(predict_filename, 'wb') as f:
+                f.write(data)
+            synthesis_time = float(response.getheader('X-Synthesis-Time'))
+        latency = time.time() - start_time
+        latencies.append(latency)
+
+        print('  Processing %s: latency %s (synthesis %s)' %
+              (input_filenames[i], format_duration(latency),
+               format_duration(synthesis_time)))
+
+    connection.close()
+
+    if len(latencies) > 0:
+        latencies = sorted(latencies)
+        print('  %d requests: mean latency %s, median %s, max %s' %
+              (len(latencies), format_duration(sum(latencies) / len(latencies)),
+               format_duration(latencies[len(latencies) // 2]),
+               format_duration(latencies[-1])))
+    print_time('End requesting')
+    print()
+
+
+if __name__ == '__main__':
+    main()
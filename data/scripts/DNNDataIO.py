@@ -42,16 +42,33 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import datetime
+import multiprocessing
 import numpy as np
 import os
 import re
-import struct
 import threading
+import traceback
 import yaml
 import ConfigParser
 
+from six.moves import queue
 from six.moves import xrange
-import tensorflow as tf
+
+
+def print_time(message):
+    date = datetime.datetime.today().strftime('%x %X')
+    print(message, 'at', date)
+
+
+def format_duration(duration):
+    if duration >= 1000:
+        return '%.1f hour' % (duration / 3600)
+    elif duration >= 100:
+        return '%.1f min' % (duration / 60)
+    else:
+        return '%.2f sec' % (duration)
 
 
 class DataReader(object):
@@ -64,30 +81,55 @@ class DataReader(object):
                  spkr_pattern=None,
                  train_spkrs=None,
                  seed=None):
+        # TensorFlow is only needed for training; the file utilities below
+        # are also used by the TensorFlow-free DNNEngine.py
+        import tensorflow as tf
+
         # Dimension
         self._num_input_dimensions, self._num_output_dimensions = num_io_dimensions
 
-        # File
-        size = 0
-        files = []
-        for filenames in open(script, 'r'):
-            files.append(filenames.rstrip())
-            input_filename, _ = filenames.split(' ', 1)
-            stat = os.stat(input_filename)
-            size = size + stat.st_size
-        self._files = np.asarray(files)
-        self._num_examples = size // (4 * self._num_input_dimensions)
-        self._num_files = len(files)
-
         # Speaker
         self._spkr_pattern = spkr_pattern
         self._spkr2id = dict()
         for i in xrange(len(train_spkrs)):
             self._spkr2id[train_spkrs[i]] = i
 
+        # File
+        self._packed = os.path.isdir(script)
+        if self._packed:
+            # Pre-packed corpus made by DNNPack.py; files are utterance ids
+            index = load_packed_index(script, num_io_dimensions)
+            self._shards = index['shards']
+            self._starts = index['starts']
+            self._lengths = index['lengths']
+            self._spkr_ids = np.asarray(
+                [self._spkr2id[spkr] if len(self._spkr2id) > 1 else 0
+                 for spkr in index['spkrs']], np.int32)
+            self._files = np.arange(len(self._lengths))
+            self._file_lengths = self._lengths
+            self._num_examples = int(np.sum(self._lengths))
+            self._max_examples = int(np.max(self._lengths))
+            self._num_files = len(self._lengths)
+            self._shard_data = map_packed_shards(script, num_io_dimensions)
+        else:
+            sizes = []
+            files = []
+            for filenames in open(script, 'r'):
+                files.append(filenames.rstrip())
+                input_filename, _ = filenames.split(' ', 1)
+                stat = os.stat(input_filename)
+                sizes.append(stat.st_size)
+            self._files = np.asarray(files)
+            self._file_lengths = (np.asarray(sizes, np.int64) //
+                                  (4 * self._num_input_dimensions))
+            self._num_examples = int(np.sum(self._file_lengths))
+            self._max_examples = int(np.max(self._file_lengths))
+            self._num_files = len(files)
+
         # Queue
         self._coord = coord
         self._frame_by_frame = frame_by_frame
+        self._queue_size = queue_size
         if frame_by_frame:
             min_after_dequeue = int(queue_size * 0.8)
             self._queue = tf.RandomShuffleQueue(
@@ -109,22 +151,31 @@ class DataReader(object):
         else:
             self._queue = tf.PaddingFIFOQueue(
                 queue_size,
-                ['float32', 'float32', 'int32'],
+                ['float32', 'float32', 'int32', 'int32'],
                 shapes=[[None, self._num_input_dimensions],
-                        [None, self._num_output_dimensions], [1]])
+                        [None, self._num_output_dimensions], [1], []])
             self._input_placeholder = tf.placeholder(
                 tf.float32, shape=None)
             self._output_placeholder = tf.placeholder(
                 tf.float32, shape=None)
             self._spkr_ids_placeholder = tf.placeholder(
                 tf.int32, shape=None)
+            self._length_placeholder = tf.placeholder(
+                tf.int32, shape=[])
             self._enqueue = self._queue.enqueue(
                 [self._input_placeholder,
                  self._output_placeholder,
-                 self._spkr_ids_placeholder])
+                 self._spkr_ids_placeholder,
+                 self._length_placeholder])
+
+        # Closing the queue wakes up the trainer when the input pipeline fails
+        self._close = self._queue.close(cancel_pending_enqueues=True)
 
         # Other
         self._rng = np.random.RandomState(seed)
+        self._seed = seed
+        self._batch_size = 1
+        self._workers = None
 
     @property
     def num_input_dimensions(self):
@@ -143,75 +194,566 @@ class DataReader(object):
         return self._num_files
 
     def dequeue(self, batch_size):
-        inputs, outputs, spkr_ids = self._queue.dequeue_many(batch_size)
-        if not self._frame_by_frame:
-            inputs = tf.squeeze(inputs, axis=0)
-            outputs = tf.squeeze(outputs, axis=0)
+        self._batch_size = batch_size
+        if self._frame_by_frame:
+            inputs, outputs, spkr_ids = self._queue.dequeue_many(batch_size)
+        else:
+            inputs, outputs, spkr_ids, _ = self._queue.dequeue_many(batch_size)
+            inputs = inputs[0]
+            outputs = outputs[0]
         return inputs, outputs, spkr_ids
 
-    def start(self, sess, num_threads=1):
+    def dequeue_padded(self, batch_size):
+        # Utterance-level batch zero-padded to the longest utterance:
+        # [batch, frames, dimensions] with the true lengths of the utterances
+        assert not self._frame_by_frame
+        self._batch_size = batch_size
+        return self._queue.dequeue_many(batch_size)
+
+    def size(self):
+        return self._queue.size()
+
+    @property
+    def capacity(self):
+        return self._queue_size
+
+    def start_workers(self, num_workers, prefetch_depth=8, cache_size=0):
+        # Forking is only safe before the session starts its threads, so
+        # trainers call this before creating the session and start() later
+        if num_workers > 0 and self._workers is None and not (
+                cache_size > 0 and self._frame_by_frame):
+            self.__start_workers(num_workers, prefetch_depth)
+
+    def start(self, sess, num_threads=1, num_workers=0, prefetch_depth=8,
+              cache_size=0, lru_size=32):
+        if cache_size > 0 and self._frame_by_frame:
+            self.__build_cache(cache_size, lru_size)
+            target = self.__cache_loop
+        elif num_workers > 0:
+            self.start_workers(num_workers, prefetch_depth)
+            target = self.__prefetch_loop
+        else:
+            target = self.__loop
         for _ in xrange(num_threads):
-            thread = threading.Thread(target=self.__loop, args=(sess,))
+            thread = threading.Thread(target=target, args=(sess,))
             thread.daemon = True
             thread.start()
 
-    def __load_data(self):
-        for filenames in self._files:
+    def __get_num_examples(self, filenames):
+        if self._packed:
+            return int(self._lengths[filenames])
+        else:
+            input_filename, _ = filenames.split(' ', 1)
+            return get_num_frames(input_filename, self._num_input_dimensions)
+
+    def __load_example(self, filenames):
+        if self._packed:
+            shard_inputs, shard_outputs = self._shard_data[
+                self._shards[filenames]]
+            start = self._starts[filenames]
+            end = start + self._lengths[filenames]
+            inputs = shard_inputs[start:end]
+            outputs = shard_outputs[start:end]
+            spkr_id = self._spkr_ids[filenames]
+        else:
             input_filename, output_filename = filenames.split(' ', 1)
             inputs = load_binary_data(
                 input_filename, self._num_input_dimensions)
-            num_input_examples = inputs.shape[0]
             outputs = load_binary_data(
                 output_filename, self._num_output_dimensions)
-            num_output_examples = outputs.shape[0]
-            assert num_input_examples == num_output_examples
+            spkr_id = get_spkr_id(filenames, self._spkr_pattern,
+                                  self._spkr2id)
+        num_input_examples = inputs.shape[0]
+        num_output_examples = outputs.shape[0]
+        assert num_input_examples == num_output_examples
+
+        return inputs, outputs, spkr_id
+
+    def __enqueue(self, sess, inputs, outputs, spkr_ids):
+        feed_dict = {self._input_placeholder: inputs,
+                     self._output_placeholder: outputs,
+                     self._spkr_ids_placeholder: spkr_ids}
+        if not self._frame_by_frame:
+            feed_dict[self._length_placeholder] = len(inputs)
+        sess.run(self._enqueue, feed_dict=feed_dict)
 
-            if len(self._spkr2id) <= 1:
-                spkr_id = 0
-            else:
-                spkr = re.compile(self._spkr_pattern).search(
-                    filenames).group(1)
-                spkr_id = self._spkr2id[spkr]
+    def __get_epoch_files(self):
+        if self._frame_by_frame:
+            order = self._rng.permutation(self._num_files)
+        else:
+            # Consecutive utterances have similar lengths so that padded
+            # batches waste little computation
+            order = get_bucketed_order(
+                self._file_lengths, self._batch_size, self._rng)
+        return self._files[order]
+
+    def __get_spkr_ids(self, spkr_id, num_examples):
+        if self._frame_by_frame:
+            return np.reshape([spkr_id] * num_examples, [-1, 1])
+        else:
+            return [spkr_id]
 
-            if self._frame_by_frame:
-                spkr_ids = np.reshape([spkr_id] * num_input_examples, [-1, 1])
-            else:
-                spkr_ids = [spkr_id]
+    def __load_data(self):
+        for filenames in self.__get_epoch_files():
+            inputs, outputs, spkr_id = self.__load_example(filenames)
+            num_input_examples = inputs.shape[0]
+            spkr_ids = self.__get_spkr_ids(spkr_id, num_input_examples)
 
             yield inputs, outputs, spkr_ids, num_input_examples
 
     def __loop(self, sess):
         halt = False
         while not halt:
-            self._rng.shuffle(self._files)
             for inputs, outputs, spkr_ids, num_examples in self.__load_data():
                 if self._coord.should_stop():
                     halt = True
                     break
 
-                sess.run(self._enqueue,
-                         feed_dict={self._input_placeholder: inputs,
-                                    self._output_placeholder: outputs,
-                                    self._spkr_ids_placeholder: spkr_ids})
-
-
-def load_binary_data(filename, num_dimensions=1, read_size=4):
-    data = []
-    with open(filename.rstrip(), 'rb') as f:
-        packed_data = f.read(read_size)
-        while packed_data != '':
-            data.extend(struct.unpack('f', packed_data))
-            packed_data = f.read(read_size)
-
-    return np.reshape(np.asarray(data), [-1, num_dimensions])
+                self.__enqueue(sess, inputs, outputs, spkr_ids)
+
+    def __build_cache(self, cache_size, lru_size):
+        # Load as many utterances as fit in cache_size bytes into contiguous
+        # arrays once; the rest is read per epoch through a small LRU cache.
+        frame_size = 4 * (self._num_input_dimensions +
+                          self._num_output_dimensions + 1)
+        max_examples = min(self._num_examples, cache_size // frame_size)
+        self._cache_inputs = np.empty(
+            [max_examples, self._num_input_dimensions], np.float32)
+        self._cache_outputs = np.empty(
+            [max_examples, self._num_output_dimensions], np.float32)
+        self._cache_spkr_ids = np.empty([max_examples, 1], np.int32)
+        self._uncached_files = []
+        num_examples = 0
+        for filenames in self._files:
+            num_file_examples = self.__get_num_examples(filenames)
+            if num_examples + num_file_examples > max_examples:
+                self._uncached_files.append(filenames)
+                continue
+            inputs, outputs, spkr_id = self.__load_example(filenames)
+            end = num_examples + num_file_examples
+            self._cache_inputs[num_examples:end] = inputs
+            self._cache_outputs[num_examples:end] = outputs
+            self._cache_spkr_ids[num_examples:end] = spkr_id
+            num_examples = end
+        self._num_cached_examples = num_examples
+        self._lru = LRUCache(lru_size)
+        self._lru_lock = threading.Lock()
+
+    def __load_uncached_data(self):
+        # Visit the utterances still held by the LRU cache first so that
+        # they are hit before being evicted by the rest of the epoch.
+        with self._lru_lock:
+            cached = [f for f in self._uncached_files if f in self._lru]
+        uncached = [f for f in self._uncached_files if f not in self._lru]
+        self._rng.shuffle(cached)
+        self._rng.shuffle(uncached)
+        for filenames in cached + uncached:
+            with self._lru_lock:
+                example = self._lru.get(filenames)
+            if example is None:
+                inputs, outputs, spkr_id = self.__load_example(filenames)
+                example = (np.array(inputs), np.array(outputs),
+                           self.__get_spkr_ids(spkr_id, inputs.shape[0]))
+                with self._lru_lock:
+                    self._lru.put(filenames, example)
+            yield example
+
+    def __cache_loop(self, sess):
+        batch_size = max(self._batch_size, 1)
+        while not self._coord.should_stop():
+            # Shuffling is an index permutation over the cached frames
+            order = self._rng.permutation(self._num_cached_examples)
+            batches = [order[i:i + batch_size]
+                       for i in xrange(0, len(order), batch_size)]
+            uncached_data = self.__load_uncached_data()
+            num_uncached = len(self._uncached_files)
+            is_uncached = np.zeros(len(batches) + num_uncached, np.bool_)
+            is_uncached[:num_uncached] = True
+            self._rng.shuffle(is_uncached)
+
+            j = 0
+            for uncached in is_uncached:
+                if self._coord.should_stop():
+                    break
+                if uncached:
+                    inputs, outputs, spkr_ids = next(uncached_data)
+                else:
+                    index = batches[j]
+                    j += 1
+                    inputs = self._cache_inputs[index]
+                    outputs = self._cache_outputs[index]
+                    spkr_ids = self._cache_spkr_ids[index]
+
+                self.__enqueue(sess, inputs, outputs, spkr_ids)
+
+    def __start_workers(self, num_workers, prefetch_depth):
+        # Worker processes decode (and in frame-by-frame mode shuffle) whole
+        # utterances into shared memory slots large enough for the longest
+        # utterance; feeder threads only copy the slots into the queue, in
+        # the order the utterances were dispatched.
+        num_dimensions = self._num_input_dimensions + self._num_output_dimensions
+        self._slots = [multiprocessing.RawArray('f', self._max_examples * num_dimensions)
+                       for _ in xrange(prefetch_depth)]
+        self._free_slots = queue.Queue()
+        for i in xrange(prefetch_depth):
+            self._free_slots.put(i)
+        self._tasks = multiprocessing.Queue()
+        self._results = multiprocessing.Queue()
+        self._reorder = dict()
+        self._reorder_lock = threading.Lock()
+        self._next_index = 0
+        # Separate from self._rng so that the epochs are the same as without
+        # workers
+        self._task_rng = np.random.RandomState(
+            None if self._seed is None else [self._seed, 1])
+
+        self._workers = []
+        for i in xrange(num_workers):
+            worker = multiprocessing.Process(target=self.__worker)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+        thread = threading.Thread(target=self.__dispatch_loop)
+        thread.daemon = True
+        thread.start()
+
+    def __get_slot(self, slot, num_examples):
+        data = np.frombuffer(self._slots[slot], np.float32)
+        data = np.reshape(
+            data[:num_examples * (self._num_input_dimensions +
+                                  self._num_output_dimensions)],
+            [num_examples, -1])
+        return (data[:, :self._num_input_dimensions],
+                data[:, self._num_input_dimensions:])
+
+    def __dispatch_loop(self):
+        # A task takes its slot here, so the oldest pending utterance never
+        # waits for a slot held by a newer one, and carries its own seed, so
+        # the result does not depend on which worker runs it
+        index = 0
+        while not self._coord.should_stop():
+            for filenames in self.__get_epoch_files():
+                if self._coord.should_stop():
+                    break
+                slot = self.__get_free_slot()
+                if slot is None:
+                    break
+                seed = self._task_rng.randint(np.iinfo(np.int32).max)
+                self._tasks.put((index, filenames, slot, seed))
+                index += 1
+
+    def __get_free_slot(self):
+        while not self._coord.should_stop():
+            try:
+                return self._free_slots.get(timeout=1.0)
+            except queue.Empty:
+                continue
+        return None
+
+    def __worker(self):
+        while True:
+            index, filenames, slot, seed = self._tasks.get()
+            try:
+                inputs, outputs, spkr_id = self.__load_example(filenames)
+                num_examples = inputs.shape[0]
+                if self._frame_by_frame:
+                    order = np.random.RandomState(seed).permutation(num_examples)
+                    inputs = inputs[order]
+                    outputs = outputs[order]
+
+                slot_inputs, slot_outputs = self.__get_slot(slot, num_examples)
+                slot_inputs[...] = inputs
+                slot_outputs[...] = outputs
+            except Exception:
+                # Unreadable or short file, or wrong dimensions
+                self._results.put(('error', 'Failed to load %s\n%s' %
+                                   (filenames, traceback.format_exc())))
+                return
+            self._results.put((index, slot, num_examples, spkr_id))
+
+    def __fail(self, sess, message):
+        # Stop training with the error instead of waiting for examples
+        # that never come
+        error = RuntimeError(message)
+        self._coord.request_stop((RuntimeError, error, None))
+        sess.run(self._close)
+
+    def __prefetch_loop(self, sess):
+        while not self._coord.should_stop():
+            try:
+                result = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [worker for worker in self._workers
+                        if not worker.is_alive()]
+                if len(dead) > 0:
+                    self.__fail(sess, 'Data worker %d exited with code %s' %
+                                (dead[0].pid, dead[0].exitcode))
+                    break
+                continue
+            if result[0] == 'error':
+                self.__fail(sess, result[1])
+                break
+            # Results arrive in completion order; hold them back until all
+            # earlier ones are enqueued so that the batches keep the order
+            # of get_bucketed_order
+            with self._reorder_lock:
+                self._reorder[result[0]] = result[1:]
+                while self._next_index in self._reorder:
+                    slot, num_examples, spkr_id = self._reorder.pop(
+                        self._next_index)
+                    self._next_index += 1
+                    inputs, outputs = self.__get_slot(slot, num_examples)
+                    spkr_ids = self.__get_spkr_ids(spkr_id, num_examples)
+                    try:
+                        self.__enqueue(sess, inputs, outputs, spkr_ids)
+                    except Exception:
+                        # The queue was closed after another feeder failed
+                        if self._coord.should_stop():
+                            return
+                        raise
+                    finally:
+                        self._free_slots.put(slot)
+
+
+class LRUCache(object):
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._items = collections.OrderedDict()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        if key not in self._items:
+            return None
+        value = self._items.pop(key)
+        self._items[key] = value
+        return value
+
+    def put(self, key, value):
+        if self._capacity <= 0:
+            return
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self._capacity:
+            self._items.popitem(last=False)
+
+
+def get_bucketed_order(lengths, batch_size, rng):
+    # Sort by length with random tie-breaking, cut into batches and shuffle
+    # the batches. The last batch is filled up with random utterances so
+    # that every epoch stays aligned to the batch size.
+    order = np.lexsort((rng.random_sample(len(lengths)), lengths))
+    remainder = len(order) % batch_size
+    if remainder > 0:
+        order = np.concatenate(
+            [order, rng.choice(order, batch_size - remainder)])
+    batches = [order[i:i + batch_size]
+               for i in xrange(0, len(order), batch_size)]
+    rng.shuffle(batches)
+    return np.concatenate(batches)
+
+
+def get_chunks(num_frames, chunk_size, overlap):
+    # Consecutive [start, end) ranges covering num_frames frames, each
+    # sharing overlap frames with the next one
+    if chunk_size <= 0 or num_frames <= chunk_size:
+        return [(0, num_frames)]
+    if overlap < 0 or overlap >= chunk_size:
+        raise ValueError('overlap %d must be in [0, %d)' % (overlap, chunk_size))
+    chunks = []
+    start = 0
+    while True:
+        end = min(start + chunk_size, num_frames)
+        chunks.append((start, end))
+        if end == num_frames:
+            return chunks
+        start = end - overlap
+
+
+def stitch_chunks(chunks, overlap):
+    # Cross-fade the overlapping frames of consecutive chunks and yield the
+    # stitched frames as soon as no later chunk can change them. Frames
+    # near the edge of a chunk are the least accurate, so the linear ramp
+    # only covers the middle half of the overlap.
+    weights = (np.arange(overlap) + 0.5 - overlap / 4.0) / (overlap / 2.0)
+    weights = np.reshape(np.clip(weights, 0.0, 1.0), [-1, 1])
+    tail = None
+    for chunk in chunks:
+        if tail is not None:
+            chunk = np.array(chunk)
+            chunk[:overlap] = (1.0 - weights) * tail + weights * chunk[:overlap]
+        if overlap > 0 and len(chunk) > overlap:
+            yield chunk[:-overlap]
+            tail = chunk[-overlap:]
+        else:
+            yield chunk
+            tail = None
+    if tail is not None:
+        yield tail
+
+
+def get_num_frames(filename, num_dimensions=1, read_size=4):
+    size = os.path.getsize(filename.rstrip())
+    frame_size = read_size * num_dimensions
+    if size % frame_size != 0:
+        raise ValueError('%s: size %d is not a multiple of %d-dimensional frames'
+                         % (filename.rstrip(), size, num_dimensions))
+    return size // frame_size
+
+
+def map_binary_data(filename, num_dimensions=1, read_size=4):
+    # Map the file without reading it; slicing the result only touches the
+    # pages of the selected frames.
+    dtype = np.float64 if read_size == 8 else np.float32
+    num_frames = get_num_frames(filename, num_dimensions, read_size)
+    if num_frames == 0:
+        # np.memmap cannot map an empty file
+        return np.zeros([0, num_dimensions], dtype)
+    return np.memmap(filename.rstrip(), dtype=dtype, mode='r',
+                     shape=(num_frames, num_dimensions))
+
+
+def load_binary_data(filename, num_dimensions=1, read_size=4,
+                     start=0, num_frames=None):
+    data = map_binary_data(filename, num_dimensions, read_size)
+    if start != 0 or num_frames is not None:
+        end = None if num_frames is None else start + num_frames
+        data = data[start:end]
+    return data
 
 
 def write_binary_data(filename, data, append=False):
     mode = 'ab' if append else 'wb'
     with open(filename, mode) as f:
-        for row in data:
-            for elem in row:
-                f.write(struct.pack('f', elem))
+        f.write(np.ascontiguousarray(data, np.float32).tobytes())
+
+
+class DataWriter(object):
+    # Keeps one open handle per output file so that data produced
+    # incrementally can be appended without reopening the file.
+    def __init__(self, append=False):
+        self._mode = 'ab' if append else 'wb'
+        self._files = dict()
+
+    def write(self, filename, data):
+        f = self._files.get(filename)
+        if f is None:
+            f = open(filename, self._mode)
+            self._files[filename] = f
+        f.write(np.ascontiguousarray(data, np.float32).tobytes())
+
+    def close(self, filename=None):
+        if filename is None:
+            filenames = list(self._files.keys())
+        else:
+            filenames = [filename]
+        for name in filenames:
+            f = self._files.pop(name, None)
+            if f is not None:
+                f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_spkr_id(filenames, spkr_pattern, spkr2id):
+    if len(spkr2id) <= 1:
+        return 0
+    spkr = re.compile(spkr_pattern).search(filenames).group(1)
+    return spkr2id[spkr]
+
+
+def pack_data(script, pack_dir, num_io_dimensions, spkr_pattern=None,
+              train_spkrs=None, max_shard_frames=1000000):
+    # Concatenate all input/output pairs into a few contiguous float32 shards
+    # plus an index of (shard, start, length, speaker) per utterance.
+    num_input_dimensions, num_output_dimensions = num_io_dimensions
+    spkr2id = dict()
+    for i in xrange(len(train_spkrs)):
+        spkr2id[train_spkrs[i]] = i
+
+    if not os.path.exists(pack_dir):
+        os.mkdir(pack_dir)
+
+    files = []
+    shards = []
+    starts = []
+    lengths = []
+    spkr_ids = []
+    shard = 0
+    start = 0
+    with DataWriter() as writer:
+        for filenames in open(script, 'r'):
+            filenames = filenames.rstrip()
+            input_filename, output_filename = filenames.split(' ', 1)
+            inputs = load_binary_data(input_filename, num_input_dimensions)
+            outputs = load_binary_data(output_filename, num_output_dimensions)
+            if inputs.shape[0] != outputs.shape[0]:
+                raise ValueError('%s: %d input frames but %d output frames' %
+                                 (filenames, inputs.shape[0], outputs.shape[0]))
+
+            if start > 0 and start + inputs.shape[0] > max_shard_frames:
+                writer.close()
+                shard += 1
+                start = 0
+            input_shard, output_shard = get_shard_filenames(pack_dir, shard)
+            writer.write(input_shard, inputs)
+            writer.write(output_shard, outputs)
+
+            files.append(filenames)
+            shards.append(shard)
+            starts.append(start)
+            lengths.append(inputs.shape[0])
+            spkr_ids.append(get_spkr_id(filenames, spkr_pattern, spkr2id))
+            start += inputs.shape[0]
+
+    np.savez(os.path.join(pack_dir, 'index.npz'),
+             files=np.asarray(files),
+             shards=np.asarray(shards, np.int32),
+             starts=np.asarray(starts, np.int64),
+             lengths=np.asarray(lengths, np.int64),
+             spkr_ids=np.asarray(spkr_ids, np.int32),
+             train_spkrs=np.asarray(train_spkrs),
+             num_io_dimensions=np.asarray(num_io_dimensions, np.int32),
+             num_shards=np.asarray(shard + 1, np.int32))
+
+    return len(files), int(np.sum(lengths)), shard + 1
+
+
+def get_shard_filenames(pack_dir, shard):
+    basename = os.path.join(pack_dir, 'shard%03d' % shard)
+    return basename + '.ffi', basename + '.ffo'
+
+
+def load_packed_index(pack_dir, num_io_dimensions):
+    index = dict(np.load(os.path.join(pack_dir, 'index.npz')))
+    if tuple(index['num_io_dimensions']) != tuple(num_io_dimensions):
+        raise ValueError('%s was packed with %s dimensions, not %s' %
+                         (pack_dir, tuple(index['num_io_dimensions']),
+                          tuple(num_io_dimensions)))
+    # Speaker names instead of ids so that the reader can remap them
+    index['spkrs'] = index['train_spkrs'][index['spkr_ids']]
+    return index
+
+
+def map_packed_shards(pack_dir, num_io_dimensions):
+    num_input_dimensions, num_output_dimensions = num_io_dimensions
+    index = np.load(os.path.join(pack_dir, 'index.npz'))
+    shard_data = []
+    for shard in xrange(int(index['num_shards'])):
+        input_shard, output_shard = get_shard_filenames(pack_dir, shard)
+        shard_data.append(
+            (map_binary_data(input_shard, num_input_dimensions),
+             map_binary_data(output_shard, num_output_dimensions)))
+    return shard_data
 
 
 def load_window(filename, padding=3):
@@ -112,13 +112,20 @@ def get_variables(name, find=True):
 
 def inference(inputs, spkr_ids, num_io_units, num_hidden_units, num_spkrs, num_feats,
               hidden_activation, output_activation, keep_prob, mode, seed=None,
-              initial_variances=None, initial_gv_variances=None):
+              initial_variances=None, initial_gv_variances=None,
+              fold_spkr_biases=False):
     tf.set_random_seed(seed)
 
     num_input_units, num_output_units = num_io_units
     hidden_activation_function = get_activation_function(hidden_activation)
     output_activation_function = get_activation_function(output_activation)
-    auxially_inputs = tf.squeeze(tf.one_hot(spkr_ids, num_spkrs), axis=1)
+    if fold_spkr_biases:
+        # All frames belong to the one speaker in spkr_ids, so its row of
+        # sd_weights is added to the biases once instead of multiplying a
+        # one-hot vector on every frame
+        spkr_id = tf.reshape(spkr_ids, [1])
+    else:
+        auxially_inputs = tf.squeeze(tf.one_hot(spkr_ids, num_spkrs), axis=1)
 
     hidden_outputs = None
     num_hidden_layers = len(num_hidden_units)
@@ -149,6 +156,10 @@ def inference(inputs, spkr_ids, num_io_units, num_hidden_units, num_spkrs, num_f
             if mode == 'SD':
                 hidden_outputs = hidden_activation_function(
                     tf.matmul(hidden_inputs, si_weights) + si_biases)
+            elif fold_spkr_biases:
+                hidden_outputs = hidden_activation_function(
+                    tf.matmul(hidden_inputs, si_weights) +
+                    (si_biases + tf.gather(sd_weights, spkr_id)))
             elif mode == 'SAT' or mode == 'ADAPT':
                 hidden_outputs = hidden_activation_function(
                     tf.matmul(hidden_inputs, si_weights) + si_biases +
@@ -185,8 +196,12 @@ def inference(inputs, spkr_ids, num_io_units, num_hidden_units, num_spkrs, num_f
             initial_gv_variances = np.ones([num_spkrs, num_feats], np.float32)
         gv_variances = initial_gv_variances
 
-        picked_variances = tf.matmul(auxially_inputs, variances)
-        picked_gv_variances = tf.matmul(auxially_inputs, gv_variances)
+        if fold_spkr_biases:
+            picked_variances = tf.gather(variances, spkr_id)
+            picked_gv_variances = tf.gather(gv_variances, spkr_id)
+        else:
+            picked_variances = tf.matmul(auxially_inputs, variances)
+            picked_gv_variances = tf.matmul(auxially_inputs, gv_variances)
 
     return outputs, picked_variances, picked_gv_variances
 
@@ -237,6 +252,215 @@ def cost(predicted_outputs, observed_outputs, variances):
     return cost, predicted_outputs
 
 
+def flatten_padded_batch(inputs, spkr_ids):
+    # [batch, frames, dimensions] -> [batch * frames, dimensions] with one
+    # speaker id per frame so that inference() can run on padded batches
+    num_dimensions = inputs.get_shape()[-1].value
+    num_frames = tf.shape(inputs)[1]
+    flat_inputs = tf.reshape(inputs, [-1, num_dimensions])
+    flat_spkr_ids = tf.reshape(tf.tile(spkr_ids, [1, num_frames]), [-1, 1])
+    return flat_inputs, flat_spkr_ids
+
+
+def unflatten_padded_batch(outputs, variances, gv_variances, padded_inputs):
+    # Inverse of flatten_padded_batch for the results of inference();
+    # variances are the same for all frames of an utterance
+    batch_shape = tf.shape(padded_inputs)[:2]
+    outputs = tf.reshape(
+        outputs, tf.concat([batch_shape, tf.shape(outputs)[1:]], 0))
+    variances = tf.reshape(
+        variances, tf.concat([batch_shape, tf.shape(variances)[1:]], 0))[:, 0]
+    gv_variances = tf.reshape(
+        gv_variances, tf.concat([batch_shape, tf.shape(gv_variances)[1:]], 0))[:, 0]
+    return outputs, variances, gv_variances
+
+
+def dense_mlpg(mu, precisions, mask, observed_c, window_vector, num_windows):
+    # MLPG with dense [T, 3T] window matrices and a full Cholesky
+    # decomposition of the [T, T] precision matrix WSW
+    window_width = len(window_vector[0]) // num_windows
+    half_window_width = (window_width - 1) // 2
+    D = len(window_vector)
+    T = tf.shape(mask)[1]
+
+    def create_window_matrix(window_vector, transpose=False):
+        half_window_vector = tf.transpose(
+            tf.slice(tf.transpose(window_vector), [0, 0],
+                     [num_windows * (window_width + 1) // 2, D]))
+        zero_vector = tf.zeros(
+            [D, num_windows * (T - half_window_width)])
+
+        W = tf.concat([window_vector, zero_vector], 1)
+        W = tf.tile(W, [1, T - 1])
+        W = tf.concat([W, half_window_vector], 1)
+        W = tf.reshape(W, [D, T, -1])
+        W = tf.slice(W, [0, 0, num_windows * half_window_width],
+                     [D, T, 3 * T])
+        if not transpose:
+            W = tf.matrix_transpose(W)
+        return W
+
+    # Padded frames neither observe (zero precision) nor are observed by
+    # the windows of the valid frames (zero columns); an identity block
+    # keeps WSW positive definite and gives c = 0 for them.
+    window_mask = tf.reshape(
+        tf.tile(tf.expand_dims(mask, 2), [1, 1, num_windows]), [-1, 1, 1, num_windows * T])
+    window_precisions = tf.tile(precisions, [1, 1, T])
+    window_precisions = tf.expand_dims(window_precisions, 2) * window_mask
+
+    W = create_window_matrix(window_vector, False)
+    W = tf.expand_dims(W, 0) * tf.reshape(mask, [-1, 1, 1, T])
+    WS = tf.matrix_transpose(W) * window_precisions
+
+    mu = tf.transpose(mu, perm=[0, 2, 1, 3])
+    mu = tf.reshape(mu, [tf.shape(mu)[0], D, -1, 1])
+
+    WSW = tf.matmul(WS, W) + tf.expand_dims(tf.matrix_diag(1.0 - mask), 1)
+    WSW_cholesky = tf.cholesky(WSW)
+
+    r = tf.matmul(WS, mu)
+
+    predicted_c = tf.cholesky_solve(WSW_cholesky, r)
+    subtracted_c = tf.expand_dims(observed_c, 3) - predicted_c
+
+    covdet = -2.0 * tf.reduce_sum(
+        tf.log(tf.matrix_diag_part(WSW_cholesky)), axis=[1, 2])
+    mahala = tf.reduce_sum(
+        subtracted_c * tf.matmul(WSW, subtracted_c), axis=[1, 2, 3])
+
+    return tf.squeeze(predicted_c, 3), covdet, mahala
+
+
+def get_window_coefficients(window_vector, num_windows):
+    # window_vector rows hold [w_k(j) for k in windows] for j = width-1, ..., 0;
+    # returns w[d, k, j] in the order of the window files
+    window_width = len(window_vector[0]) // num_windows
+    windows = np.reshape(
+        window_vector, [len(window_vector), window_width, num_windows])
+    return np.transpose(windows[:, ::-1, :], [0, 2, 1])
+
+
+def shift_frames(x, shift, axis):
+    # y[t] = x[t - shift] along axis with zero padding
+    paddings = [[0, 0] for _ in xrange(len(x.get_shape()))]
+    length = tf.shape(x)[axis]
+    begin = [0] * len(paddings)
+    size = [-1] * len(paddings)
+    if shift >= 0:
+        paddings[axis][0] = shift
+    else:
+        paddings[axis][1] = -shift
+        begin[axis] = -shift
+    size[axis] = length
+    return tf.slice(tf.pad(x, paddings), begin, size)
+
+
+def banded_mlpg(mu, precisions, mask, observed_c, window_vector, num_windows):
+    # MLPG exploiting that WSW is banded with bandwidth 2 * (half window
+    # width): the bands are built directly from the windows and WSW is
+    # factorized and solved by a banded Cholesky decomposition, so that
+    # time and memory are linear in the number of frames.
+    windows = get_window_coefficients(window_vector, num_windows).astype(np.float32)
+    window_width = windows.shape[2]
+    h = (window_width - 1) // 2
+    p = 2 * h
+    B = tf.shape(mask)[0]
+    D = len(window_vector)
+
+    mu = tf.transpose(mu, perm=[0, 2, 1, 3])
+    frame_precisions = (tf.expand_dims(precisions, 2) *
+                        tf.reshape(mask, [-1, 1, tf.shape(mask)[1], 1]))
+    weighted_mu = frame_precisions * mu
+
+    # bands[j][b, d, t] = WSW[t, t + j] and r = WS mu
+    frame_mask = tf.expand_dims(mask, 1)
+    bands = []
+    for j in xrange(p + 1):
+        band = 0.0
+        for a in xrange(-h, h - j + 1):
+            coefficients = windows[:, :, a + h] * windows[:, :, a + h + j]
+            band += tf.reduce_sum(
+                shift_frames(frame_precisions, a, 2) *
+                np.reshape(coefficients, [1, D, 1, num_windows]), axis=3)
+        bands.append(band * frame_mask * shift_frames(frame_mask, -j, 2))
+    bands[0] += 1.0 - frame_mask
+    r = 0.0
+    for a in xrange(-h, h + 1):
+        r += tf.reduce_sum(
+            shift_frames(weighted_mu, a, 2) *
+            np.reshape(windows[:, :, a + h], [1, D, 1, num_windows]), axis=3)
+    r *= frame_mask
+
+    # Row t of WSW within the band: [WSW[t - p, t], ..., WSW[t, t]]
+    band_rows = tf.stack(
+        [shift_frames(bands[p - i], p - i, 2) for i in xrange(p)] + [bands[0]],
+        axis=3)
+    band_rows = tf.transpose(band_rows, perm=[2, 0, 1, 3])
+    r = tf.transpose(r, perm=[2, 0, 1])
+
+    def forward_step(state, elems):
+        # One row of the Cholesky factor L and of the solution of L y = r;
+        # the state keeps the previous p rows of L and y.
+        prev_L, prev_y = state
+        a, r_t = elems
+        row = []
+        for i in xrange(p):
+            value = a[:, :, i]
+            for m in xrange(i):
+                value -= row[m] * prev_L[:, :, i, m - i + p]
+            row.append(value / prev_L[:, :, i, p])
+        diag = a[:, :, p]
+        for i in xrange(p):
+            diag -= tf.square(row[i])
+        row.append(tf.sqrt(diag))
+        y_t = r_t
+        for i in xrange(p):
+            y_t -= row[i] * prev_y[:, :, i]
+        y_t /= row[p]
+        L_t = tf.stack(row, axis=2)
+        return (tf.concat([prev_L[:, :, 1:], tf.expand_dims(L_t, 2)], 2),
+                tf.concat([prev_y[:, :, 1:], tf.expand_dims(y_t, 2)], 2))
+
+    # Rows before the first frame are those of an identity matrix
+    initial_L = np.zeros([1, 1, p, p + 1], np.float32)
+    initial_L[:, :, :, p] = 1.0
+    initial_L = tf.tile(initial_L, [B, D, 1, 1])
+    initial_y = tf.zeros([B, D, p])
+    L, y = tf.scan(forward_step, (band_rows, r),
+                   initializer=(initial_L, initial_y))
+    L = L[:, :, :, p - 1]
+    y = y[:, :, :, p - 1]
+    L_diag = L[:, :, :, p]
+
+    # Solve L^T c = y backwards in time; L[t + i, t] for i = 1, ..., p
+    L_cols = tf.stack(
+        [shift_frames(L[:, :, :, p - i], -i, 0) for i in xrange(1, p + 1)],
+        axis=3)
+
+    def backward_step(prev_c, elems):
+        y_t, diag_t, col_t = elems
+        c_t = (y_t - tf.reduce_sum(col_t * prev_c, axis=2)) / diag_t
+        return tf.concat([tf.expand_dims(c_t, 2), prev_c[:, :, :-1]], 2)
+
+    c = tf.scan(backward_step,
+                (tf.reverse(y, [0]), tf.reverse(L_diag, [0]), tf.reverse(L_cols, [0])),
+                initializer=tf.zeros([B, D, p]))
+    predicted_c = tf.transpose(tf.reverse(c[:, :, :, 0], [0]), perm=[1, 2, 0])
+
+    covdet = -2.0 * tf.reduce_sum(tf.log(L_diag), axis=[0, 2])
+    subtracted_c = observed_c - predicted_c
+    mahala = bands[0] * tf.square(subtracted_c)
+    for j in xrange(1, p + 1):
+        mahala += 2.0 * bands[j] * subtracted_c * shift_frames(subtracted_c, -j, 2)
+    mahala = tf.reduce_sum(mahala, axis=[1, 2])
+
+    return predicted_c, covdet, mahala
+
+
+mlpg_solvers = {'dense': dense_mlpg, 'banded': banded_mlpg}
+default_mlpg_solver = 'banded'
+
+
 def trajectory_cost(predicted_outputs,
                     observed_outputs,
                     variances,
@@ -246,14 +470,25 @@ def trajectory_cost(predicted_outputs,
                     num_windows,
                     window_vector,
                     msd_weight=1e-0,
-                    gv_weight=1e-6):
-    window_width = len(window_vector[0]) // num_windows
-    half_window_width = (window_width - 1) // 2
+                    gv_weight=1e-6,
+                    lengths=None,
+                    solver=default_mlpg_solver):
+    # If lengths is given, the outputs are zero-padded batches of
+    # [batch, frames, dimensions] and the variances are [batch, dimensions].
+    # Otherwise a single utterance of [frames, dimensions] is assumed.
+    batched = lengths is not None
+    if batched:
+        lengths = tf.convert_to_tensor(lengths, tf.int32)
+    else:
+        predicted_outputs = tf.expand_dims(predicted_outputs, 0)
+        observed_outputs = tf.expand_dims(observed_outputs, 0)
+        lengths = tf.shape(predicted_outputs)[1:2]
 
-    T = tf.shape(predicted_outputs)[0]
-    float_T = tf.cast(T, tf.float32)
+    T = tf.shape(predicted_outputs)[1]
+    float_T = tf.cast(lengths, tf.float32)
     D = sum(num_feature_dimensions)
     msd_D = sum(msd_flags)
+    mask = tf.sequence_mask(lengths, T, dtype=tf.float32)
 
     num_splits = []
     feature_types = []
@@ -265,7 +500,7 @@ def trajectory_cost(predicted_outputs,
             num_splits.append(num_feature_dimensions[i])
             feature_types.append(j)
 
-    split_predicted_outputs = tf.split(predicted_outputs, num_splits, axis=1)
+    split_predicted_outputs = tf.split(predicted_outputs, num_splits, axis=2)
     msd_predicted_outputs = []
     static_predicted_outputs = []
     delta_predicted_outputs = [[] for _ in xrange(num_windows - 1)]
@@ -277,16 +512,16 @@ def trajectory_cost(predicted_outputs,
         else:
             delta_predicted_outputs[feature_types[i] -
                                     1].append(split_predicted_outputs[i])
-    msd_predicted_outputs = tf.concat(msd_predicted_outputs, 1)
+    msd_predicted_outputs = tf.concat(msd_predicted_outputs, 2)
     static_predicted_outputs = tf.expand_dims(
-        tf.concat(static_predicted_outputs, 1), 2)
+        tf.concat(static_predicted_outputs, 2), 3)
     for i in xrange(num_windows - 1):
         delta_predicted_outputs[i] = tf.expand_dims(
-            tf.concat(delta_predicted_outputs[i], 1), 2)
+            tf.concat(delta_predicted_outputs[i], 2), 3)
     sorted_predicted_outputs = tf.concat(
-        [static_predicted_outputs, tf.concat(delta_predicted_outputs, 2)], 2)
+        [static_predicted_outputs, tf.concat(delta_predicted_outputs, 3)], 3)
 
-    split_observed_outputs = tf.split(observed_outputs, num_splits, axis=1)
+    split_observed_outputs = tf.split(observed_outputs, num_splits, axis=2)
     msd_observed_outputs = []
     static_observed_outputs = []
     for i in xrange(len(feature_types)):
@@ -294,8 +529,8 @@ def trajectory_cost(predicted_outputs,
             msd_observed_outputs.append(split_observed_outputs[i])
         elif feature_types[i] == 0:
             static_observed_outputs.append(split_observed_outputs[i])
-    msd_observed_outputs = tf.concat(msd_observed_outputs, 1)
-    static_observed_outputs = tf.concat(static_observed_outputs, 1)
+    msd_observed_outputs = tf.concat(msd_observed_outputs, 2)
+    static_observed_outputs = tf.concat(static_observed_outputs, 2)
 
     split_precisions = tf.split(tf.reciprocal(variances), num_splits, axis=1)
     msd_precisions = []
@@ -312,81 +547,54 @@ def trajectory_cost(predicted_outputs,
     static_precisions = tf.concat(static_precisions, 1)
     for i in xrange(num_windows - 1):
         delta_precisions[i] = tf.concat(delta_precisions[i], 1)
-    sorted_precisions = tf.transpose(tf.concat(
-        [static_precisions, tf.concat(delta_precisions, 0)], 0))
+    sorted_precisions = tf.stack(
+        [static_precisions] + delta_precisions, axis=2)
 
-    def create_window_matrix(window_vector, transpose=False):
-        half_window_vector = tf.transpose(
-            tf.slice(tf.transpose(window_vector), [0, 0],
-                     [num_windows * (window_width + 1) // 2, D]))
-        zero_vector = tf.zeros(
-            [D, num_windows * (T - half_window_width)])
+    observed_c = tf.transpose(static_observed_outputs, perm=[0, 2, 1])
+    observed_c = observed_c * tf.expand_dims(mask, 1)
 
-        W = tf.concat([window_vector, zero_vector], 1)
-        W = tf.tile(W, [1, T - 1])
-        W = tf.concat([W, half_window_vector], 1)
-        W = tf.reshape(W, [D, T, -1])
-        W = tf.slice(W, [0, 0, num_windows * half_window_width],
-                     [D, T, 3 * T])
-        if not transpose:
-            W = tf.matrix_transpose(W)
-        return W
-
-    window_precision_vector = window_vector * tf.tile(
-        tf.reshape(sorted_precisions, [D, num_windows]),
-        [1, window_width])
-
-    mu = tf.transpose(sorted_predicted_outputs, perm=[1, 0, 2])
-    mu = tf.reshape(mu, [D, -1, 1])
-
-    W = create_window_matrix(window_vector, False)
-    WS = create_window_matrix(window_precision_vector, True)
-
-    WSW = tf.matmul(WS, W)
-    WSW_cholesky = tf.cholesky(WSW)
-
-    P = tf.cholesky_solve(WSW_cholesky, tf.eye(T, batch_shape=[D]))
-    r = tf.matmul(WS, mu)
-
-    predicted_c = tf.matmul(P, r)
-    observed_c = tf.expand_dims(tf.transpose(static_observed_outputs), -1)
-    subtracted_c = observed_c - predicted_c
+    if solver not in mlpg_solvers:
+        raise ValueError('unknown mlpg_solver %s' % solver)
+    predicted_c, trj_covdet, trj_mahala = mlpg_solvers[solver](
+        sorted_predicted_outputs, sorted_precisions, mask, observed_c,
+        window_vector, num_windows)
 
-    trj_gconst = tf.cast(D * T * np.log(2.0 * np.pi), tf.float32)
-    trj_covdet = -2.0 * \
-        tf.reduce_sum(tf.log(tf.matrix_diag_part(WSW_cholesky)))
-    trj_mahala = tf.reduce_sum(tf.matmul(tf.matrix_transpose(subtracted_c),
-                                         tf.matmul(WSW, subtracted_c)))
+    trj_gconst = tf.cast(D * lengths * np.log(2.0 * np.pi), tf.float32)
     trj_cost = (trj_gconst + trj_covdet + trj_mahala) / (2.0 * D * float_T)
 
-    msd_gconst = tf.cast(msd_D * T * np.log(2.0 * np.pi), tf.float32)
-    msd_covdet = -float_T * tf.reduce_sum(tf.log(msd_precisions))
-    msd_mahala = tf.reduce_sum(tf.multiply(
-        tf.square(msd_predicted_outputs - msd_observed_outputs), msd_precisions))
+    msd_gconst = tf.cast(msd_D * lengths * np.log(2.0 * np.pi), tf.float32)
+    msd_covdet = -float_T * tf.reduce_sum(tf.log(msd_precisions), axis=1)
+    msd_mahala = tf.reduce_sum(
+        tf.square(msd_predicted_outputs - msd_observed_outputs) *
+        tf.expand_dims(msd_precisions, 1) * tf.expand_dims(mask, 2),
+        axis=[1, 2])
     msd_cost = (msd_gconst + msd_covdet + msd_mahala) / (2.0 * msd_D * float_T)
 
     # GV
     gv_precisions = tf.reciprocal(gv_variances)
-    mean_predicted_c = tf.reduce_mean(predicted_c, axis=1, keep_dims=True)
-    mean_predicted_c = tf.tile(mean_predicted_c, [1, T, 1])
-    predicted_v = tf.squeeze(
-        tf.reduce_mean(tf.square(predicted_c - mean_predicted_c), axis=1), 1)
-    mean_observed_c = tf.reduce_mean(observed_c, axis=1, keep_dims=True)
-    mean_observed_c = tf.tile(mean_observed_c, [1, T, 1])
-    observed_v = tf.squeeze(
-        tf.reduce_mean(tf.square(observed_c - mean_observed_c), axis=1), 1)
+    frame_mask = tf.reshape(mask, [-1, 1, T])
+    mean_predicted_c = tf.expand_dims(
+        tf.reduce_sum(predicted_c, axis=2) / tf.expand_dims(float_T, 1), 2)
+    predicted_v = tf.reduce_sum(
+        tf.square(predicted_c - mean_predicted_c) * frame_mask,
+        axis=2) / tf.expand_dims(float_T, 1)
+    mean_observed_c = tf.expand_dims(
+        tf.reduce_sum(observed_c, axis=2) / tf.expand_dims(float_T, 1), 2)
+    observed_v = tf.reduce_sum(
+        tf.square(observed_c - mean_observed_c) * frame_mask,
+        axis=2) / tf.expand_dims(float_T, 1)
 
     gv_gconst = tf.cast(D * np.log(2.0 * np.pi), tf.float32)
-    gv_covdet = -tf.reduce_sum(tf.log(gv_precisions))
+    gv_covdet = -tf.reduce_sum(tf.log(gv_precisions), axis=1)
     gv_mahala = tf.reduce_sum(tf.multiply(
-        tf.square(predicted_v - observed_v), gv_precisions))
+        tf.square(predicted_v - observed_v), gv_precisions), axis=1)
     gv_cost = (gv_gconst + gv_covdet + gv_mahala) / (2.0 * D)
 
-    cost = trj_cost + msd_weight * msd_cost + gv_weight * gv_cost
+    cost = tf.reduce_mean(trj_cost + msd_weight * msd_cost + gv_weight * gv_cost)
 
-    predicted_c = tf.transpose(tf.squeeze(predicted_c, 2))
-    split_predicted_c = tf.split(predicted_c, num_feature_dimensions, axis=1)
-    split_predicted_msd = tf.split(msd_predicted_outputs, 1, axis=1)
+    predicted_c = tf.transpose(predicted_c, perm=[0, 2, 1])
+    split_predicted_c = tf.split(predicted_c, num_feature_dimensions, axis=2)
+    split_predicted_msd = tf.split(msd_predicted_outputs, msd_D, axis=2)
     final_outputs = []
     j = 0
     for i in xrange(len(num_feature_dimensions)):
@@ -394,6 +602,8 @@ def trajectory_cost(predicted_outputs,
             final_outputs.append(split_predicted_msd[j])
             j = j + 1
         final_outputs.append(split_predicted_c[i])
-    final_outputs = tf.concat(final_outputs, 1)
+    final_outputs = tf.concat(final_outputs, 2)
+    if not batched:
+        final_outputs = tf.squeeze(final_outputs, 0)
 
     return cost, final_outputs
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------- #
+#           The HMM-Based Speech Synthesis System (HTS)             #
+#           developed by HTS Working Group                          #
+#           http://hts.sp.nitech.ac.jp/                             #
+# ----------------------------------------------------------------- #
+#                                                                   #
+#  Copyright (c) 2014-2017  Nagoya Institute of Technology          #
+#                           Department of Computer Science          #
+#                                                                   #
+# All rights reserved.                                              #
+#                                                                   #
+# Redistribution and use in source and binary forms, with or        #
+# without modification, are permitted provided that the following   #
+# conditions are met:                                               #
+#                                                                   #
+# - Redistributions of source code must retain the above copyright  #
+#   notice, this list of conditions and the following disclaimer.   #
+# - Redistributions in binary form must reproduce the above         #
+#   copyright notice, this list of conditions and the following     #
+#   disclaimer in the documentation and/or other materials provided #
+#   with the distribution.                                          #
+# - Neither the name of the HTS working group nor the names of its  #
+#   contributors may be used to endorse or promote products derived #
+#   from this software without specific prior written permission.   #
+#                                                                   #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND            #
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,       #
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF          #
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE          #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS #
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,          #
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED   #
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,     #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON #
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,   #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY    #
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE           #
+# POSSIBILITY OF SUCH DAMAGE.                                       #
+# ----------------------------------------------------------------- #
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import sys
+import time
+
+from six.moves import xrange
+
+import DNNDataIO
+from DNNDataIO import format_duration, print_time
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-m', metavar='f', dest='model_file', type=str, required=True,
+                    help='set model exported by DNNExport.py to f')
+parser.add_argument('-M', metavar='dir', dest='gen_dir', type=str, default='.',
+                    help='set directory to write outputs')
+parser.add_argument('-S', metavar='f', dest='script', type=str, required=True,
+                    help='set generation script file to f')
+parser.add_argument('-X', metavar='ext', dest='extension', type=str, default='ffo',
+                    help='set output file extension')
+parser.add_argument('-s', metavar='spkr', dest='spkr', type=str, default=None,
+                    help='set speaker to generate (default: the last speaker)')
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def get_activation_function(string):
+    word = string.lower()
+    if word == 'linear':
+        return lambda x: x
+    elif word == 'sigmoid':
+        return sigmoid
+    elif word == 'tanh':
+        return np.tanh
+    elif word == 'relu':
+        return lambda x: np.maximum(x, 0.0)
+    else:
+        raise NotImplementedError
+
+
+def shift_frames(x, shift):
+    # y[t] = x[t - shift] along the first axis with zero padding
+    y = np.zeros_like(x)
+    if shift >= 0:
+        y[shift:] = x[:len(x) - shift]
+    else:
+        y[:shift] = x[-shift:]
+    return y
+
+
+def mlpg(mu, precisions, windows):
+    # Banded MLPG as in DNNDefine.banded_mlpg for one utterance:
+    # mu is [frames, dimensions, windows], precisions [dimensions, windows]
+    # and windows [dimensions, windows, width]; returns [frames, dimensions]
+    T, D, _ = mu.shape
+    h = (windows.shape[2] - 1) // 2
+    p = 2 * h
+    frame_precisions = np.tile(precisions, [T, 1, 1])
+    weighted_mu = frame_precisions * mu
+
+    # bands[j][t] = WSW[t, t + j] and r = WS mu
+    bands = []
+    for j in xrange(p + 1):
+        band = np.zeros([T, D])
+        for a in xrange(-h, h - j + 1):
+            band += np.sum(shift_frames(frame_precisions, a) *
+                           windows[:, :, a + h] * windows[:, :, a + h + j], axis=2)
+        band[T - j:] = 0.0
+        bands.append(band)
+    r = np.zeros([T, D])
+    for a in xrange(-h, h + 1):
+        r += np.sum(shift_frames(weighted_mu, a) * windows[:, :, a + h], axis=2)
+
+    # L[t + p, :, i] = L[t, t - p + i] with p identity rows in front
+    L = np.zeros([T + p, D, p + 1])
+    L[:p, :, p] = 1.0
+    y = np.zeros([T + p, D])
+    for t in xrange(T):
+        row = L[t + p]
+        for i in xrange(p):
+            if t - p + i < 0:
+                continue
+            value = bands[p - i][t - p + i].copy()
+            for m in xrange(i):
+                value -= row[:, m] * L[t + i, :, m - i + p]
+            row[:, i] = value / L[t + i, :, p]
+        row[:, p] = np.sqrt(bands[0][t] - np.sum(np.square(row[:, :p]), axis=1))
+        y[t + p] = (r[t] - np.sum(row[:, :p] * y[t:t + p].T, axis=1)) / row[:, p]
+
+    # Solve L^T c = y backwards in time
+    c = np.zeros([T + p, D])
+    for t in xrange(T - 1, -1, -1):
+        value = y[t + p].copy()
+        for i in xrange(1, p + 1):
+            if t + i < T:
+                value -= L[t + i + p, :, p - i] * c[t + i]
+        c[t] = value / L[t + p, :, p]
+    return c[:T]
+
+
+def quantize_params(params, weight_format):
+    # Stores the hidden-layer weights as float16, or as int8 with one
+    # float32 scale per output unit (symmetric, max |w| maps to 127)
+    if weight_format not in ('float32', 'float16', 'int8'):
+        raise ValueError('unknown weight format: %s' % weight_format)
+    params = dict(params)
+    params['weight_format'] = np.asarray(weight_format)
+    if weight_format == 'float32':
+        return params
+    for i in xrange(int(params['num_hidden_layers'])):
+        key = 'hidden%d/si_weights' % i
+        weights = params[key].astype(np.float32)
+        if weight_format == 'float16':
+            params[key] = weights.astype(np.float16)
+        else:
+            scales = np.max(np.abs(weights), axis=0) / 127.0
+            scales[scales == 0.0] = 1.0
+            params[key] = np.round(weights / scales).astype(np.int8)
+            params[key + '_scales'] = scales.astype(np.float32)
+    return params
+
+
+def dequantize_dot(inputs, weights, scales=None):
+    # The weights are converted only for this product so that the model
+    # stays resident in its reduced precision
+    outputs = np.dot(inputs, weights.astype(np.float32))
+    if scales is not None:
+        outputs *= scales
+    return outputs
+
+
+class Engine(object):
+    # Forward pass of a model exported by DNNExport.py with NumPy only, so
+    # that generation does not have to import TensorFlow
+    def __init__(self, model_file):
+        with np.load(model_file) as data:
+            params = dict((key, data[key]) for key in data.files)
+
+        self._mode = str(params['mode'])
+        self._hidden_activation = get_activation_function(
+            str(params['hidden_activation']))
+        self._output_activation = get_activation_function(
+            str(params['output_activation']))
+        self._frame_by_frame = bool(params['frame_by_frame'])
+        self._all_spkrs = [str(spkr) for spkr in params['all_spkrs']]
+
+        # The speaker-dependent weights only act as per-speaker biases, so
+        # they are folded into one bias table per layer when loading
+        self._layers = []
+        for i in xrange(int(params['num_hidden_layers'])):
+            prefix = 'hidden%d/' % i
+            biases = params[prefix + 'si_biases']
+            if self._mode == 'SAT':
+                bias_table = biases + params[prefix + 'sd_weights']
+            else:
+                bias_table = np.tile(biases, [len(self._all_spkrs), 1])
+            self._layers.append((params[prefix + 'si_weights'],
+                                 params.get(prefix + 'si_weights_scales'),
+                                 bias_table))
+        self._output_layer = (params['output/si_weights'],
+                              params['output/si_biases'])
+        self._variance_table = params['variance/variances']
+
+        if not self._frame_by_frame:
+            self.__prepare_mlpg(params['num_feature_dimensions'],
+                                params['msd_flags'], params['windows'])
+
+    def __prepare_mlpg(self, num_feature_dimensions, msd_flags, windows):
+        # Output layout of DNNDefine.trajectory_cost: per feature, the MSD
+        # weight (if any) and then the statics, deltas, ... of its dimensions
+        num_windows = windows.shape[1]
+        self._windows = windows.astype(np.float64)
+        self._msd_index = []
+        self._static_index = []
+        offset = 0
+        for i in xrange(len(num_feature_dimensions)):
+            if msd_flags[i]:
+                self._msd_index.append(offset)
+                offset += 1
+            index = offset + np.arange(num_windows * num_feature_dimensions[i])
+            self._static_index.append(
+                np.reshape(index, [num_windows, -1]).T)
+            offset += num_windows * num_feature_dimensions[i]
+        self._msd_flags = msd_flags
+        self._mlpg_index = np.concatenate(self._static_index)
+
+    @property
+    def num_input_units(self):
+        if len(self._layers) > 0:
+            return len(self._layers[0][0])
+        return len(self._output_layer[0])
+
+    @property
+    def frame_by_frame(self):
+        return self._frame_by_frame
+
+    @property
+    def all_spkrs(self):
+        return self._all_spkrs
+
+    def get_spkr_id(self, spkr=None):
+        # The last speaker by default as in DNNSynthesis.py
+        if spkr is None:
+            return len(self._all_spkrs) - 1
+        if spkr not in self._all_spkrs:
+            raise ValueError('unknown speaker %s' % spkr)
+        return self._all_spkrs.index(spkr)
+
+    def variances(self, spkr=None):
+        spkr_id = self.get_spkr_id(spkr)
+        return self._variance_table[spkr_id:spkr_id + 1]
+
+    def forward(self, input_data, spkr=None):
+        spkr_id = self.get_spkr_id(spkr)
+        outputs = np.asarray(input_data, np.float32)
+        for weights, scales, bias_table in self._layers:
+            outputs = self._hidden_activation(
+                dequantize_dot(outputs, weights, scales) + bias_table[spkr_id])
+        weights, biases = self._output_layer
+        return self._output_activation(np.dot(outputs, weights) + biases)
+
+    def generate(self, input_data, spkr=None):
+        outputs = self.forward(input_data, spkr)
+        if self._frame_by_frame:
+            return outputs
+
+        precisions = 1.0 / self.variances(spkr)[0][self._mlpg_index].astype(
+            np.float64)
+        c = mlpg(outputs[:, self._mlpg_index].astype(np.float64),
+                 precisions, self._windows)
+        final_outputs = []
+        j = 0
+        k = 0
+        for i in xrange(len(self._static_index)):
+            if self._msd_flags[i]:
+                final_outputs.append(outputs[:, [self._msd_index[j]]])
+                j += 1
+            num_dimensions = len(self._static_index[i])
+            final_outputs.append(c[:, k:k + num_dimensions])
+            k += num_dimensions
+        return np.concatenate(final_outputs, axis=1).astype(np.float32)
+
+
+def main():
+    args = parser.parse_args()
+
+    if not os.path.exists(args.gen_dir):
+        os.mkdir(args.gen_dir)
+
+    engine = Engine(args.model_file)
+    if args.spkr is not None and args.spkr not in engine.all_spkrs:
+        sys.exit('  ERROR  main: Unknown speaker %s' % args.spkr)
+    input_filenames, _ = DNNDataIO.get_filenames(args.script)
+
+    print_time('Start forwarding')
+    start_time = time.time()
+    num_frames = 0
+    for input_filename in input_filenames:
+        print('  Processing %s' % input_filename)
+        file_start_time = time.time()
+        input_data = DNNDataIO.load_binary_data(input_filename,
+                                                engine.num_input_units)
+
+        basename = os.path.splitext(os.path.basename(input_filename))[0]
+        basename = os.path.join(args.gen_dir, basename)
+        if args.extension == '':
+            predict_filename = basename
+        else:
+            predict_filename = basename + '.' + args.extension
+
+        if engine.frame_by_frame:
+            DNNDataIO.write_binary_data(basename + '.var',
+                                        engine.variances(args.spkr))
+        DNNDataIO.write_binary_data(predict_filename,
+                                    engine.generate(input_data, args.spkr))
+
+        print('    Generation: %d frames (%s)' %
+              (len(input_data), format_duration(time.time() - file_start_time)))
+        num_frames += len(input_data)
+
+    duration = time.time() - start_time
+    print('  %d files (%d frames) in %s: %.2f utterances/sec' %
+          (len(input_filenames), num_frames, format_duration(duration),
+           len(input_filenames) / duration))
+    print_time('End forwarding')
+    print()
+
+
+if __name__ == '__main__':
+    main()
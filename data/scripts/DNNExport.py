@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------- #
+#           The HMM-Based Speech Synthesis System (HTS)             #
+#           developed by HTS Working Group                          #
+#           http://hts.sp.nitech.ac.jp/                             #
+# ----------------------------------------------------------------- #
+#                                                                   #
+#  Copyright (c) 2014-2017  Nagoya Institute of Technology          #
+#                           Department of Computer Science          #
+#                                                                   #
+# All rights reserved.                                              #
+#                                                                   #
+# Redistribution and use in source and binary forms, with or        #
+# without modification, are permitted provided that the following   #
+# conditions are met:                                               #
+#                                                                   #
+# - Redistributions of source code must retain the above copyright  #
+#   notice, this list of conditions and the following disclaimer.   #
+# - Redistributions in binary form must reproduce the above         #
+#   copyright notice, this list of conditions and the following     #
+#   disclaimer in the documentation and/or other materials provided #
+#   with the distribution.                                          #
+# - Neither the name of the HTS working group nor the names of its  #
+#   contributors may be used to endorse or promote products derived #
+#   from this software without specific prior written permission.   #
+#                                                                   #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND            #
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,       #
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF          #
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE          #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS #
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,          #
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED   #
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,     #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON #
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,   #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY    #
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE           #
+# POSSIBILITY OF SUCH DAMAGE.                                       #
+# ----------------------------------------------------------------- #
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import os
+import sys
+
+from six.moves import xrange
+import tensorflow as tf
+
+import DNNDataIO
+import DNNDefine
+import DNNEngine
+from DNNDataIO import print_time
+from DNNSynthesis import get_model_path, get_window_vector
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-w', metavar='dir', dest='window_dir', type=str, default=None,
+                    help='set window used for trajectory training')
+parser.add_argument('-C', metavar='cf', dest='config', type=str, required=True,
+                    help='set config file to cf')
+parser.add_argument('-H', metavar='dir', dest='model_dir', type=str, required=True,
+                    help='set directory to load a model')
+parser.add_argument('-q', metavar='format', dest='weight_format', type=str,
+                    default='float32', choices=['float32', 'float16', 'int8'],
+                    help='set storage format of hidden-layer weights')
+parser.add_argument('-o', metavar='f', dest='export_file', type=str, default=None,
+                    help='set exported model file to f (default: model.npz in the model directory)')
+
+
+def export_model(config, model_dir, export_file, window_dir=None,
+                 weight_format='float32'):
+    # Only what the forward pass needs: weights and variances of the
+    # restored checkpoint without optimizer slots, plus the settings that
+    # define the network and, for trajectory models, the windows
+    reader = tf.train.NewCheckpointReader(get_model_path(config, model_dir))
+
+    if len(config['all_spkrs']) > 1:
+        mode = 'SAT'
+    else:
+        mode = 'SD'
+
+    params = {}
+    num_hidden_layers = len(config['num_hidden_units'])
+    for i in xrange(num_hidden_layers):
+        names = ['si_weights', 'si_biases']
+        if mode == 'SAT':
+            names.append('sd_weights')
+        for name in names:
+            key = 'hidden%d/%s' % (i, name)
+            params[key] = reader.get_tensor('model/' + key)
+    for key in ['output/si_weights', 'output/si_biases', 'variance/variances']:
+        params[key] = reader.get_tensor('model/' + key)
+
+    params['mode'] = np.asarray(mode)
+    params['num_hidden_layers'] = np.asarray(num_hidden_layers)
+    params['hidden_activation'] = np.asarray(config['hidden_activation'])
+    params['output_activation'] = np.asarray(config['output_activation'])
+    params['all_spkrs'] = np.asarray(config['all_spkrs'])
+    params['num_feature_dimensions'] = np.asarray(config['num_feature_dimensions'])
+    params['frame_by_frame'] = np.asarray(config['frame_by_frame'])
+
+    if not config['frame_by_frame']:
+        if window_dir is None:
+            raise ValueError('windows are required to export a trajectory model')
+        num_windows, window_vector = get_window_vector(config, window_dir)
+        params['msd_flags'] = np.asarray(config['msd_flags'])
+        params['windows'] = DNNDefine.get_window_coefficients(
+            window_vector, num_windows)
+
+    params = DNNEngine.quantize_params(params, weight_format)
+    np.savez(export_file, **params)
+    return params
+
+
+def main():
+    args = parser.parse_args()
+    config = DNNDataIO.load_config(args.config)
+
+    export_file = args.export_file
+    if export_file is None:
+        export_file = os.path.join(args.model_dir, 'model.npz')
+
+    print_time('Start exporting')
+    try:
+        params = export_model(config, args.model_dir, export_file,
+                              args.window_dir, args.weight_format)
+    except (IOError, ValueError) as e:
+        sys.exit('  ERROR  main: %s' % e)
+    num_params = sum(value.size for key, value in params.items()
+                     if '/' in key and not key.endswith('_scales'))
+    num_bytes = sum(value.nbytes for key, value in params.items() if '/' in key)
+    print('  %d parameters (%d bytes, %s weights) were exported to %s' %
+          (num_params, num_bytes, args.weight_format,
+           os.path.abspath(export_file)))
+    print_time('End exporting')
+    print()
+
+
+if __name__ == '__main__':
+    main()
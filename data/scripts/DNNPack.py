@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------- #
+#           The HMM-Based Speech Synthesis System (HTS)             #
+#           developed by HTS Working Group                          #
+#           http://hts.sp.nitech.ac.jp/                             #
+# ----------------------------------------------------------------- #
+#                                                                   #
+#  Copyright (c) 2014-2017  Nagoya Institute of Technology          #
+#                           Department of Computer Science          #
+#                                                                   #
+# All rights reserved.                                              #
+#                                                                   #
+# Redistribution and use in source and binary forms, with or        #
+# without modification, are permitted provided that the following   #
+# conditions are met:                                               #
+#                                                                   #
+# - Redistributions of source code must retain the above copyright  #
+#   notice, this list of conditions and the following disclaimer.   #
+# - Redistributions in binary form must reproduce the above         #
+#   copyright notice, this list of conditions and the following     #
+#   disclaimer in the documentation and/or other materials provided #
+#   with the distribution.                                          #
+# - Neither the name of the HTS working group nor the names of its  #
+#   contributors may be used to endorse or promote products derived #
+#   from this software without specific prior written permission.   #
+#                                                                   #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND            #
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,       #
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF          #
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE          #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS #
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,          #
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED   #
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,     #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON #
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,   #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY    #
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE           #
+# POSSIBILITY OF SUCH DAMAGE.                                       #
+# ----------------------------------------------------------------- #
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import os
+
+import DNNDataIO
+from DNNDataIO import print_time
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-C', metavar='cf', dest='config', type=str, required=True,
+                    help='set config file to cf')
+parser.add_argument('-M', metavar='dir', dest='pack_dir', type=str, required=True,
+                    help='set directory to write packed corpus')
+parser.add_argument('-S', metavar='f', dest='script', type=str, required=True,
+                    help='set training script file to f')
+parser.add_argument('-s', metavar='n', dest='max_shard_frames', type=int,
+                    default=1000000, help='set maximum number of frames per shard to n')
+args = parser.parse_args()
+
+
+def main():
+    config = DNNDataIO.load_config(args.config)
+
+    if len(config['all_spkrs']) <= 1:
+        config['spkr_pattern'] = None
+
+    print_time('Start packing')
+    num_files, num_examples, num_shards = DNNDataIO.pack_data(
+        args.script,
+        args.pack_dir,
+        config['num_io_units'],
+        spkr_pattern=config['spkr_pattern'],
+        train_spkrs=config['all_spkrs'],
+        max_shard_frames=args.max_shard_frames)
+    print('  %d files (%d examples) were packed into %d shards in %s' %
+          (num_files, num_examples, num_shards, os.path.abspath(args.pack_dir)))
+    print_time('End packing')
+    print()
+
+
+if __name__ == '__main__':
+    main()
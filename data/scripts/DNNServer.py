@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# ----------------------------------------------------------------- #
+#           The HMM-Based Speech Synthesis System (HTS)             #
+#           developed by HTS Working Group                          #
+#           http://hts.sp.nitech.ac.jp/                             #
+# ----------------------------------------------------------------- #
+#                                                                   #
+#  Copyright (c) 2014-2017  Nagoya Institute of Technology          #
+#                           Department of Computer Science          #
+#                                                                   #
+# All rights reserved.                                              #
+#                                                                   #
+# Redistribution and use in source and binary forms, with or        #
+# without modification, are permitted provided that the following   #
+# conditions are met:                                               #
+#                                                                   #
+# - Redistributions of source code must retain the above copyright  #
+#   notice, this list of conditions and the following disclaimer.   #
+# - Redistributions in binary form must reproduce the above         #
+#   copyright notice, this list of conditions and the following     #
+#   disclaimer in the documentation and/or other materials provided #
+#   with the distribution.                                          #
+# - Neither the name of the HTS working group nor the names of its  #
+#   contributors may be used to endorse or promote products derived #
+#   from this software without specific prior written permission.   #
+#                                                                   #
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND            #
+# CONTRIBUTORS "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES,       #
+# INCLUDING, BUT NOT LIMITED TO, THE IMPLIED WARRANTIES OF          #
+# MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE          #
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT OWNER OR CONTRIBUTORS #
+# BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,          #
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED   #
+# TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,     #
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON #
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,   #
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY    #
+# OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE           #
+# POSSIBILITY OF SUCH DAMAGE.                                       #
+# ----------------------------------------------------------------- #
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import numpy as np
+import os
+import sys
+import time
+
+from six.moves import BaseHTTPServer
+
+import DNNDataIO
+from DNNDataIO import format_duration, print_time
+from DNNSynthesis import Synthesizer
+
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-w', metavar='dir', dest='window_dir', type=str, default=None,
+                    help='set window used for trajectory training')
+parser.add_argument('-C', metavar='cf', dest='config', type=str, required=True,
+                    help='set config file to cf')
+parser.add_argument('-H', metavar='dir', dest='model_dir', type=str, required=True,
+                    help='set directory to load a model')
+parser.add_argument('-a', metavar='host', dest='address', type=str,
+                    default='localhost', help='set address to listen on')
+parser.add_argument('-p', metavar='n', dest='port', type=int, default=8080,
+                    help='set port to listen on')
+
+
+class SynthesisHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    # POST /synthesize takes either the binary frames of an input file
+    # (application/octet-stream) and returns the generated frames, or a JSON
+    # object {"input": file, "output": file} naming files to read and write.
+    # The speaker is given by an X-Speaker header or a "speaker" member.
+    # GET /status returns the number of requests and their mean latency.
+    protocol_version = 'HTTP/1.1'
+    # Small responses on a kept-alive connection would otherwise wait for
+    # delayed acknowledgements
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path != '/status':
+            self.send_error(404)
+            return
+        stats = self.server.stats
+        num_requests = stats['num_requests']
+        self.__send_json({
+            'num_requests': num_requests,
+            'num_frames': stats['num_frames'],
+            'mean_latency': stats['total_latency'] / max(num_requests, 1)})
+
+    def do_POST(self):
+        if self.path != '/synthesize':
+            self.send_error(404)
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        start_time = time.time()
+        try:
+            if self.headers.get('Content-Type') == 'application/json':
+                num_frames, response = self.__synthesize_file(
+                    json.loads(body.decode('utf-8')))
+            else:
+                num_frames, response = self.__synthesize_array(
+                    body, self.headers.get('X-Speaker'))
+        except (ValueError, KeyError, IOError) as e:
+            self.send_error(400, str(e))
+            return
+        latency = time.time() - start_time
+
+        stats = self.server.stats
+        stats['num_requests'] += 1
+        stats['num_frames'] += num_frames
+        stats['total_latency'] += latency
+        print('  Request %d: %d frames (%s)' %
+              (stats['num_requests'], num_frames, format_duration(latency)))
+        sys.stdout.flush()
+
+        if isinstance(response, dict):
+            response['synthesis_time'] = latency
+            self.__send_json(response)
+        else:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(response)))
+            self.send_header('X-Num-Frames', str(num_frames))
+            self.send_header('X-Synthesis-Time', '%f' % latency)
+            self.end_headers()
+            self.wfile.write(response)
+
+    def __synthesize_array(self, body, spkr):
+        num_input_units = self.server.config['num_input_units']
+        if len(body) % (4 * num_input_units) != 0:
+            raise ValueError('size %d is not a multiple of %d-dimensional frames'
+                             % (len(body), num_input_units))
+        input_data = np.reshape(np.frombuffer(body, np.float32),
+                                [-1, num_input_units])
+        predicts, _ = self.server.synthesizer.synthesize(input_data, spkr=spkr)
+        return len(input_data), np.ascontiguousarray(predicts, np.float32).tobytes()
+
+    def __synthesize_file(self, request):
+        synthesizer = self.server.synthesizer
+        input_data = DNNDataIO.load_binary_data(
+            request['input'], self.server.config['num_input_units'])
+        predict_filename = request['output']
+        spkr = request.get('speaker')
+        if synthesizer.frame_by_frame:
+            DNNDataIO.write_binary_data(
+                os.path.splitext(predict_filename)[0] + '.var',
+                synthesizer.variances(spkr))
+        blocks, _ = synthesizer.generate(input_data, spkr=spkr)
+        with DNNDataIO.DataWriter() as writer:
+            for predicts in blocks:
+                writer.write(predict_filename, predicts)
+        return len(input_data), {'num_frames': len(input_data)}
+
+    def __send_json(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Requests are logged with their latency in do_POST
+        pass
+
+
+def main():
+    args = parser.parse_args()
+    config = DNNDataIO.load_config(args.config)
+
+    print_time('Start restoring model')
+    try:
+        synthesizer = Synthesizer(config, args.model_dir, args.window_dir)
+    except (IOError, ValueError) as e:
+        sys.exit('  ERROR  main: %s' % e)
+    print_time('End restoring model')
+
+    server = BaseHTTPServer.HTTPServer((args.address, args.port),
+                                       SynthesisHandler)
+    server.config = config
+    server.synthesizer = synthesizer
+    server.stats = {'num_requests': 0, 'num_frames': 0, 'total_latency': 0.0}
+
+    print_time('Start serving on http://%s:%d' % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    synthesizer.close()
+
+    print_time('End serving')
+    print()
+
+
+if __name__ == '__main__':
+    main()
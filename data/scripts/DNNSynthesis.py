@@ -44,8 +44,8 @@ from __future__ import division
 from __future__ import print_function
 
 import argparse
-import datetime
 import glob
+import multiprocessing
 import numpy as np
 import os
 import sys
@@ -56,6 +56,7 @@ import tensorflow as tf
 
 import DNNDataIO
 import DNNDefine
+from DNNDataIO import format_duration, print_time
 
 
 parser = argparse.ArgumentParser()
@@ -71,169 +72,301 @@ parser.add_argument('-S', metavar='f', dest='script', type=str, required=True,
                     help='set generation script file to f')
 parser.add_argument('-X', metavar='ext', dest='extension', type=str, default='ffo',
                     help='set output file extension')
-args = parser.parse_args()
+parser.add_argument('-s', metavar='spkr', dest='spkr', type=str, default=None,
+                    help='set speaker to generate (default: the last speaker)')
+parser.add_argument('-j', '--jobs', metavar='n', dest='jobs', type=int, default=1,
+                    help='set number of worker processes to n')
 
 
-def print_time(message):
-    date = datetime.datetime.today().strftime('%x %X')
-    print(message, 'at', date)
+def get_model_path(config, model_dir):
+    model_path = os.path.join(model_dir, 'model.ckpt')
+    if config['restore_ckpt'] > 0:
+        model_path = '-'.join([model_path, str(config['restore_ckpt'])])
+    if len(glob.glob("%s*" % model_path)) == 0:
+        raise IOError('No such file %s' % model_path)
+    return model_path
+
+
+def check_chunk_config(config):
+    chunk_size = config.get('mlpg_chunk_size', 0)
+    chunk_overlap = config.get('mlpg_chunk_overlap', 100)
+    if chunk_size > 0 and not 0 <= chunk_overlap < chunk_size:
+        raise ValueError('mlpg_chunk_overlap must be in [0, %d)' % chunk_size)
 
 
-def format_duration(duration):
-    if duration >= 1000:
-        return '%.1f hour' % (duration / 3600)
-    elif duration >= 100:
-        return '%.1f min' % (duration / 60)
+def get_window_vector(config, window_dir):
+    windows = []
+    for filename in config['window_filenames']:
+        windows.append(
+            DNNDataIO.load_window(os.path.join(window_dir, filename)))
+    # Assume that all features have the same number of windows.
+    num_windows = (len(config['window_filenames']) //
+                   len(config['num_feature_dimensions']))
+    window_width = len(windows[0])
+    window_vector = []
+    for i in xrange(len(config['num_feature_dimensions'])):
+        for j in xrange(window_width - 1, -1, -1):
+            for k in xrange(num_windows):
+                window_vector.append(windows[i * num_windows + k][j])
+    window_vector = np.reshape(
+        window_vector, [len(config['num_feature_dimensions']), -1])
+    window_vector = np.repeat(
+        window_vector, config['num_feature_dimensions'], axis=0)
+    window_vector = window_vector.astype(np.float32)
+    return num_windows, window_vector
+
+
+class Synthesizer(object):
+    # Builds the forwarding graph and restores the model once so that any
+    # number of utterances can be generated with the same session
+    def __init__(self, config, model_dir, window_dir=None):
+        self._config = config
+
+        if len(config['all_spkrs']) > 1:
+            mode = 'SAT'
+        else:
+            mode = 'SD'
+
+        model_path = get_model_path(config, model_dir)
+        check_chunk_config(config)
+
+        # Load window for trajectory training
+        if window_dir is not None:
+            num_windows, window_vector = get_window_vector(config, window_dir)
+
+        self._block_size = config.get('forward_block_size', 0)
+        self._chunk_size = config.get('mlpg_chunk_size', 0)
+        self._chunk_overlap = config.get('mlpg_chunk_overlap', 100)
+
+        self._graph = tf.Graph()
+        with self._graph.as_default():
+            self._inputs = tf.placeholder(dtype=tf.float32,
+                                          shape=[None, config['num_input_units']])
+            self._outputs = tf.placeholder(dtype=tf.float32,
+                                           shape=[None, config['num_output_units']])
+            # The last speaker unless another one is fed
+            self._spkr_id = tf.placeholder_with_default(
+                np.int32(len(config['all_spkrs']) - 1), shape=[])
+
+            with tf.variable_scope('model'):
+                (predicted_outputs, self._trained_variances, trained_gv_variances) = (
+                    DNNDefine.inference(
+                        self._inputs,
+                        tf.reshape(self._spkr_id, [1, 1]),
+                        config['num_io_units'],
+                        config['num_hidden_units'],
+                        len(config['all_spkrs']),
+                        sum(config['num_feature_dimensions']),
+                        config['hidden_activation'],
+                        config['output_activation'],
+                        1.0,
+                        mode,
+                        fold_spkr_biases=True))
+
+            if config['frame_by_frame']:
+                self._cost_op, self._predicted_outputs = DNNDefine.cost(
+                    predicted_outputs,
+                    self._outputs,
+                    self._trained_variances)
+            else:
+                self._cost_op, self._predicted_outputs = DNNDefine.trajectory_cost(
+                    predicted_outputs,
+                    self._outputs,
+                    self._trained_variances,
+                    trained_gv_variances,
+                    config['num_feature_dimensions'],
+                    config['msd_flags'],
+                    num_windows,
+                    window_vector,
+                    solver=config.get('mlpg_solver', DNNDefine.default_mlpg_solver))
+
+            init_op = tf.group(
+                tf.global_variables_initializer(),
+                tf.local_variables_initializer())
+
+            self._sess = tf.Session(config=tf.ConfigProto(
+                intra_op_parallelism_threads=config['num_threads']))
+
+            self._sess.run(init_op)
+
+            saver = tf.train.Saver()
+            saver.restore(self._sess, model_path)
+
+    @property
+    def frame_by_frame(self):
+        return self._config['frame_by_frame']
+
+    @property
+    def all_spkrs(self):
+        return self._config['all_spkrs']
+
+    def __get_feed_dict(self, spkr):
+        if spkr is None:
+            return {}
+        if spkr not in self.all_spkrs:
+            raise ValueError('unknown speaker %s' % spkr)
+        return {self._spkr_id: self.all_spkrs.index(spkr)}
+
+    def variances(self, spkr=None):
+        return self._sess.run(self._trained_variances,
+                              feed_dict=self.__get_feed_dict(spkr))
+
+    def __forward(self, input_data, output_data, chunks, feed_dict, costs):
+        # Costs are weighted by the number of frames in each chunk
+        num_frames = float(sum(end - start for start, end in chunks))
+        for start, end in chunks:
+            yield self.__forward_chunk(input_data, output_data, start, end,
+                                       feed_dict, (end - start) / num_frames,
+                                       costs)
+
+    def __forward_chunk(self, input_data, output_data, start, end, feed_dict,
+                        weight, costs):
+        feed_dict = dict(feed_dict)
+        feed_dict[self._inputs] = input_data[start:end]
+        if output_data is None:
+            return self._sess.run(self._predicted_outputs, feed_dict=feed_dict)
+        feed_dict[self._outputs] = output_data[start:end]
+        predicts, cost = self._sess.run([self._predicted_outputs, self._cost_op],
+                                        feed_dict=feed_dict)
+        costs.append(cost * weight)
+        return predicts
+
+    def generate(self, input_data, output_data=None, spkr=None):
+        # Returns an iterator over consecutive blocks of generated frames and
+        # a list whose sum is the cost once the iterator is exhausted
+        num_examples = len(input_data)
+        feed_dict = self.__get_feed_dict(spkr)
+        costs = []
+        if self.frame_by_frame:
+            # The network is applied frame by frame, so whole blocks of
+            # frames are forwarded at once; the cost of a block is the
+            # mean of its frame costs.
+            chunks = DNNDataIO.get_chunks(num_examples, self._block_size, 0)
+            blocks = self.__forward(input_data, output_data, chunks,
+                                    feed_dict, costs)
+        else:
+            # Long utterances are generated in overlapping chunks that are
+            # cross-faded, so that memory does not depend on length
+            chunks = DNNDataIO.get_chunks(num_examples, self._chunk_size,
+                                          self._chunk_overlap)
+            overlap = self._chunk_overlap if len(chunks) > 1 else 0
+            blocks = DNNDataIO.stitch_chunks(
+                self.__forward(input_data, output_data, chunks, feed_dict,
+                               costs), overlap)
+        return blocks, costs
+
+    def synthesize(self, input_data, output_data=None, spkr=None):
+        blocks, costs = self.generate(input_data, output_data, spkr)
+        predicts = np.concatenate(list(blocks))
+        if output_data is None:
+            return predicts, None
+        return predicts, sum(costs)
+
+    def close(self):
+        self._sess.close()
+
+
+def synthesize_file(synthesizer, config, input_filename, output_filename,
+                    gen_dir, extension, spkr=None):
+    start_time = time.time()
+
+    input_data = DNNDataIO.load_binary_data(input_filename,
+                                            config['num_input_units'])
+    output_data = None
+    if output_filename is not None:
+        output_data = DNNDataIO.load_binary_data(output_filename,
+                                                 config['num_output_units'])
+
+    basename = os.path.splitext(os.path.basename(input_filename))[0]
+    basename = os.path.join(gen_dir, basename)
+    if extension == '':
+        predict_filename = basename
     else:
-        return '%.2f sec' % (duration)
+        predict_filename = basename + '.' + extension
+
+    if synthesizer.frame_by_frame:
+        DNNDataIO.write_binary_data(basename + '.var',
+                                    synthesizer.variances(spkr))
+
+    blocks, costs = synthesizer.generate(input_data, output_data, spkr)
+    with DNNDataIO.DataWriter() as writer:
+        for predicts in blocks:
+            writer.write(predict_filename, predicts)
+
+    total_cost = None if output_data is None else sum(costs)
+    return len(input_data), total_cost, time.time() - start_time
+
+
+# Each worker process restores the model once and keeps it for all the
+# files it is given
+worker_synthesizer = None
+
+
+def initialize_worker(config, model_dir, window_dir):
+    global worker_synthesizer
+    worker_synthesizer = Synthesizer(config, model_dir, window_dir)
+
+
+def synthesize_worker_file(arguments):
+    return synthesize_file(worker_synthesizer, *arguments)
 
 
 def main():
+    args = parser.parse_args()
     config = DNNDataIO.load_config(args.config)
 
-    if len(config['all_spkrs']) > 1:
-        mode = 'SAT'
-    else:
-        mode = 'SD'
-
     # Make directories
     if not os.path.exists(args.gen_dir):
         os.mkdir(args.gen_dir)
-    model_path = os.path.join(args.model_dir, 'model.ckpt')
-    if config['restore_ckpt'] > 0:
-        model_path = '-'.join([model_path, str(config['restore_ckpt'])])
-    if len(glob.glob("%s*" % model_path)) == 0:
-        sys.exit('  ERROR  main: No such file %s' % model_path)
-
-    # Load window for trajectory training
-    windows = []
-    if args.window_dir is not None:
-        for filename in config['window_filenames']:
-            windows.append(
-                DNNDataIO.load_window(os.path.join(args.window_dir, filename)))
-        # Assume that all features have the same number of windows.
-        num_windows = (len(config['window_filenames']) //
-                       len(config['num_feature_dimensions']))
-        window_width = len(windows[0])
-        window_vector = []
-        for i in xrange(len(config['num_feature_dimensions'])):
-            for j in xrange(window_width - 1, -1, -1):
-                for k in xrange(num_windows):
-                    window_vector.append(windows[i * num_windows + k][j])
-        window_vector = np.reshape(
-            window_vector, [len(config['num_feature_dimensions']), -1])
-        window_vector = np.repeat(
-            window_vector, config['num_feature_dimensions'], axis=0)
-        window_vector = window_vector.astype(np.float32)
-
-    with tf.Graph().as_default():
-        inputs = tf.placeholder(dtype=tf.float32,
-                                shape=[None, config['num_input_units']])
-        outputs = tf.placeholder(dtype=tf.float32,
-                                 shape=[None, config['num_output_units']])
-
-        with tf.variable_scope('model'):
-            (predicted_outputs, trained_variances, trained_gv_variances) = (
-                DNNDefine.inference(
-                    inputs,
-                    [[len(config['all_spkrs']) - 1]],
-                    config['num_io_units'],
-                    config['num_hidden_units'],
-                    len(config['all_spkrs']),
-                    sum(config['num_feature_dimensions']),
-                    config['hidden_activation'],
-                    config['output_activation'],
-                    1.0,
-                    mode))
-
-        if config['frame_by_frame']:
-            cost_op, _ = DNNDefine.cost(
-                predicted_outputs,
-                outputs,
-                trained_variances)
+    try:
+        get_model_path(config, args.model_dir)
+        check_chunk_config(config)
+    except (IOError, ValueError) as e:
+        sys.exit('  ERROR  main: %s' % e)
+    if args.spkr is not None and args.spkr not in config['all_spkrs']:
+        sys.exit('  ERROR  main: Unknown speaker %s' % args.spkr)
+
+    input_filenames, output_filenames = DNNDataIO.get_filenames(args.script)
+    tasks = [(config, input_filenames[i], output_filenames[i],
+              args.gen_dir, args.extension, args.spkr)
+             for i in xrange(len(input_filenames))]
+
+    print_time('Start forwarding')
+    start_time = time.time()
+    if args.jobs > 1:
+        # The threads of one session are shared among the workers
+        worker_config = dict(config)
+        worker_config['num_threads'] = max(1, config['num_threads'] // args.jobs)
+        pool = multiprocessing.Pool(
+            args.jobs, initialize_worker,
+            (worker_config, args.model_dir, args.window_dir))
+        results = pool.imap(synthesize_worker_file, tasks)
+    else:
+        synthesizer = Synthesizer(config, args.model_dir, args.window_dir)
+        results = (synthesize_file(synthesizer, *task) for task in tasks)
+
+    # Results come back in the order of the script
+    num_frames = 0
+    for i, (num_examples, total_cost, duration) in enumerate(results):
+        print('  Processing %s' % input_filenames[i])
+        if total_cost is None:
+            print('    Generation: %d frames (%s)' %
+                  (num_examples, format_duration(duration)))
         else:
-            cost_op, predicted_outputs = DNNDefine.trajectory_cost(
-                predicted_outputs,
-                outputs,
-                trained_variances,
-                trained_gv_variances,
-                config['num_feature_dimensions'],
-                config['msd_flags'],
-                num_windows,
-                window_vector)
-
-        init_op = tf.group(
-            tf.global_variables_initializer(),
-            tf.local_variables_initializer())
-
-        sess = tf.Session(config=tf.ConfigProto(
-            intra_op_parallelism_threads=config['num_threads']))
-
-        sess.run(init_op)
-
-        saver = tf.train.Saver()
-        saver.restore(sess, model_path)
-
-        input_filenames, output_filenames = DNNDataIO.get_filenames(
-            args.script)
-
-        print_time('Start forwarding')
-        for i in xrange(len(input_filenames)):
-            print('  Processing %s' % input_filenames[i])
-            input_data = DNNDataIO.load_binary_data(input_filenames[i],
-                                                    config['num_input_units'])
-            if output_filenames[i] is not None:
-                output_data = DNNDataIO.load_binary_data(output_filenames[i],
-                                                         config['num_output_units'])
-            num_examples = len(input_data)
-
-            basename = os.path.splitext(
-                os.path.basename(input_filenames[i]))[0]
-            basename = os.path.join(args.gen_dir, basename)
-            if args.extension == '':
-                predict_filename = basename
-            else:
-                predict_filename = basename + '.' + args.extension
+            print('    Evaluation: cost = %e (%s)' %
+                  (total_cost, format_duration(duration)))
+        num_frames += num_examples
 
-            total_cost = 0.0
-            start_time = time.time()
-
-            if config['frame_by_frame']:
-                DNNDataIO.write_binary_data(basename + '.var',
-                                            sess.run(trained_variances))
-                for j in xrange(num_examples):
-                    if output_filenames[i] is None:
-                        predicts = sess.run(predicted_outputs,
-                                            feed_dict={inputs: [input_data[j]]})
-                    else:
-                        predicts, cost = sess.run([predicted_outputs, cost_op],
-                                                  feed_dict={
-                                                      inputs: [input_data[j]],
-                                                      outputs: [output_data[j]]})
-                        total_cost += cost
-                    append = False if j == 0 else True
-                    DNNDataIO.write_binary_data(
-                        predict_filename, predicts, append)
-                total_cost = total_cost / num_examples
-            else:
-                if output_filenames[i] is None:
-                    predicts = sess.run(predicted_outputs,
-                                        feed_dict={inputs: input_data})
-                else:
-                    predicts, cost = sess.run([predicted_outputs, cost_op],
-                                              feed_dict={
-                                                  inputs: input_data,
-                                                  outputs: output_data})
-                    total_cost = cost
-                append = False
-                DNNDataIO.write_binary_data(predict_filename, predicts, append)
-
-            if output_filenames[i] is not None:
-                duration = format_duration(time.time() - start_time)
-                print('    Evaluation: cost = %e (%s)' % (total_cost, duration))
-
-        sess.close()
+    if args.jobs > 1:
+        pool.close()
+        pool.join()
+    else:
+        synthesizer.close()
 
+    duration = time.time() - start_time
+    print('  %d files (%d frames) in %s: %.2f utterances/sec' %
+          (len(input_filenames), num_frames, format_duration(duration),
+           len(input_filenames) / duration))
     print_time('End forwarding')
     print()
 
@@ -47,6 +47,7 @@ import argparse
 import datetime
 import numpy as np
 import os
+import sys
 import time
 import traceback
 
@@ -67,9 +68,9 @@ parser.add_argument('-C', metavar='cf', dest='config', type=str, required=True,
 parser.add_argument('-H', metavar='dir', dest='model_dir', type=str, required=True,
                     help='set directory to save trained models')
 parser.add_argument('-N', metavar='f', dest='valid_script', type=str, default=None,
-                    help='set validation script file to f')
+                    help='set validation script file (or packed corpus directory) to f')
 parser.add_argument('-S', metavar='f', dest='train_script', type=str, required=True,
-                    help='set training script file to f')
+                    help='set training script file (or packed corpus directory) to f')
 args = parser.parse_args()
 
 
@@ -98,6 +99,10 @@ def format_num_parameters(num_parameters):
 
 def main():
     config = DNNDataIO.load_config(args.config)
+    config.setdefault('mlpg_solver', DNNDefine.default_mlpg_solver)
+    if config['mlpg_solver'] not in DNNDefine.mlpg_solvers:
+        sys.exit('  ERROR  main: Unknown mlpg_solver %s (%s)' %
+                 (config['mlpg_solver'], ', '.join(sorted(DNNDefine.mlpg_solvers))))
 
     if config['adaptation']:
         mode = 'ADAPT'
@@ -175,8 +180,15 @@ def main():
             spkr_pattern=config['spkr_pattern'],
             train_spkrs=config['all_spkrs'],
             seed=config['random_seed'])
-        train_inputs, train_outputs, train_spkr_ids = (
-            train_reader.dequeue(config['batch_size']))
+        if config['frame_by_frame']:
+            train_inputs, train_outputs, train_spkr_ids = (
+                train_reader.dequeue(config['batch_size']))
+        else:
+            # Padded batches of utterances with similar lengths
+            (padded_train_inputs, train_outputs, train_spkr_ids, train_lengths) = (
+                train_reader.dequeue_padded(config['batch_size']))
+            train_inputs, train_spkr_ids = DNNDefine.flatten_padded_batch(
+                padded_train_inputs, train_spkr_ids)
         if config['frame_by_frame']:
             num_train_steps = (config['num_epochs'] * train_reader.num_examples //
                                config['batch_size'])
@@ -197,8 +209,14 @@ def main():
                 spkr_pattern=config['spkr_pattern'],
                 train_spkrs=config['all_spkrs'],
                 seed=config['random_seed'])
-            valid_inputs, valid_outputs, valid_spkr_ids = (
-                valid_reader.dequeue(config['batch_size']))
+            if config['frame_by_frame']:
+                valid_inputs, valid_outputs, valid_spkr_ids = (
+                    valid_reader.dequeue(config['batch_size']))
+            else:
+                (padded_valid_inputs, valid_outputs, valid_spkr_ids, valid_lengths) = (
+                    valid_reader.dequeue_padded(config['batch_size']))
+                valid_inputs, valid_spkr_ids = DNNDefine.flatten_padded_batch(
+                    padded_valid_inputs, valid_spkr_ids)
             if config['frame_by_frame']:
                 num_valid_steps = (valid_reader.num_examples //
                                    config['batch_size'])
@@ -225,6 +243,13 @@ def main():
                     seed=config['random_seed'],
                     initial_variances=variances,
                     initial_gv_variances=gv_variances))
+            if not config['frame_by_frame']:
+                (predicted_train_outputs, train_variances, train_gv_variances) = (
+                    DNNDefine.unflatten_padded_batch(
+                        predicted_train_outputs,
+                        train_variances,
+                        train_gv_variances,
+                        padded_train_inputs))
 
             if args.valid_script is not None:
                 with tf.variable_scope('model', reuse=True):
@@ -240,6 +265,13 @@ def main():
                             config['output_activation'],
                             1.0,
                             mode))
+                if not config['frame_by_frame']:
+                    (predicted_valid_outputs, valid_variances, valid_gv_variances) = (
+                        DNNDefine.unflatten_padded_batch(
+                            predicted_valid_outputs,
+                            valid_variances,
+                            valid_gv_variances,
+                            padded_valid_inputs))
 
         num_parameters = DNNDefine.get_num_params()
         print('Number of parameters: %s' %
@@ -260,7 +292,9 @@ def main():
                 config['msd_flags'],
                 num_windows,
                 window_vector,
-                gv_weight=config['gv_weight'])
+                gv_weight=config['gv_weight'],
+                lengths=train_lengths,
+                solver=config['mlpg_solver'])
 
         if args.valid_script is not None:
             if config['frame_by_frame']:
@@ -278,7 +312,9 @@ def main():
                     config['msd_flags'],
                     num_windows,
                     window_vector,
-                    gv_weight=config['gv_weight'])
+                    gv_weight=config['gv_weight'],
+                    lengths=valid_lengths,
+                    solver=config['mlpg_solver'])
 
         if mode == 'SD':
             train_op = DNNDefine.training(
@@ -306,6 +342,11 @@ def main():
             tf.global_variables_initializer(),
             tf.local_variables_initializer())
 
+        # Fork the data workers before the session starts its threads
+        train_reader.start_workers(config.get('num_workers', 0),
+                                   config.get('prefetch_depth', 8),
+                                   config.get('cache_size', 0))
+
         sess = tf.Session(config=tf.ConfigProto(
             intra_op_parallelism_threads=config['num_threads']))
 
@@ -328,25 +369,36 @@ def main():
                 sess.run(tf.assign(sd_tensors[i], sd_params))
 
         threads = tf.train.start_queue_runners(sess=sess, coord=coord)
-        train_reader.start(sess)
+        train_reader.start(sess,
+                           num_workers=config.get('num_workers', 0),
+                           prefetch_depth=config.get('prefetch_depth', 8),
+                           cache_size=config.get('cache_size', 0),
+                           lru_size=config.get('cache_lru_size', 32))
         if args.valid_script is not None:
             valid_reader.start(sess)
+        train_queue_size_op = train_reader.size()
 
         print_time('Start model training')
         try:
             total_cost = 0.0
+            total_queue_size = 0
             start_time = time.time()
 
             for step in xrange(1, num_train_steps + 1):
-                _, cost = sess.run([train_op, train_cost_op])
+                _, cost, queue_size = sess.run(
+                    [train_op, train_cost_op, train_queue_size_op])
                 total_cost += cost
+                total_queue_size += queue_size
 
                 if step % config['log_interval'] == 0:
                     avg_cost = total_cost / config['log_interval']
+                    avg_queue_size = total_queue_size / config['log_interval']
                     duration = format_duration(time.time() - start_time)
-                    print('  Step %7d: cost = %e (%s)' %
-                          (step, avg_cost, duration))
+                    print('  Step %7d: cost = %e (%s, queue %.0f/%d)' %
+                          (step, avg_cost, duration, avg_queue_size,
+                           train_reader.capacity))
                     total_cost = 0.0
+                    total_queue_size = 0
                     start_time = time.time()
 
                 if step % config['save_interval'] == 0:
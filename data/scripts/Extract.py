@@ -1,26 +1,13 @@
 #!/bin/python
+import argparse
+import glob
 import sys
 import os
-import math
-import struct
+import multiprocessing
+import time
 import re
 import numpy as np
-import statsmodels.api as sm
-from progressbar import *
-import matplotlib.pyplot as plt
-lowess = sm.nonparametric.lowess
-
-def calloc(len):
-    ret = []
-    for i in range(0, len):
-        ret.append(0)
-    return ret
-
-def calloc2d(len):
-    ret = []
-    for i in range(0, len):
-        ret.append([0, 0])
-    return ret
+#statsmodels、scipy和progressbar的导入很慢，只在用到的地方导入
 
 def smooth(a, WSZ):
     # a:原始数据，NumPy 1-D array containing the data to be smoothed 
@@ -33,29 +20,62 @@ def smooth(a, WSZ):
     stop = (np.cumsum(a[:-WSZ:-1])[::2]/r)[::-1]
     return np.concatenate(( start , out0, stop ))
 
-def loadVector(filename, width, typeStr):
-    fsize = os.path.getsize(filename)
-    file = open(filename, 'rb')
-    ret = []
-    oneByte = 4
-    if(typeStr == 'd'):
-        oneByte = 8
-    length = math.floor(fsize / width / oneByte)
-    for i in range(0, length):
-        t = file.read(width * oneByte)
-        ret.append(struct.unpack(typeStr * width, t))
-    file.close()
+#去趋势的窗口为片段长度的2/3，与lowess的默认frac相同
+trendFrac = 2.0 / 3.0
+
+def trendWindow(length, odd = False):
+    ret = int(trendFrac * length + 1e-10)
+    if odd and ret % 2 == 0:
+        ret -= 1
     return ret
 
+def lowessTrend(f0):
+    from statsmodels.nonparametric.smoothers_lowess import lowess
+    return lowess(f0, range(0, len(f0)), it = 20, delta = 0.0)[:, 1]
+
+def lowessDeltaTrend(f0):
+    #间隔不到delta的点用线性插值，不再逐点拟合
+    from statsmodels.nonparametric.smoothers_lowess import lowess
+    return lowess(f0, range(0, len(f0)), it = 20, delta = 0.01 * len(f0))[:, 1]
+
+def windowTrend(f0):
+    #窗口内的线性回归（不加权，不迭代），用累积和计算，O(n)
+    length = len(f0)
+    k = trendWindow(length)
+    x = np.arange(length, dtype = np.float64) - length / 2.0
+    lo = np.clip(np.arange(length) - k // 2, 0, length - k)
+    hi = lo + k
+    def windowMean(v):
+        c = np.concatenate(([0.0], np.cumsum(v)))
+        return (c[hi] - c[lo]) / k
+    mx = windowMean(x)
+    my = windowMean(f0)
+    slope = (windowMean(x * f0) - mx * my) / (windowMean(x * x) - mx * mx)
+    return my + slope * (x - mx)
+
+def savgolTrend(f0):
+    from scipy.signal import savgol_filter
+    return savgol_filter(f0, trendWindow(len(f0), odd = True), 2, mode = 'interp')
+
+def smoothTrend(f0):
+    return smooth(f0, trendWindow(len(f0), odd = True))
+
+detrendBackends = {
+    'lowess': lowessTrend,
+    'lowess-delta': lowessDeltaTrend,
+    'window': windowTrend,
+    'savgol': savgolTrend,
+    'smooth': smoothTrend,
+}
+
+def loadVector(filename, width, typeStr):
+    dtype = np.dtype(typeStr)
+    #不完整的最后一帧被忽略
+    length = os.path.getsize(filename) // width // dtype.itemsize
+    return np.fromfile(filename, dtype, length * width).reshape(length, width)
+
 def saveVector(filename, vector, typeStr):
-    file = open(filename, 'wb')
-    for column in vector:
-        if(not isinstance(column, list)):
-            file.write(struct.pack(typeStr, column))
-        else:
-            for one in column:
-                file.write(struct.pack(typeStr, one))
-    file.close()
+    np.asarray(vector, typeStr).tofile(filename)
 
 def loadLabel(mono, full):
     monoFile = open(mono, 'r')
@@ -80,30 +100,53 @@ def loadLabel(mono, full):
         ret.append(t)
     return ret
 
+def labelArrays(label, framePeriod, fLen):
+    #每个标签的开始帧、结束帧和音高（Hz），休止符（xx）的音高为0
+    n = len(label)
+    ret = np.zeros(n, dtype = [('start', np.int64), ('end', np.int64),
+                               ('pitch', np.float64)])
+    if n == 0:
+        return ret
+    times = np.array([[l[0], l[1]] for l in label])
+    frames = np.floor(times / framePeriod).astype(np.int64)
+    ret['start'] = np.maximum(frames[:, 0], 0)
+    ret['end'] = np.minimum(frames[:, 1], fLen)
+    ret['pitch'] = [lookupNotePitch(notePattern.search(l[3]).group(1))
+                    for l in label]
+    return ret
+
+def labelIndex(start, end, length):
+    #每帧所属的标签序号，标签重叠时后面的优先，不属于任何标签的帧为-1
+    index = np.full(length, -1, dtype = np.int64)
+    valid = np.flatnonzero(start < end)
+    if len(valid) == 0:
+        return index
+    s = start[valid]
+    e = end[valid]
+    if np.all(s[1:] >= e[:-1]):
+        #标签按时间排列且不重叠（通常的情况）：间隔和标签交替，一次np.repeat
+        gaps = s - np.concatenate(([0], e[:-1]))
+        values = np.stack([np.full(len(valid), -1), valid], axis = 1).ravel()
+        counts = np.stack([gaps, e - s], axis = 1).ravel()
+        index[:e[-1]] = np.repeat(values, counts)
+    else:
+        for i, a, b in zip(valid, s, e):
+            index[a:b] = i
+    return index
+
 def soprLog(arr):
-    ret = []
-    for i in range(0, len(arr)):
-        t = []
-        for j in range(0, len(arr[i])):
-            if arr[i][j] <= 0:
-                t.append(1e-8)
-            else:
-                t.append(np.log(arr[i][j]))
-        ret.append(t)
+    #非正数为1e-8（不是log(1e-8)），NaN保持不变
+    arr = np.asarray(arr, np.float64)
+    ret = np.full(arr.shape, 1e-8)
+    valid = ~(arr <= 0)
+    ret[valid] = np.log(arr[valid])
     return ret
 
 def soprExp(arr):
-    ret = []
-    for i in range(0, len(arr)):
-        s = []
-        for j in range(0, len(arr[i])):
-            t = np.exp(arr[i][j])
-            if t < 1:
-                t = 0
-            s.append(t)
-        ret.append(s)
+    ret = np.exp(np.asarray(arr, np.float64))
+    ret[ret < 1] = 0
     return ret
-                
+
 
 def getNotePitch(note):
     scaList = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
@@ -112,117 +155,195 @@ def getNotePitch(note):
     targetF0 = 440 * pow(2.0, octave) * pow(2.0, scale / 12.0)
     return targetF0
 
+#音符名到频率的表，不在表中的音符仍由getNotePitch计算（或报错）
+notePattern = re.compile(r'/E:(\w+)\]')
+notePitchTable = dict((name + str(octave), getNotePitch(name + str(octave)))
+                      for name in ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G',
+                                   'Ab', 'A', 'Bb', 'B']
+                      for octave in range(0, 10))
+notePitchTable['xx'] = 0.0
+
+def lookupNotePitch(note):
+    if note in notePitchTable:
+        return notePitchTable[note]
+    return getNotePitch(note)
+
+def voicedSegments(f0, start, end):
+    #[start, end)中从浊音帧开始、到清音帧为止的片段，到end还没有清音帧的片段被舍弃
+    #NaN帧既不开始也不结束片段
+    x = f0[start:end]
+    unvoiced = np.concatenate(([True], x < 55.0, [True])).astype(np.int8)
+    edges = np.diff(unvoiced)
+    runStarts = np.flatnonzero(edges == -1)
+    runEnds = np.flatnonzero(edges == 1)
+    keep = runEnds < len(x)
+    runStarts = runStarts[keep]
+    runEnds = runEnds[keep]
+    #每个非清音区间中的第一个浊音帧
+    voiced = np.flatnonzero(x >= 55.0)
+    first = np.searchsorted(voiced, runStarts)
+    ostarts = np.append(voiced, len(x))[first]
+    keep = ostarts < runEnds
+    return [(start + int(a), start + int(b))
+            for a, b in zip(ostarts[keep], runEnds[keep])]
+
 def getVibrate(f0):
     length = len(f0)
     if length <= 2:
         return
-    vib = calloc2d(length) #[vbr, vbp]
-    if f0[0] < 0:
-        positive = False
-    else:
-        positive = True
-
-    interPoints = []
-    #计算交点
-    for i in range(0, length):
-        if(positive and f0[i] <= 0):
-            interPoints.append(i)
-            positive = False
-        elif(not positive and f0[i] >= 0):
-            interPoints.append(i)
-            positive = True
+    #前length帧为0，[vbr, vbp]接在其后
+    vib = [np.zeros((length, 2))]
+    positive0 = not f0[0] < 0
+
+    #计算交点：正数和负数决定符号，0使符号翻转，NaN不改变符号
+    frames = np.arange(length)
+    last = np.maximum.accumulate(np.where((f0 > 0) | (f0 < 0), frames, -1))
+    zeros = np.cumsum(f0 == 0)
+    lastIndex = np.maximum(last, 0)
+    sign = np.where(last >= 0, f0[lastIndex] > 0, positive0)
+    flips = zeros - np.where(last >= 0, zeros[lastIndex], 0)
+    positive = sign ^ (flips % 2 == 1)
+    interPoints = np.flatnonzero(
+        positive != np.concatenate(([positive0], positive[:-1])))
+
     peak = 0
     period = 0
-    for i in range(0, len(interPoints) - 1):
-        #计算每一段的深度最大值
-        start = interPoints[i]
-        end = interPoints[i + 1]
-        t = abs(f0[start:end])
-        #峰值
-        peak = max(t)
-        if(peak < 5):
-            continue
-        #周期
-        period = end - start / 2
-        for j in range(start, end):
-            vib.append([peak, period])
-    for i in range(interPoints[-1], length):
-        vib.append([peak, period])
-    return vib
+    if len(interPoints) > 1:
+        #计算每一段的深度最大值和周期
+        starts = interPoints[:-1]
+        ends = interPoints[1:]
+        peaks = np.maximum.reduceat(np.abs(f0[:interPoints[-1]]), starts)
+        periods = ends - starts / 2
+        #峰值小于5的段被跳过，但最后的峰值仍然来自最后一段
+        valid = ~(peaks < 5)
+        vib.append(np.repeat(np.stack([peaks, periods], axis = 1)[valid],
+                             (ends - starts)[valid], axis = 0))
+        peak = peaks[-1]
+        if np.any(valid):
+            period = periods[valid][-1]
+    vib.append(np.tile([peak, period], (length - interPoints[-1], 1)))
+    return np.concatenate(vib)
 
-if __name__ == "__main__":
-    if(len(sys.argv) != 3):
-        print("Usage: python %s <basename> <frame_period>" % sys.argv[0])
-        exit()
-    base = sys.argv[1]
-    framePeriod = float(sys.argv[2])
-    lf0 = 'lf0/%s.lf0' % base
-    vib = 'vib/%s.vib' % base
-    mono = 'labels/mono/%s.lab' % base
-    full = 'labels/full/%s.lab' % base
-    
-    f0 = soprExp(loadVector(lf0, 1, 'f'))
+def extract(lf0, vib, mono, full, framePeriod, detrend = 'lowess',
+            showProgress = True):
+    f0 = soprExp(loadVector(lf0, 1, 'f'))[:, 0]
+    unvoiced = f0 < 55.0
 
     fLen = len(f0)
-    df0 = calloc2d(fLen)
-    df02 = calloc(fLen)
-    label = loadLabel(mono, full)
-    vibrate = calloc2d(fLen)
+    label = labelArrays(loadLabel(mono, full), framePeriod, fLen)
+    vibrate = np.zeros((fLen, 2))
     lLen = len(label)
 
-    widgets = ['Extract VIB: ',Percentage(), ' ', Bar('#'), ' ']
-    pbar = ProgressBar(widgets = widgets).start()
+    #计算差分f0：每帧的音高由其所属的标签决定
+    index = labelIndex(label['start'], label['end'], fLen)
+    covered = index >= 0
+    basePitch = label['pitch'][index] if lLen > 0 else np.zeros(fLen)
+    t = f0 - basePitch + 500
+    t[t <= 0] = -1
+    df0 = np.zeros((fLen, 2))
+    df0[covered, 0] = f0[covered]
+    df0[:, 1] = np.where(covered & ~unvoiced, t, 0)
+
+    pbar = None
+    if showProgress:
+        from progressbar import Bar, Percentage, ProgressBar
+        widgets = ['Extract VIB: ',Percentage(), ' ', Bar('#'), ' ']
+        pbar = ProgressBar(widgets = widgets).start()
     for i in range(0, lLen):
-        pbar.update((i / lLen) * 100)
-        start = max(math.floor(label[i][0] / framePeriod), 0)
-        end = min(math.floor(label[i][1] / framePeriod), fLen)
-        notePitch = re.findall(r'/E:\w+\]', label[i][3])[0]
-        notePitch = notePitch.replace('/E:', '').replace(']', '')
-        basePitch = 0
-        if(notePitch != 'xx'):
-            #print(notePitch)
-            basePitch = getNotePitch(notePitch)
-        #计算差分f0
-        for j in range(start, end):
-            t = f0[j][0] - basePitch + 500
-            if t <= 0:
-                t = -1
-            df0[j][0] = f0[j][0]
-            if(f0[j][0] < 55.0):
-                df0[j][1] = 0
-                df02[j] = 0
-            else:
-                df0[j][1] = t
-                df02[j] = f0[j][0] - basePitch
+        if pbar is not None:
+            pbar.update((i / lLen) * 100)
+        start = int(label['start'][i])
+        end = int(label['end'][i])
         #计算颤音
-        #先把前后为0的区域trim掉，再根据中间的0切分
-        j = start
-        while j < end:
-            ostart = j
-            oend = 0
-            firstTime = True
-            while j < end:
-                if firstTime and f0[j][0] >= 55.0:
-                    #标记开始时间
-                    ostart = j
-                    firstTime = False
-                elif not firstTime and f0[j][0] < 55.0:
-                    oend = j
-                    break
-                j += 1
-            if oend == 0:
-                continue
-            #print("start: %d, end: %d" % (ostart, oend))
+        for ostart, oend in voicedSegments(f0, start, end):
             if(oend - ostart > 20):
-                #有数据的部分
-                pf0 = np.array(df02[ostart:oend])
-                keys = range(0, len(pf0))
-                s = lowess(pf0, keys, it = 20, delta = 0.0)
-                pf0 = pf0 - s[:, 1]
+                #有数据的部分，使用本标签的音高
+                pf0 = f0[ostart:oend] - label['pitch'][i]
+                pf0 = pf0 - detrendBackends[detrend](pf0)
                 t = getVibrate(pf0)
-                for k in range(0, len(t)):
-                    vibrate[ostart + k][0] = t[k][0]
-                    vibrate[ostart + k][1] = t[k][1]
+                #getVibrate的结果比片段长，可能超出最后一帧
+                if ostart + len(t) > fLen:
+                    raise IndexError("vibrato exceeds the last frame.")
+                vibrate[ostart:ostart + len(t)] = t
     saveVector(lf0, soprLog(df0), 'f')
     saveVector(vib, soprLog(vibrate), 'f')
-    pbar.finish()
\ No newline at end of file
+    if pbar is not None:
+        pbar.finish()
+
+def extractFile(base, framePeriod, detrend = 'lowess', showProgress = True):
+    lf0 = 'lf0/%s.lf0' % base
+    vib = 'vib/%s.vib' % base
+    mono = 'labels/mono/%s.lab' % base
+    full = 'labels/full/%s.lab' % base
+    try:
+        extract(lf0, vib, mono, full, framePeriod, detrend, showProgress)
+    except Exception as e:
+        return ["Failed to extract features from %s: %s" % (base, e)]
+    #与Makefile中对每个文件的NaN检查相同：有NaN或Inf的输出被删除
+    errors = []
+    for filename, kind in [(lf0, 'LF0'), (vib, 'VIB')]:
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            if not np.all(np.isfinite(np.fromfile(filename, np.float32))):
+                errors.append("Failed to extract features from %s: %s error" %
+                              (base, kind))
+                os.remove(filename)
+    return errors
+
+def extractWorker(args):
+    return extractFile(*args)
+
+def getBasenames(patterns, listFile = None):
+    #通配符在lf0目录中展开
+    bases = []
+    if listFile is not None:
+        with open(listFile, 'r') as f:
+            bases.extend(line.strip() for line in f if line.strip() != '')
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            filenames = sorted(glob.glob('lf0/%s.lf0' % pattern))
+            bases.extend(os.path.basename(f)[:-len('.lf0')] for f in filenames)
+        else:
+            bases.append(pattern)
+    return bases
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('bases', metavar = 'basename', nargs = '*',
+                        help = 'basenames or glob patterns of files in lf0/')
+    parser.add_argument('framePeriod', metavar = 'frame_period', type = float)
+    parser.add_argument('-d', metavar = 'backend', dest = 'detrend',
+                        default = 'lowess', choices = sorted(detrendBackends),
+                        help = 'trend removed from F0 before extracting vibrato')
+    parser.add_argument('-l', metavar = 'file', dest = 'listFile', default = None,
+                        help = 'file with one basename per line')
+    parser.add_argument('-j', metavar = 'n', dest = 'jobs', type = int,
+                        default = 1, help = 'number of processes (0 -> all CPUs)')
+    parser.add_argument('-s', dest = 'strict', action = 'store_true',
+                        help = 'exit with status 1 if any file failed (default: '
+                        'report and remove the bad files, then carry on)')
+    args = parser.parse_args()
+    bases = getBasenames(args.bases, args.listFile)
+    if len(bases) == 0:
+        parser.error('no basenames to extract')
+
+    #批处理时不显示进度条
+    showProgress = len(bases) == 1
+    jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+    tasks = [(base, args.framePeriod, args.detrend, showProgress) for base in bases]
+    startTime = time.time()
+    numFailed = 0
+    if jobs == 1 or len(bases) == 1:
+        results = map(extractWorker, tasks)
+    else:
+        pool = multiprocessing.Pool(min(jobs, len(bases)))
+        results = pool.imap(extractWorker, tasks)
+    for errors in results:
+        for error in errors:
+            print(" " + error)
+        numFailed += len(errors) > 0
+        sys.stdout.flush()
+    if len(bases) > 1:
+        print("Extracted VIB from %d files (%d failed) in %.1f sec" %
+              (len(bases), numFailed, time.time() - startTime))
+    if args.strict and numFailed > 0:
+        sys.exit(1)
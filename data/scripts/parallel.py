@@ -2,45 +2,300 @@
 #脚本的作用：通过并行提升HTS训练速度
 #需要配合修改后的training.pl使用
 #作者：hyperzlib
+import argparse
+import asyncio
+import glob
+import hashlib
+import json
+import os
 import re
+import signal
+import socket
 import sys
 import threading
 import time
 import subprocess
 import platform
 
-from queue import Queue
+from collections import deque
+from queue import Empty, Queue
 #from tkinter import *
 from multiprocessing import cpu_count
 
 global shellEncoding
 
 class threadCtrl:
-    def __init__(self, threadNum, conf):
+    def __init__(self, threadNum, conf, memory = 0, retries = 0,
+                 keepGoing = False, engine = 'thread', logDir = None,
+                 tail = False, cache = None):
+        checkDependencies(conf)
         self.config = conf
         self.threadNum = threadNum
+        self.memory = memory #0为不限制
+        self.retries = retries
+        self.keepGoing = keepGoing
+        self.engine = engine #executors中的名字，或返回线程列表的函数
+        self.logDir = logDir
+        #有日志文件时只在tail为真时输出到控制台
+        self.console = logDir is None or tail
+        self.cache = cache #None为不使用缓存
+        self.cacheKeys = {}
+        self.cacheHits = []
         self.finished = []
-        self.threadName = list(conf.keys())
-        self.threadCommands = list(conf.values())
+        self.results = {}
         self.threadList = []
         self.queue = Queue()
-        for i in range(0, len(self.threadName)):
-            self.queue.put([self.threadName[i], self.threadCommands[i]])
+        self.doneQueue = Queue()
+        self.stop = threading.Event()
         self.createThreads()
+        self.scheduler = threading.Thread(target = self.schedule)
 
     def createThreads(self):
-        lock = threading.Lock()
-        for i in range(0, self.threadNum):
-            thread = runShell(i, self.queue, lock)
-            self.threadList.append(thread)
+        if self.logDir is not None and not os.path.isdir(self.logDir):
+            os.makedirs(self.logDir)
+        engine = self.engine
+        if not callable(engine):
+            engine = executors[engine]
+        self.threadList.extend(engine(self))
 
     def start(self):
-        for i in range(0, self.threadNum):
-            self.threadList[i].start()
+        self.startTime = time.time()
+        for thread in self.threadList:
+            thread.start()
+        self.scheduler.start()
 
     def wait(self):
+        self.scheduler.join()
+        for thread in self.threadList:
+            thread.join()
+
+    def schedule(self):
+        #依赖都已完成的部分按配置文件中的顺序开始，
+        #同时运行的部分不超过线程数，声明的内存之和不超过限制
+        pending = list(self.config.keys())
+        running = {}
+        freeMemory = self.memory
+        while len(pending) > 0 or len(running) > 0:
+            #停止后收回还没有线程取走的部分
+            while self.stop.is_set():
+                try:
+                    config = self.queue.get_nowait()
+                except Empty:
+                    break
+                freeMemory += running.pop(config[0])
+                self.results[config[0]] = skippedResult()
+            #缓存命中的部分直接完成，可能使排在前面的部分可以开始
+            changed = True
+            while changed and not self.stop.is_set():
+                changed = False
+                for name in list(pending):
+                    if self.stop.is_set():
+                        break
+                    section = self.config[name]
+                    if any(dep not in self.finished for dep in section['depends']):
+                        continue
+                    if self.checkCache(name):
+                        pending.remove(name)
+                        self.finished.append(name)
+                        self.results[name] = cachedResult()
+                        changed = True
+                        continue
+                    if len(running) >= self.threadNum:
+                        continue
+                    #超过限制的部分在没有其它部分运行时单独运行
+                    need = section['memory']
+                    if self.memory > 0 and need > freeMemory and len(running) > 0:
+                        continue
+                    pending.remove(name)
+                    running[name] = need
+                    freeMemory -= need
+                    retries = section['retries']
+                    if retries is None:
+                        retries = self.retries
+                    self.queue.put([name, section['commands'], retries])
+            if len(running) == 0:
+                break
+            name, result = self.doneQueue.get()
+            freeMemory += running.pop(name)
+            self.results[name] = result
+            if name in self.cacheKeys:
+                if result['status'] == 'ok':
+                    self.cache.update(name, self.config[name], self.cacheKeys[name])
+                else:
+                    self.cache.remove(name)
+            if result['status'] == 'ok':
+                self.finished.append(name)
+            elif self.stop.is_set():
+                pass
+            elif self.keepGoing:
+                #依赖失败部分的部分（包括间接依赖）不再运行
+                changed = True
+                while changed:
+                    changed = False
+                    for other in list(pending):
+                        if any(dep in self.results and not isSuccess(self.results[dep])
+                               for dep in self.config[other]['depends']):
+                            pending.remove(other)
+                            self.results[other] = skippedResult()
+                            changed = True
+            else:
+                self.cancel()
+        for name in pending:
+            self.results[name] = skippedResult()
+        #每个线程收到None后结束
         for i in range(0, self.threadNum):
-            self.threadList[i].join()
+            self.queue.put(None)
+
+    def checkCache(self, name):
+        #只有声明了outputs=的部分可以跳过：依赖的部分都来自缓存，
+        #命令和输入与上次成功时相同，输出也没有被改动或删除
+        if self.cache is None or name in self.cacheKeys:
+            return False
+        section = self.config[name]
+        if len(section['outputs']) == 0:
+            return False
+        self.cacheKeys[name] = self.cache.key(section)
+        if any(self.results[dep]['status'] != 'cached' for dep in section['depends']):
+            return False
+        if not self.cache.isUpToDate(name, section, self.cacheKeys[name]):
+            return False
+        del self.cacheKeys[name]
+        self.cacheHits.append(name)
+        return True
+
+    def cancel(self):
+        #不再开始新的部分，终止正在运行的命令
+        self.stop.set()
+        for thread in self.threadList:
+            thread.terminate()
+
+    def succeeded(self):
+        return all(isSuccess(result) for result in self.results.values())
+
+    def printSummary(self):
+        #按运行时间从长到短
+        duration = time.time() - self.startTime
+        names = sorted(self.results, key = lambda name: -self.results[name]['time'])
+        counts = {}
+        for result in self.results.values():
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+        jobTime = sum(result['time'] for result in self.results.values())
+        print("Summary: %d sections (%s) in %.1f sec, %.1f sec of jobs (%.1f at a time)" %
+              (len(self.results),
+               ", ".join("%d %s" % (counts[status], status) for status in
+                         ['ok', 'cached', 'failed', 'cancelled', 'skipped'] if status in counts),
+               duration, jobTime, jobTime / max(duration, 1e-6)))
+        width = max([len(name) for name in names] + [7])
+        print("  %-*s %-9s %8s %6s %10s %7s" %
+              (width, "Section", "Status", "Attempts", "Exit", "Time [sec]", "Slot"))
+        for name in names:
+            result = self.results[name]
+            print("  %-*s %-9s %8d %6s %10.2f %7s" %
+                  (width, name, result['status'], result['attempts'],
+                   "-" if result['returncode'] is None else result['returncode'],
+                   result['time'],
+                   "-" if result['thread'] is None else result['thread']))
+        if self.cache is not None:
+            print("Cache: %d hits, %d misses, %d sections without outputs= (%s)" %
+                  (len(self.cacheHits), len(self.cacheKeys),
+                   len([name for name in self.config if len(self.config[name]['outputs']) == 0]),
+                   self.cache.filename))
+        sys.stdout.flush()
+
+def skippedResult():
+    return {'status': 'skipped', 'returncode': None, 'attempts': 0,
+            'time': 0.0, 'thread': None}
+
+def cachedResult():
+    return {'status': 'cached', 'returncode': None, 'attempts': 0,
+            'time': 0.0, 'thread': None}
+
+def isSuccess(result):
+    return result['status'] in ('ok', 'cached')
+
+def openLog(logDir, name):
+    if logDir is None:
+        return None
+    return open(os.path.join(logDir, re.sub(r'[^\w.-]+', '_', name) + '.log'), 'wb')
+
+def killProcessGroup(proc):
+    #命令在自己的进程组中运行，连同shell启动的子进程一起终止
+    try:
+        if hasattr(os, 'killpg'):
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            proc.terminate()
+    except OSError:
+        pass
+
+class resultCache:
+    #以部分名为键记录上次成功运行时的命令、输入和输出，保存为JSON文件
+    def __init__(self, filename, useMtime = False):
+        self.filename = filename
+        self.useMtime = useMtime #只比较大小和修改时间，不读取文件内容
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename, 'r') as fp:
+                self.entries = json.load(fp)
+
+    def signature(self, path):
+        if not os.path.isfile(path):
+            return None
+        if self.useMtime:
+            stat = os.stat(path)
+            return "%d:%d" % (stat.st_size, stat.st_mtime_ns)
+        digest = hashlib.sha1()
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def expand(self, patterns):
+        #没有匹配的通配符原样保留，当作不存在的文件
+        paths = []
+        for pattern in patterns:
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else []
+            paths.extend(matches if len(matches) > 0 else [pattern])
+        return paths
+
+    def key(self, section):
+        digest = hashlib.sha1()
+        for command in section['commands']:
+            digest.update(("%s\n" % command).encode('utf-8'))
+        for path in self.expand(section['inputs']):
+            digest.update(("%s=%s\n" % (path, self.signature(path))).encode('utf-8'))
+        return digest.hexdigest()
+
+    def isUpToDate(self, name, section, key):
+        entry = self.entries.get(name)
+        if entry is None or entry['key'] != key:
+            return False
+        outputs = self.expand(section['outputs'])
+        if sorted(outputs) != sorted(entry['outputs']):
+            return False
+        for path in outputs:
+            signature = self.signature(path)
+            if signature is None or signature != entry['outputs'][path]:
+                return False
+        return True
+
+    def update(self, name, section, key):
+        outputs = self.expand(section['outputs'])
+        self.entries[name] = {'key': key, 'outputs': dict(
+            (path, self.signature(path)) for path in outputs)}
+        self.save()
+
+    def remove(self, name):
+        if name in self.entries:
+            del self.entries[name]
+            self.save()
+
+    def save(self):
+        #先写临时文件再替换，中断时不会留下不完整的缓存
+        tmpFile = self.filename + '.tmp'
+        with open(tmpFile, 'w') as fp:
+            json.dump(self.entries, fp, indent = 1, sort_keys = True)
+        os.replace(tmpFile, self.filename)
 
 # class outputWindow(threading.Thread):
     # def __init__(self, threadId):
@@ -72,50 +327,646 @@ class threadCtrl:
 
 
 class runShell(threading.Thread):
-    def __init__(self, threadId, queue, lock):
+    def __init__(self, threadId, queue, lock, doneQueue, stop, logDir = None,
+                 console = True):
         threading.Thread.__init__(self)
         self.threadId = threadId
         self.queue = queue
         self.lock = lock
+        self.doneQueue = doneQueue
+        self.stop = stop
+        self.logDir = logDir
+        self.console = console
+        self.proc = None
+
+    def terminate(self):
+        proc = self.proc
+        if proc is not None and proc.poll() is None:
+            killProcessGroup(proc)
     
     def run(self):
         global shellEncoding
         #window = outputWindow(self.threadId)
         #window.start()
-        while not self.queue.empty():
+        while True:
             config = self.queue.get()
+            if config is None:
+                break
             name = config[0]
             commands = config[1]
+            retries = config[2]
             print("Thread %d now starting: %s" % (self.threadId + 1, name))
             #window.changeTaskName(name)
+            startTime = time.time()
+            result = {'status': 'ok', 'returncode': 0, 'attempts': 0,
+                      'thread': self.threadId + 1}
+            #调度器等待每个部分的结果，出现异常也要放入doneQueue
+            try:
+                self.runSection(name, commands, retries, result)
+            except Exception as e:
+                result['status'] = 'failed'
+                result['returncode'] = None
+                with self.lock:
+                    print("Thread %d failed: %s: %s" % (self.threadId + 1, name, e))
+            finally:
+                result['time'] = time.time() - startTime
+                self.doneQueue.put((name, result))
+
+    def runSection(self, name, commands, retries, result):
+        log = openLog(self.logDir, name)
+        try:
             for command in commands:
-                proc = subprocess.Popen(command, bufsize=0, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) #打开新进程
-                sout = proc.stdout
-                done = False
-                while not done:
-                    buffer = str(sout.readline(), shellEncoding)
-                    if buffer == "":
-                        done = True
-                    else:
-                        buffer = buffer.rstrip("\r\n")
+                #失败的命令最多重试retries次，之后该部分的其余命令不再运行
+                for attempt in range(0, retries + 1):
+                    if self.stop.is_set():
+                        break
+                    if attempt > 0:
+                        self.lock.acquire()
+                        print("Thread %d retrying (%d/%d): %s" %
+                              (self.threadId + 1, attempt, retries, command))
+                        self.lock.release()
+                    result['attempts'] += 1
+                    returncode = self.runCommand(command, log)
+                    if returncode == 0:
+                        break
+                if self.stop.is_set():
+                    result['status'] = 'cancelled'
+                    result['returncode'] = None
+                    break
+                if returncode != 0:
+                    result['status'] = 'failed'
+                    result['returncode'] = returncode
+                    self.lock.acquire()
+                    print("Thread %d failed: %s (exit status %d): %s" %
+                          (self.threadId + 1, name, returncode, command))
+                    self.lock.release()
+                    break
+        finally:
+            if log is not None:
+                log.close()
+
+    def runCommand(self, command, log = None):
+        global shellEncoding
+        proc = subprocess.Popen(command, bufsize=0, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True) #打开新进程
+        self.proc = proc
+        sout = proc.stdout
+        try:
+            if log is not None:
+                log.write(("$ %s\n" % command).encode(shellEncoding))
+            done = False
+            while not done:
+                line = sout.readline()
+                if line == b"":
+                    done = True
+                else:
+                    if log is not None:
+                        log.write(line)
+                    if self.console:
+                        buffer = str(line, shellEncoding, 'replace').rstrip("\r\n")
                         self.lock.acquire()
                         print("[T %d] %s" % (self.threadId + 1, buffer))
                         self.lock.release()
+        except Exception:
+            #读取或写日志失败时不留下还在运行的命令
+            killProcessGroup(proc)
+            raise
+        finally:
+            sout.close()
+            returncode = proc.wait()
+            self.proc = None
+        return returncode
+
+
+class asyncShell(threading.Thread):
+    #在一个线程的事件循环中运行所有部分，输出按块写入日志文件
+    def __init__(self, slots, queue, doneQueue, stop, logDir = None,
+                 console = True):
+        threading.Thread.__init__(self)
+        self.queue = queue
+        self.doneQueue = doneQueue
+        self.stop = stop
+        self.logDir = logDir
+        self.console = console
+        self.freeSlots = list(range(slots, 0, -1))
+        self.procs = set()
+        self.loop = None
+
+    def run(self):
+        asyncio.run(self.main())
+
+    def terminate(self):
+        try:
+            self.loop.call_soon_threadsafe(self.killAll)
+        except (AttributeError, RuntimeError):
+            pass
+
+    def killAll(self):
+        for proc in self.procs:
+            if proc.returncode is None:
+                killProcessGroup(proc)
+
+    async def main(self):
+        self.loop = asyncio.get_running_loop()
+        tasks = set()
+        while True:
+            #队列的阻塞读取放在另一个线程中
+            config = await self.loop.run_in_executor(None, self.queue.get)
+            if config is None:
+                break
+            task = asyncio.ensure_future(self.runSection(*config))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if len(tasks) > 0:
+            await asyncio.wait(tasks)
+
+    async def runSection(self, name, commands, retries):
+        slot = self.freeSlots.pop()
+        print("Slot %d now starting: %s" % (slot, name))
+        startTime = time.time()
+        result = {'status': 'ok', 'returncode': 0, 'attempts': 0, 'thread': slot}
+        #调度器等待每个部分的结果，出现异常也要放入doneQueue
+        log = None
+        try:
+            log = openLog(self.logDir, name)
+            for command in commands:
+                #失败的命令最多重试retries次，之后该部分的其余命令不再运行
+                for attempt in range(0, retries + 1):
+                    if self.stop.is_set():
+                        break
+                    if attempt > 0:
+                        print("Slot %d retrying (%d/%d): %s" %
+                              (slot, attempt, retries, command))
+                    result['attempts'] += 1
+                    returncode = await self.runCommand(command, name, log)
+                    if returncode == 0:
+                        break
+                if self.stop.is_set():
+                    result['status'] = 'cancelled'
+                    result['returncode'] = None
+                    break
+                if returncode != 0:
+                    result['status'] = 'failed'
+                    result['returncode'] = returncode
+                    print("Slot %d failed: %s (exit status %d): %s" %
+                          (slot, name, returncode, command))
+                    break
+        except Exception as e:
+            result['status'] = 'failed'
+            result['returncode'] = None
+            print("Slot %d failed: %s: %s" % (slot, name, e))
+        finally:
+            if log is not None:
+                log.close()
+            result['time'] = time.time() - startTime
+            self.freeSlots.append(slot)
+            self.doneQueue.put((name, result))
+
+    async def runCommand(self, command, name, log):
+        global shellEncoding
+        proc = await asyncio.create_subprocess_shell(
+            command, stdout = asyncio.subprocess.PIPE,
+            stderr = asyncio.subprocess.STDOUT, start_new_session = True)
+        self.procs.add(proc)
+        try:
+            if log is not None:
+                log.write(("$ %s\n" % command).encode(shellEncoding))
+            #控制台输出以部分名为前缀，不完整的行留到下一块
+            rest = b""
+            while True:
+                chunk = await proc.stdout.read(65536)
+                if chunk == b"":
+                    break
+                if log is not None:
+                    log.write(chunk)
+                if self.console:
+                    lines = (rest + chunk).split(b"\n")
+                    rest = lines.pop()
+                    if len(lines) > 0:
+                        print("\n".join("[%s] %s" % (name, str(line, shellEncoding, 'replace').rstrip("\r"))
+                                        for line in lines))
+            if self.console and rest != b"":
+                print("[%s] %s" % (name, str(rest, shellEncoding, 'replace').rstrip("\r")))
+        except Exception:
+            #读取或写日志失败时不留下还在运行的命令
+            killProcessGroup(proc)
+            raise
+        finally:
+            returncode = await proc.wait()
+            self.procs.discard(proc)
+        return returncode
+
 
+class remoteShell(threading.Thread):
+    #把部分分给用parallel.py -w连接进来的工作进程，每个工作进程除了
+    #正在运行的部分外还可以预先排队prefetch倍槽位数的部分，
+    #空闲的工作进程从排队最多的工作进程那里拿走一半还没开始的部分
+    def __init__(self, address, queue, doneQueue, stop, prefetch = 1):
+        threading.Thread.__init__(self)
+        self.address = address
+        self.queue = queue
+        self.doneQueue = doneQueue
+        self.stop = stop
+        self.prefetch = prefetch
+        self.events = Queue()
+        self.workers = {}
+        self.nextId = 1
+        self.pending = deque() #还没有分给工作进程的部分
+        self.sections = {} #还没有结果的部分
+        self.finishing = False
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(address)
+        self.server.listen(16)
+
+    def terminate(self):
+        self.events.put(('cancel', None, None))
+
+    def run(self):
+        print("Waiting for workers on %s:%d" % self.server.getsockname()[:2])
+        sys.stdout.flush()
+        for target in [self.accept, self.feed]:
+            threading.Thread(target = target, daemon = True).start()
+        lastHeartbeat = time.time()
+        while not self.finishing or len(self.sections) > 0:
+            try:
+                self.handle(*self.events.get(timeout = min(1.0, heartbeatInterval)))
+            except Empty:
+                pass
+            if time.time() - lastHeartbeat >= heartbeatInterval:
+                lastHeartbeat = time.time()
+                self.broadcast({'type': 'heartbeat'})
+            if self.stop.is_set():
+                #停止后不再分配，排队的部分算作跳过
+                while len(self.pending) > 0:
+                    name = self.pending.popleft()
+                    del self.sections[name]
+                    self.doneQueue.put((name, skippedResult()))
+            self.assign()
+            self.balance()
+        self.broadcast({'type': 'exit'})
+        for worker in list(self.workers.values()):
+            worker.close()
+        self.server.close()
+
+    def accept(self):
+        while True:
+            try:
+                sock, address = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target = self.listen, args = (sock,),
+                             daemon = True).start()
+
+    def listen(self, sock):
+        #在heartbeatTimeout内没有收到任何消息时当作断开
+        sock.settimeout(heartbeatTimeout)
+        worker = remoteWorker(sock)
+        for message in readMessages(sock):
+            self.events.put(('message', worker, message))
+        self.events.put(('lost', worker, None))
+
+    def feed(self):
+        while True:
+            config = self.queue.get()
+            if config is None:
+                self.events.put(('finish', None, None))
+                break
+            self.events.put(('section', None, config))
+
+    def handle(self, event, worker, data):
+        if event == 'section':
+            self.sections[data[0]] = data
+            self.pending.append(data[0])
+        elif event == 'finish':
+            self.finishing = True
+        elif event == 'cancel':
+            self.broadcast({'type': 'cancel'})
+        elif event == 'lost':
+            self.lose(worker)
+        else:
+            try:
+                self.receive(worker, data)
+            except (KeyError, TypeError, ValueError, AttributeError):
+                #格式不对的消息：断开这个工作进程，它的部分重新分配
+                print("Worker %d sent a malformed message" % worker.id)
+                self.lose(worker)
+
+    def receive(self, worker, data):
+        if data['type'] == 'hello' and worker.id == 0:
+            worker.slots = max(int(data['slots']), 1)
+            worker.id = self.nextId
+            self.nextId += 1
+            self.workers[worker.id] = worker
+            print("Worker %d joined: %s, %d slots" % (worker.id, data['host'], worker.slots))
+            if self.stop.is_set():
+                self.send(worker, {'type': 'cancel'})
+        elif self.workers.get(worker.id) is not worker:
+            pass
+        elif data['type'] == 'done':
+            name = data['name']
+            if name in worker.assigned:
+                result = checkResult(data['result'])
+                worker.assigned.remove(name)
+                del self.sections[name]
+                result['thread'] = "w%d/%s" % (worker.id, result['thread'])
+                self.doneQueue.put((name, result))
+        elif data['type'] == 'stolen':
+            names = [name for name in data['names'] if name in worker.assigned]
+            for name in names:
+                worker.assigned.remove(name)
+            self.pending.extendleft(reversed(names))
+            worker.robbed = False
+            if len(names) > 0:
+                print("Worker %d gave up %d queued sections" % (worker.id, len(names)))
 
+    def send(self, worker, message):
+        try:
+            worker.send(message)
+        except OSError:
+            self.lose(worker)
+
+    def broadcast(self, message):
+        for worker in list(self.workers.values()):
+            self.send(worker, message)
+
+    def lose(self, worker):
+        #断开的工作进程上的部分重新分配
+        if self.workers.get(worker.id) is not worker:
+            worker.close()
+            return
+        del self.workers[worker.id]
+        worker.close()
+        print("Worker %d lost, %d sections requeued" % (worker.id, len(worker.assigned)))
+        self.pending.extendleft(reversed(worker.assigned))
+        worker.assigned = []
+
+    def assign(self):
+        while len(self.pending) > 0 and not self.stop.is_set():
+            #分给已分配部分相对槽位数最少的工作进程
+            workers = [worker for worker in self.workers.values()
+                       if len(worker.assigned) < worker.slots * (1 + self.prefetch)]
+            if len(workers) == 0:
+                break
+            worker = min(workers, key = lambda worker:
+                         (len(worker.assigned) / float(worker.slots), worker.id))
+            name = self.pending.popleft()
+            config = self.sections[name]
+            worker.assigned.append(name)
+            print("Worker %d now queued: %s" % (worker.id, name))
+            self.send(worker, {'type': 'run', 'name': name,
+                               'commands': config[1], 'retries': config[2]})
+
+    def balance(self):
+        if len(self.pending) > 0 or self.stop.is_set():
+            return
+        for thief in list(self.workers.values()):
+            free = thief.slots - len(thief.assigned)
+            victims = [worker for worker in self.workers.values()
+                       if len(worker.assigned) > worker.slots and not worker.robbed]
+            if free <= 0 or len(victims) == 0:
+                continue
+            victim = max(victims, key = lambda worker: len(worker.assigned) - worker.slots)
+            victim.robbed = True
+            count = min(free, (len(victim.assigned) - victim.slots + 1) // 2)
+            self.send(victim, {'type': 'steal', 'count': count})
+
+class remoteWorker:
+    #remoteShell中一个连接进来的工作进程
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.id = 0
+        self.slots = 1
+        self.assigned = [] #已发送还没有结果的部分
+        self.robbed = False #发出了steal还没有回复
+
+    def send(self, message):
+        sendMessage(self.sock, self.lock, message)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+class workerAgent:
+    #工作进程：连接到-e remote的parallel.py，用runShell在本机运行分到的部分，
+    #一次运行结束或连接断开后重新连接，等待下一次运行
+    def __init__(self, address, slots, logDir = None, console = True, once = False):
+        self.address = address
+        self.slots = slots
+        self.logDir = logDir
+        self.console = console
+        self.once = once
+
+    def serve(self):
+        if self.logDir is not None and not os.path.isdir(self.logDir):
+            os.makedirs(self.logDir)
+        waiting = False
+        while True:
+            try:
+                sock = socket.create_connection(self.address, timeout = heartbeatTimeout)
+            except OSError:
+                if not waiting:
+                    print("Waiting for %s:%d" % self.address)
+                    sys.stdout.flush()
+                    waiting = True
+                time.sleep(1.0)
+                continue
+            waiting = False
+            print("Connected to %s:%d" % self.address)
+            self.session(sock)
+            if self.once:
+                break
+
+    def session(self, sock):
+        sendLock = threading.Lock()
+        queue = Queue()
+        doneQueue = Queue()
+        stop = threading.Event()
+        closed = threading.Event()
+        lock = threading.Lock()
+        threads = [runShell(i, queue, lock, doneQueue, stop, self.logDir, self.console)
+                   for i in range(0, self.slots)]
+        for thread in threads:
+            thread.start()
+
+        def send(message):
+            try:
+                sendMessage(sock, sendLock, message)
+            except OSError:
+                pass
+
+        def heartbeat():
+            while not closed.wait(heartbeatInterval):
+                send({'type': 'heartbeat'})
+
+        def report():
+            while True:
+                item = doneQueue.get()
+                if item is None:
+                    break
+                send({'type': 'done', 'name': item[0], 'result': item[1]})
+
+        helpers = [threading.Thread(target = heartbeat), threading.Thread(target = report)]
+        for helper in helpers:
+            helper.start()
+        send({'type': 'hello', 'slots': self.slots, 'host': socket.gethostname()})
+        try:
+            for message in readMessages(sock):
+                if message['type'] == 'run':
+                    queue.put([message['name'], message['commands'], message['retries']])
+                elif message['type'] == 'steal':
+                    #只交出还没有线程取走的部分
+                    names = []
+                    for i in range(0, message['count']):
+                        try:
+                            names.append(queue.get_nowait()[0])
+                        except Empty:
+                            break
+                    send({'type': 'stolen', 'names': names})
+                elif message['type'] == 'cancel':
+                    stop.set()
+                    for thread in threads:
+                        thread.terminate()
+                elif message['type'] == 'exit':
+                    break
+        finally:
+            #连接断开时终止还在运行的命令
+            stop.set()
+            for thread in threads:
+                thread.terminate()
+                queue.put(None)
+            for thread in threads:
+                thread.join()
+            closed.set()
+            doneQueue.put(None)
+            for helper in helpers:
+                helper.join()
+            sock.close()
+
+def checkResult(result):
+    #工作进程发来的结果必须和runShell的结果格式相同
+    if not isinstance(result, dict) or result.get('status') not in ('ok', 'failed', 'cancelled'):
+        raise ValueError("bad result")
+    checked = {'status': result['status'], 'attempts': int(result['attempts']),
+               'time': float(result['time']), 'thread': int(result['thread'])}
+    returncode = result['returncode']
+    checked['returncode'] = None if returncode is None else int(returncode)
+    return checked
+
+def sendMessage(sock, lock, message):
+    data = (json.dumps(message) + "\n").encode('utf-8')
+    with lock:
+        sock.sendall(data)
+
+def readMessages(sock):
+    #每行一个JSON消息，连接断开或超时时结束
+    reader = sock.makefile('rb')
+    try:
+        for line in reader:
+            yield json.loads(line.decode('utf-8'))
+    except (OSError, ValueError):
+        pass
+    finally:
+        reader.close()
+
+#执行器：返回一组有start、join、terminate的线程，它们从ctrl.queue取出
+#[部分名, 命令列表, 重试次数]，运行后把(部分名, 结果)放入ctrl.doneQueue，取到None时结束
+def threadExecutor(ctrl):
+    lock = threading.Lock()
+    return [runShell(i, ctrl.queue, lock, ctrl.doneQueue, ctrl.stop,
+                     ctrl.logDir, ctrl.console) for i in range(0, ctrl.threadNum)]
+
+def asyncioExecutor(ctrl):
+    return [asyncShell(ctrl.threadNum, ctrl.queue, ctrl.doneQueue, ctrl.stop,
+                       ctrl.logDir, ctrl.console)]
+
+def remoteExecutor(ctrl, address = ('127.0.0.1', 7001), prefetch = 1):
+    return [remoteShell(address, ctrl.queue, ctrl.doneQueue, ctrl.stop, prefetch)]
+
+executors = {
+    'thread': threadExecutor,
+    'asyncio': asyncioExecutor,
+    'remote': remoteExecutor,
+}
+
+heartbeatInterval = 5.0
+heartbeatTimeout = 3 * heartbeatInterval
+
+def parseAddress(string, defaultHost = '127.0.0.1'):
+    #host:port、:port或port，省略host时只监听本机，其它网卡需要明确写出0.0.0.0等
+    host, _, port = string.rpartition(':')
+    if host == '':
+        host = defaultHost
+    return (host.strip('[]'), int(port))
+
+def parseMemory(string):
+    #字节数，可以加K、M、G、T
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+    string = string.strip().upper().rstrip('B')
+    if string[-1:] in units:
+        return int(float(string[:-1]) * units[string[-1]])
+    return int(string)
+
+def getPhysicalMemory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return 0
+
+def parseOptions(string):
+    #部分名后的选项，例如 [HERest 2] depends=HERest 1a,HERest 1b mem=2G retries=1
+    #inputs=和outputs=为逗号分隔的文件或通配符，用于-c的缓存
+    options = {'depends': [], 'memory': 0, 'retries': None,
+               'inputs': [], 'outputs': []}
+    for key, value in re.findall(r'(\w+)=((?:[^=\s]|\s(?!\s*\w+=))*)', string):
+        value = value.strip()
+        if key == 'depends':
+            options['depends'] = [dep.strip() for dep in value.split(',')
+                                  if dep.strip() != '']
+        elif key == 'mem':
+            options['memory'] = parseMemory(value)
+        elif key == 'retries':
+            options['retries'] = int(value)
+        elif key == 'inputs' or key == 'outputs':
+            options[key] = [path.strip() for path in value.split(',')
+                            if path.strip() != '']
+        else:
+            raise Exception("unknown option %s." % key)
+    return options
+
+def checkDependencies(conf):
+    #依赖的部分必须存在，且不能循环
+    for name in conf:
+        for dep in conf[name]['depends']:
+            if dep not in conf:
+                raise Exception("%s depends on unknown section %s." % (name, dep))
+    finished = set()
+    remaining = list(conf.keys())
+    while len(remaining) > 0:
+        ready = [name for name in remaining
+                 if all(dep in finished for dep in conf[name]['depends'])]
+        if len(ready) == 0:
+            raise Exception("circular dependency among %s." % ", ".join(remaining))
+        finished.update(ready)
+        remaining = [name for name in remaining if name not in finished]
 
 def parseConfig(content):
     lines = content.split("\n")
-    comp = re.compile(r'^\[.*?\]')
+    comp = re.compile(r'^\[(.*?)\](.*)$')
     nowId = ""
     commandList = {}
     for line in lines:
         line = line.strip()
-        if(comp.match(line)):
-            nowId = line.strip('[]')
-            commandList[nowId] = []
+        match = comp.match(line)
+        if(match):
+            nowId = match.group(1)
+            commandList[nowId] = parseOptions(match.group(2))
+            commandList[nowId]['commands'] = []
         elif(nowId != "" and line != ""):
-            commandList[nowId].append(line)
+            commandList[nowId]['commands'].append(line)
     return commandList
 
 def loadConfig(file):
@@ -125,19 +976,97 @@ def loadConfig(file):
     return parseConfig(content)
 
 if __name__ == "__main__":
-    if len(sys.argv) == 2:
-        confFile = sys.argv[1]
-    else:
-        print("usage: %s <config file>" % sys.argv[0])
-        exit(0)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('confFile', metavar = 'config', nargs = '?',
+                        help = 'sections of commands, [name] depends=a,b mem=2G')
+    parser.add_argument('-j', metavar = 'n', dest = 'jobs', type = int,
+                        default = None,
+                        help = 'number of sections run at the same time (default: '
+                        'number of CPUs, all ready sections with -e remote)')
+    parser.add_argument('-m', metavar = 'size', dest = 'memory', default = None,
+                        help = 'memory shared by the mem= of running sections '
+                        '(0 -> unlimited, default: physical memory)')
+    parser.add_argument('-r', metavar = 'n', dest = 'retries', type = int,
+                        default = 0,
+                        help = 'times a failed command is retried, unless retries= is given')
+    parser.add_argument('-k', dest = 'keepGoing', action = 'store_true',
+                        help = 'keep running the sections that do not depend on a '
+                        'failed one (default: stop at the first failure)')
+    parser.add_argument('-e', metavar = 'engine', dest = 'engine', default = 'thread',
+                        choices = sorted(executors.keys()),
+                        help = 'run sections in one thread each, all in one '
+                        'asyncio event loop, or on the workers started with -w')
+    parser.add_argument('-l', metavar = 'dir', dest = 'logDir', default = None,
+                        help = 'write the output of each section to dir/<section>.log')
+    parser.add_argument('-t', dest = 'tail', action = 'store_true',
+                        help = 'also print the output to the console when -l is given')
+    parser.add_argument('-c', metavar = 'file', dest = 'cacheFile', default = None,
+                        help = 'skip the sections with outputs= whose commands, inputs= '
+                        'and outputs= are unchanged since they last succeeded')
+    parser.add_argument('-T', dest = 'useMtime', action = 'store_true',
+                        help = 'compare files by size and modification time instead '
+                        'of content hash with -c')
+    parser.add_argument('-a', metavar = 'host:port', dest = 'address',
+                        default = '127.0.0.1:7001',
+                        help = 'address -e remote listens on for workers; give the '
+                        'host, e.g. 0.0.0.0:7001, to accept other machines (no '
+                        'authentication, use on a trusted network only)')
+    parser.add_argument('-P', metavar = 'n', dest = 'prefetch', type = int, default = 1,
+                        help = 'sections queued on a worker per slot besides the '
+                        'running ones, which idle workers may steal')
+    parser.add_argument('-w', metavar = 'host:port', dest = 'worker', default = None,
+                        help = 'run as a worker of parallel.py -e remote with -j '
+                        'slots instead of reading a config')
+    parser.add_argument('-o', dest = 'once', action = 'store_true',
+                        help = 'exit after one run instead of waiting for the next '
+                        'one with -w')
+    args = parser.parse_args()
+    confFile = args.confFile
+    if confFile is None and args.worker is None:
+        parser.error("config is required unless -w is given")
 
     global shellEncoding
     if platform.system() == "Windows":
         shellEncoding = "cp936"
     else:
         shellEncoding = "utf-8"
+    if args.worker is not None:
+        agent = workerAgent(parseAddress(args.worker, 'localhost'),
+                            args.jobs or cpu_count(), args.logDir,
+                            args.logDir is None or args.tail, args.once)
+        try:
+            agent.serve()
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
     commands = loadConfig(confFile)
-    threadNum = cpu_count()
-    threadPool = threadCtrl(threadNum, commands)
+    engine = args.engine
+    jobs = args.jobs or cpu_count()
+    if engine == 'remote':
+        #分配受工作进程的槽位数限制，本机内存与它们无关
+        address = parseAddress(args.address)
+        prefetch = args.prefetch
+        engine = lambda ctrl: remoteExecutor(ctrl, address, prefetch)
+        jobs = args.jobs or len(commands)
+        if args.memory is None:
+            args.memory = '0'
+    if args.memory is None:
+        memory = getPhysicalMemory()
+    else:
+        memory = parseMemory(args.memory)
+    cache = None
+    if args.cacheFile is not None:
+        cache = resultCache(args.cacheFile, args.useMtime)
+    threadNum = max(min(jobs, len(commands)), 1)
+    threadPool = threadCtrl(threadNum, commands, memory, args.retries,
+                            args.keepGoing, engine, args.logDir, args.tail,
+                            cache)
     threadPool.start()
-    threadPool.wait()
\ No newline at end of file
+    try:
+        threadPool.wait()
+    except KeyboardInterrupt:
+        threadPool.cancel()
+        threadPool.wait()
+    threadPool.printSummary()
+    if not threadPool.succeeded():
+        sys.exit(1)
\ No newline at end of file
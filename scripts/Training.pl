@@ -874,7 +874,7 @@ if ($MSPFD) {
       }
 
       # synthesize speech parameters using model alignment
-      shell("$PYTHON $datdir/scripts/DNNSynthesis.py -C $cfg{'sdn'} -S $scp{'tdn'} -H $dnnmodels -M $mspfdir/$gentype");
+      synthesize_dnn( $scp{'tdn'}, $dnnmodels, "$mspfdir/$gentype" );
       gen_param("$mspfdir/$gentype");
 
       # estimate statistics for modulation spectrum
@@ -903,7 +903,7 @@ if ($PGEND) {
       make_gen_data_dnn($dir);
 
       # generate parameter
-      shell("$PYTHON $datdir/scripts/DNNSynthesis.py -C $cfg{'sdn'} -S $scp{'sdn'} -H $dnnmodels -M $dir");
+      synthesize_dnn( $scp{'sdn'}, $dnnmodels, $dir );
 
       # generate smooth parameter sequence
       gen_param("$dir");
@@ -961,7 +961,7 @@ if ($MSPFT) {
       }
 
       # synthesize speech parameters using model alignment
-      shell("$PYTHON $datdir/scripts/DNNSynthesis.py -C $cfg{'sdn'} -S $scp{'tdn'} -H $dnnmodelsdir{'trj'} -M $mspfdir/$gentype");
+      synthesize_dnn( $scp{'tdn'}, $dnnmodelsdir{'trj'}, "$mspfdir/$gentype" );
       gen_param("$mspfdir/$gentype");
 
       # estimate statistics for modulation spectrum
@@ -990,7 +990,7 @@ if ($PGENT) {
       make_gen_data_dnn($dir);
 
       # generate parameter
-      shell("$PYTHON $datdir/scripts/DNNSynthesis.py -C $cfg{'sdn'} -S $scp{'sdn'} -H $dnnmodelsdir{'trj'} -M $dir");
+      synthesize_dnn( $scp{'sdn'}, $dnnmodelsdir{'trj'}, $dir );
 
       # generate smooth parameter sequence
       gen_param("$dir");
@@ -1634,6 +1634,24 @@ sub convert_state2phone {
    }
 }
 
+# sub routine for generating parameters by the DNN in a model directory
+sub synthesize_dnn($$$) {
+   my ( $script, $modeldir, $gendir ) = @_;
+
+   if ($useEngine) {
+      my $npz = ( $engineWeights eq 'float32' ) ? "$modeldir/model.npz" : "$modeldir/model.$engineWeights.npz";
+
+      # export the model again only if it was retrained
+      if ( !-e $npz || -M $npz > -M "$modeldir/checkpoint" ) {
+         shell("$PYTHON $datdir/scripts/DNNExport.py -C $cfg{'sdn'} -H $modeldir -q $engineWeights -o $npz");
+      }
+      shell("$PYTHON $datdir/scripts/DNNEngine.py -m $npz -S $script -M $gendir");
+   }
+   else {
+      shell("$PYTHON $datdir/scripts/DNNSynthesis.py -C $cfg{'sdn'} -S $script -H $modeldir -M $gendir");
+   }
+}
+
 sub convert_dur2lab($) {
    my ($gendir) = @_;
    my ( $line, @FILE, $file, $base, $s, $e, $model, $ct, $t, $p, @ary );
@@ -1952,6 +1970,9 @@ sub make_config_dnn {
    print CONF "batch_size: $batchSize\n";
    print CONF "num_epochs: $nEpoch\n";
    print CONF "num_threads: $nThread\n";
+   print CONF "num_workers: $nWorker\n";
+   print CONF "prefetch_depth: $nPrefetch\n";
+   print CONF "cache_size: $cacheSize\n";
    print CONF "random_seed: $randomSeed\n";
    print CONF "frame_by_frame: 1\n";
    print CONF "adaptation: 0\n";
@@ -1988,9 +2009,11 @@ sub make_config_dnn {
    print CONF "gv_weight: $dnnGVWeight\n";
    print CONF "keep_prob: $keepProb\n";
    print CONF "queue_size: $queueSize\n";
-   print CONF "batch_size: 1\n";
+   print CONF "batch_size: $trjBatchSize\n";
    print CONF "num_epochs: $nTrjEpoch\n";
    print CONF "num_threads: $nThread\n";
+   print CONF "num_workers: $nWorker\n";
+   print CONF "prefetch_depth: $nPrefetch\n";
    print CONF "random_seed: $randomSeed\n";
    print CONF "frame_by_frame: 0\n";
    print CONF "adaptation: 0\n";